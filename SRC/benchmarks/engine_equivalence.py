@@ -0,0 +1,364 @@
+import argparse
+import hashlib
+import json
+import logging
+import sys
+from collections import Counter
+from collections import namedtuple
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+import ezdxf as dx
+import numpy as np
+from networkx import Graph
+
+from dxf_reader.hospital_dxf import DXF
+from graph.extract_grid_from_dxf import get_grid
+from graph.extract_grid_from_dxf import mark_exterior
+from graph.graph_sparsifier import sparsify_graph
+from graph.grid_array import array_to_grid
+from graph.grid_array import grid_to_array
+from graph.grid_memmap import get_grid_via_memmap
+from graph.grid_memmap import mark_exterior_via_memmap
+from graph.grid_to_graph_converter import make_graph_from_grid
+from graph.parallel_raster import rasterize_grid_parallel
+from graph_to_svg.png_saver import GRID_PALETTE
+from graph_to_svg.png_saver import write_png
+from util.constants import SPARSITY_LEVEL
+from util.data_containers import SpaceType
+
+# Implementations of the pipeline stages, by stage and engine name:
+#   grid:     engine(dxf_info) -> grid (before mark_exterior)
+#   exterior: engine(grid) marks the exterior of grid in place, or returns
+#             the marked grid
+#   sparsify: engine(graph, sparsity_level) -> sparsified graph
+# Grids can be lists of lists or arrays of cell codes.
+ENGINES = {
+    "grid": {
+        "reference": get_grid,
+        "memmap": get_grid_via_memmap,
+        "parallel": rasterize_grid_parallel,
+    },
+    "exterior": {"reference": mark_exterior, "memmap": mark_exterior_via_memmap},
+    "sparsify": {"reference": sparsify_graph},
+}
+DIFF_TILE_SIZE = 32
+MAX_EXAMPLES = 10
+_CODE_NAMES = {
+    SpaceType.OPEN.value: "OPEN",
+    SpaceType.WALL.value: "WALL",
+    SpaceType.DOOR.value: "DOOR",
+    3: "OUTSIDE",
+}
+_DIFF_COLOR = (255, 0, 0)
+_MISSING_NODE_COLOR = (255, 0, 255)
+_EXTRA_NODE_COLOR = (0, 160, 0)
+_CHANGED_NODE_COLOR = (255, 140, 0)
+
+# node and edge keys mapped to the hashes of their attributes, and a digest
+# of the whole graph
+GraphFingerprint = namedtuple("GraphFingerprint", ["nodes", "edges", "digest"])
+GraphDiff = namedtuple("GraphDiff", [
+    "missing_nodes",
+    "extra_nodes",
+    "changed_nodes",
+    "missing_edges",
+    "extra_edges",
+    "changed_edges",
+])
+
+
+def register_engine(stage: str, name: str, engine: Callable):
+    """Makes an alternative implementation of a stage available to the
+    harness (see ENGINES for the signatures)."""
+    ENGINES[stage][name] = engine
+
+
+def _canonical_value(value):
+    if isinstance(value, SpaceType):
+        return value.name
+    if isinstance(value, float):
+        return repr(round(value, 9))
+    if isinstance(value, dict):
+        return {str(key): _canonical_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical_value(item) for item in value]
+    return value
+
+
+def _hash(value) -> str:
+    text = json.dumps(_canonical_value(value), sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def canonical_node_key(node) -> Tuple:
+    """A key of a node that does not depend on its type (Node or Node_4d)."""
+    return (
+        str(getattr(node, "building", "")),
+        str(getattr(node, "floor", "")),
+        int(node.x),
+        int(node.y),
+    )
+
+
+def graph_fingerprint(graph: Graph) -> GraphFingerprint:
+    """Hashes the attributes of every node and edge of a graph, and the
+    whole graph, independently of node and edge order.
+
+    :param graph: The graph to fingerprint.
+    :return: Its GraphFingerprint.
+    """
+    nodes = {
+        canonical_node_key(node): _hash(attributes)
+        for node, attributes in graph.nodes(data=True)
+    }
+    edges = {
+        tuple(sorted((canonical_node_key(u), canonical_node_key(v)))): _hash(attributes)
+        for u, v, attributes in graph.edges(data=True)
+    }
+    digest = hashlib.sha256()
+    for item in sorted(nodes.items()):
+        digest.update(repr(item).encode("utf-8"))
+    digest.update(b"edges")
+    for item in sorted(edges.items()):
+        digest.update(repr(item).encode("utf-8"))
+    return GraphFingerprint(nodes=nodes, edges=edges, digest=digest.hexdigest())
+
+
+def compare_graphs(reference: Graph, candidate: Graph) -> GraphDiff:
+    """Compares two graphs node by node and edge by edge, attributes
+    included.
+
+    :return: The GraphDiff, with canonical node keys and edge keys.
+    """
+    reference_print = graph_fingerprint(reference)
+    candidate_print = graph_fingerprint(candidate)
+
+    def diff(reference_items, candidate_items):
+        return (
+            sorted(set(reference_items) - set(candidate_items)),
+            sorted(set(candidate_items) - set(reference_items)),
+            sorted(
+                key for key in set(reference_items) & set(candidate_items)
+                if reference_items[key] != candidate_items[key]
+            ),
+        )
+
+    missing_nodes, extra_nodes, changed_nodes = diff(reference_print.nodes, candidate_print.nodes)
+    missing_edges, extra_edges, changed_edges = diff(reference_print.edges, candidate_print.edges)
+    return GraphDiff(
+        missing_nodes=missing_nodes,
+        extra_nodes=extra_nodes,
+        changed_nodes=changed_nodes,
+        missing_edges=missing_edges,
+        extra_edges=extra_edges,
+        changed_edges=changed_edges,
+    )
+
+
+def diff_tiles(points: List[Tuple[int, int]], tile_size: int=DIFF_TILE_SIZE) -> List[Dict]:
+    """Groups differences by square tiles of the grid, most different first.
+
+    :param points: The (x, y) grid positions of the differences.
+    :param tile_size: The size of the tiles in grid cells.
+    :return: A list of dicts with the bounds (min_x, min_y, max_x, max_y,
+             max excluded) and number of differences of every tile.
+    """
+    counts = Counter((int(x) // tile_size, int(y) // tile_size) for x, y in points)
+    return [
+        {
+            "bounds": [tx*tile_size, ty*tile_size, (tx+1)*tile_size, (ty+1)*tile_size],
+            "count": count,
+        }
+        for (tx, ty), count in counts.most_common()
+    ]
+
+
+def compare_grids(reference, candidate) -> Dict:
+    """Compares two grids cell by cell.
+
+    :param reference: The reference grid (list of lists or cell codes).
+    :param candidate: The grid to check.
+    :return: A report with the number of different cells, the number of
+             every (reference, candidate) cell type transition, the tiles
+             with differences and the different cells themselves (`cells`,
+             an array of (x, y) rows).
+    """
+    reference = grid_to_array(reference)
+    candidate = grid_to_array(candidate)
+    if reference.shape != candidate.shape:
+        return {
+            "equal": False,
+            "error": f"grid shapes differ: {reference.shape} vs {candidate.shape}",
+            "cells": np.zeros((0, 2), dtype=np.int64),
+        }
+    cells = np.argwhere(reference != candidate)
+    transitions = Counter(
+        f"{_CODE_NAMES.get(a, a)}->{_CODE_NAMES.get(b, b)}"
+        for a, b in zip(reference[cells[:, 0], cells[:, 1]].tolist(), candidate[cells[:, 0], cells[:, 1]].tolist())
+    )
+    return {
+        "equal": len(cells) == 0,
+        "cells_different": len(cells),
+        "transitions": dict(transitions),
+        "tiles": diff_tiles(cells.tolist()),
+        "cells": cells,
+    }
+
+
+def graph_diff_report(diff: GraphDiff) -> Dict:
+    """Summarizes a GraphDiff: counts, a few examples of every kind of
+    difference and the tiles the differences are in."""
+    points = [(key[2], key[3]) for key in diff.missing_nodes + diff.extra_nodes + diff.changed_nodes]
+    points += [
+        ((u[2] + v[2]) // 2, (u[3] + v[3]) // 2)
+        for u, v in diff.missing_edges + diff.extra_edges + diff.changed_edges
+    ]
+    report = {"equal": not points, "tiles": diff_tiles(points)}
+    for kind, keys in diff._asdict().items():
+        report[kind] = len(keys)
+        report[f"{kind}_examples"] = [list(key) for key in keys[:MAX_EXAMPLES]]
+    return report
+
+
+def write_diff_png(
+        grid,
+        outfile: str,
+        cells: np.ndarray=None,
+        diff: GraphDiff=None,
+        cell_pixels: int=2,
+):
+    """Draws the differences on top of a dimmed grid: different cells in
+    red, and nodes missing from, added by or changed by the candidate in
+    magenta, green and orange.
+
+    :param grid: The reference grid.
+    :param outfile: The png file to write.
+    :param cells: The different cells, as (x, y) rows.
+    :param diff: A GraphDiff to draw.
+    :param cell_pixels: The size of a grid cell in pixels.
+    """
+    image = GRID_PALETTE[grid_to_array(grid).T] // 2 + 127
+    if cells is not None and len(cells):
+        image[cells[:, 1], cells[:, 0]] = _DIFF_COLOR
+    if diff is not None:
+        for keys, color in (
+                (diff.missing_nodes, _MISSING_NODE_COLOR),
+                (diff.extra_nodes, _EXTRA_NODE_COLOR),
+                (diff.changed_nodes, _CHANGED_NODE_COLOR),
+        ):
+            for key in keys:
+                if 0 <= key[3] < image.shape[0] and 0 <= key[2] < image.shape[1]:
+                    image[key[3], key[2]] = color
+    image = np.repeat(np.repeat(image, cell_pixels, axis=0), cell_pixels, axis=1)
+    write_png(image.astype(np.uint8), outfile)
+
+
+def _run_exterior_engine(engine: Callable, grid):
+    grid = array_to_grid(grid_to_array(grid))
+    marked = engine(grid)
+    return grid if marked is None else marked
+
+
+def run_equivalence(
+        dxf_info: DXF,
+        grid_engine: str="reference",
+        exterior_engine: str="reference",
+        sparsify_engine: str="reference",
+        sparsity_level: int=SPARSITY_LEVEL,
+        diff_png_prefix: str=None,
+) -> Dict:
+    """Runs the reference pipeline and the chosen engines on the same floor
+    and compares the output of every stage. Each engine gets the reference
+    output of the previous stage as input, so that a difference is reported
+    at the stage that introduced it.
+
+    :param dxf_info: The floor to convert.
+    :param grid_engine: The name of the grid engine to check.
+    :param exterior_engine: The name of the exterior marking engine to check.
+    :param sparsify_engine: The name of the sparsification engine to check.
+    :param sparsity_level: The sparsity level of the sparsification.
+    :param diff_png_prefix: If given, a png of the differences of every
+           stage is written to `{diff_png_prefix}_{stage}.png`.
+    :return: A report with the comparison of every stage and `equal`, True
+             if all stages are equivalent.
+    """
+    report = {"engines": {"grid": grid_engine, "exterior": exterior_engine, "sparsify": sparsify_engine}}
+
+    reference_grid = get_grid(dxf_info)
+    reference_raw = grid_to_array(reference_grid)
+    if grid_engine != "reference":
+        report["grid"] = compare_grids(reference_raw, ENGINES["grid"][grid_engine](dxf_info))
+
+    mark_exterior(reference_grid)
+    if exterior_engine != "reference":
+        report["exterior"] = compare_grids(
+            reference_grid,
+            _run_exterior_engine(ENGINES["exterior"][exterior_engine], reference_raw),
+        )
+
+    if sparsify_engine != "reference":
+        graph = make_graph_from_grid(reference_grid, dxf_info.room_labels)
+        reference_graph = sparsify_graph(graph, sparsity_level)
+        diff = compare_graphs(
+            reference_graph,
+            ENGINES["sparsify"][sparsify_engine](graph, sparsity_level),
+        )
+        report["sparsify"] = graph_diff_report(diff)
+        if diff_png_prefix:
+            write_diff_png(reference_grid, f"{diff_png_prefix}_sparsify.png", diff=diff)
+
+    for stage in ("grid", "exterior"):
+        if stage in report:
+            cells = report[stage].pop("cells")
+            if diff_png_prefix and len(cells):
+                write_diff_png(
+                    reference_raw if stage == "grid" else reference_grid,
+                    f"{diff_png_prefix}_{stage}.png",
+                    cells=cells,
+                )
+    report["equal"] = all(
+        report[stage]["equal"] for stage in ("grid", "exterior", "sparsify") if stage in report
+    )
+    for stage in ("grid", "exterior", "sparsify"):
+        if stage in report:
+            logging.info(f"{stage}: {'equivalent' if report[stage]['equal'] else 'DIFFERENT'}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-fa', '--architecture_filename', type=str, required=True, help="path to input architecture file")
+    parser.add_argument('-fl', '--label_filename', type=str, help="path to input label file (defaults to the architecture file)")
+    parser.add_argument('-sz', '--step_size', type=int, help="Supply a step size")
+    parser.add_argument('--grid', type=str, default="reference", help="grid engine to check")
+    parser.add_argument('--exterior', type=str, default="reference", help="exterior marking engine to check")
+    parser.add_argument('--sparsify', type=str, default="reference", help="sparsification engine to check")
+    parser.add_argument('-o', '--outfile', type=str, default="equivalence_report.json", help="path to the json report")
+    parser.add_argument('--diff_png', type=str, help="prefix of png files showing the differences")
+    parser.add_argument('-v', '--verbose', action="store_true", help='turn verbose mode on')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    dxf_info = DXF(
+        floor_architecture=dx.readfile(args.architecture_filename),
+        floor_labels=dx.readfile(args.label_filename or args.architecture_filename),
+        step_size=args.step_size,
+    )
+    report = run_equivalence(
+        dxf_info,
+        grid_engine=args.grid,
+        exterior_engine=args.exterior,
+        sparsify_engine=args.sparsify,
+        diff_png_prefix=args.diff_png,
+    )
+    with open(args.outfile, "w") as outfile:
+        json.dump(report, outfile, indent=2)
+    if not report["equal"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
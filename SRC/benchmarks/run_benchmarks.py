@@ -0,0 +1,200 @@
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+from collections import defaultdict
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from benchmarks.synthetic_floor_plan import generate_floor_plan
+from dxf_to_graph_converter import extract_graph_from_dxf
+from graph.graph_utils import compute_neighborhood_cached
+
+# (floor area, number of rooms) of the synthetic floors
+DEFAULT_SIZES = (
+    (2.5e5, 6),
+    (5e5, 10),
+    (1e6, 20),
+    (2e6, 40),
+)
+REGRESSION_STAGES = ("get grid", "mark exterior", "sparsify graph")
+# the stage whose cell count is the size of a floor
+GRID_STAGE = "get grid"
+DEFAULT_TOLERANCE = 1.25
+
+
+def benchmark_floor(
+        floor_area: float,
+        num_rooms: int,
+        workdir: str,
+        repeats: int=1,
+        seed: int=0,
+) -> Dict:
+    """Converts one synthetic floor with tracing on, repeats times.
+
+    :param floor_area: The area of the synthetic floor.
+    :param num_rooms: The number of rooms of the synthetic floor.
+    :param workdir: The directory for the dxf and the outputs.
+    :param repeats: The number of conversions. The fastest time of every
+           stage is kept.
+    :param seed: The seed of the floor plan generator.
+    :return: A dict with the size, the item counts and the wall times of
+             every stage, both keyed by stage name.
+    """
+    name = f"floor_{int(floor_area)}_{num_rooms}"
+    dxf_filepath = os.path.join(workdir, f"{name}.dxf")
+    outfile = os.path.join(workdir, name)
+    generate_floor_plan(dxf_filepath, floor_area=floor_area, num_rooms=num_rooms, seed=seed)
+
+    walls = {}
+    counts = defaultdict(dict)
+    for _ in range(repeats):
+        compute_neighborhood_cached.cache_clear()
+        extract_graph_from_dxf(
+            architecture_filename=dxf_filepath,
+            label_filename=dxf_filepath,
+            outfile=outfile,
+            building_name="BENCHMARK",
+            trace=True,
+        )
+        with open(f"{outfile}.trace.json") as trace_file:
+            stages = json.load(trace_file)["stages"]
+        run_walls = defaultdict(float)
+        for stage in stages:
+            run_walls[stage["name"]] += stage["wall"]
+            counts[stage["name"]].update(stage["counts"])
+        for stage_name, wall in run_walls.items():
+            walls[stage_name] = min(wall, walls.get(stage_name, math.inf))
+
+    logging.info(f"{name}: {walls.get('extract graph from dxf', 0):.2f}s")
+    return {
+        "floor_area": floor_area,
+        "num_rooms": num_rooms,
+        "counts": dict(counts),
+        "stages": walls,
+    }
+
+
+def _cells(result: Dict) -> int:
+    return result["counts"].get(GRID_STAGE, {}).get("cells", 0)
+
+
+def scaling_exponents(results: List[Dict]) -> Dict[str, float]:
+    """Fits wall time ~ cells**k for every stage by least squares on a log
+    log scale, e.g. k=1 for linear stages and k=2 for quadratic ones.
+
+    :param results: The results of benchmark_floor for several sizes.
+    :return: A dict from stage names to their exponent k.
+    """
+    exponents = {}
+    stage_names = set.intersection(*(set(result["stages"]) for result in results)) if results else set()
+    for stage_name in sorted(stage_names):
+        points = [
+            (math.log(_cells(result)), math.log(result["stages"][stage_name]))
+            for result in results
+            if result["stages"][stage_name] > 0 and _cells(result)
+        ]
+        if len(points) < 2:
+            continue
+        mean_x = sum(x for x, _ in points) / len(points)
+        mean_y = sum(y for _, y in points) / len(points)
+        variance = sum((x - mean_x)**2 for x, _ in points)
+        if variance > 0:
+            exponents[stage_name] = sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+    return exponents
+
+
+def find_regressions(
+        report: Dict,
+        baseline: Dict,
+        stages: Tuple[str]=REGRESSION_STAGES,
+        tolerance: float=DEFAULT_TOLERANCE,
+) -> List[str]:
+    """Compares the stage times of a report with those of a baseline report
+    for the floors they have in common.
+
+    :return: A description of every stage that got slower than tolerance
+             times its baseline time.
+    """
+    baseline_results = {
+        (result["floor_area"], result["num_rooms"]): result
+        for result in baseline["results"]
+    }
+    regressions = []
+    for result in report["results"]:
+        baseline_result = baseline_results.get((result["floor_area"], result["num_rooms"]))
+        if baseline_result is None:
+            continue
+        for stage_name in stages:
+            wall = result["stages"].get(stage_name)
+            baseline_wall = baseline_result["stages"].get(stage_name)
+            if wall is not None and baseline_wall and wall > tolerance * baseline_wall:
+                regressions.append(
+                    f"{stage_name} on area {result['floor_area']:.0f}: "
+                    f"{wall:.3f}s vs {baseline_wall:.3f}s"
+                )
+    return regressions
+
+
+def run_benchmarks(
+        sizes: Tuple[Tuple[float, int]]=DEFAULT_SIZES,
+        repeats: int=1,
+        workdir: str=None,
+) -> Dict:
+    """Benchmarks the conversion pipeline on synthetic floors of increasing
+    size.
+
+    :param sizes: (floor area, number of rooms) of the floors.
+    :param repeats: The number of conversions per floor.
+    :param workdir: Where to keep the dxf files and outputs. A temporary
+           directory is used by default.
+    :return: A report with the results of every floor and the scaling
+             exponent of every stage.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        results = [
+            benchmark_floor(floor_area, num_rooms, workdir or tmpdir, repeats)
+            for floor_area, num_rooms in sizes
+        ]
+    return {
+        "results": results,
+        "scaling": scaling_exponents(results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--outfile', type=str, default="benchmark_report.json", help="path to the json report")
+    parser.add_argument('-s', '--size', type=str, action="append", metavar="AREA:ROOMS", help="floor area and number of rooms of a synthetic floor (repeatable)")
+    parser.add_argument('-n', '--repeats', type=int, default=1, help="conversions per floor, the fastest is kept")
+    parser.add_argument('-b', '--baseline', type=str, help="a previous report to check for regressions")
+    parser.add_argument('-t', '--tolerance', type=float, default=DEFAULT_TOLERANCE, help="slowdown factor reported as a regression")
+    parser.add_argument('-w', '--workdir', type=str, help="keep the generated files in this directory")
+    parser.add_argument('-v', '--verbose', action="store_true", help='turn verbose mode on')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    sizes = DEFAULT_SIZES
+    if args.size:
+        sizes = [(float(size.split(":")[0]), int(size.split(":")[1])) for size in args.size]
+    report = run_benchmarks(sizes, args.repeats, args.workdir)
+    with open(args.outfile, "w") as outfile:
+        json.dump(report, outfile, indent=2)
+
+    for stage_name, exponent in sorted(report["scaling"].items()):
+        print(f"{stage_name:40s} ~ cells^{exponent:.2f}")
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = find_regressions(report, json.load(baseline_file), tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
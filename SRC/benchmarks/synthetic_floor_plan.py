@@ -0,0 +1,151 @@
+import argparse
+import logging
+import math
+import random
+
+import ezdxf as dx
+from ezdxf.lldxf.types import DXFVertex
+
+DOOR_WIDTH = 36
+CORRIDOR_WIDTH = 96
+ROOM_TAG_BLOCK = "ROOMTAG"
+ROOM_TYPES = ("OFFICE", "EXAM", "STORAGE", "TOILET", "CONFERENCE")
+
+
+def _add_wall(modelspace, start, end, layer="ARWALL"):
+    modelspace.add_line(start, end, dxfattribs={"layer": layer})
+
+
+def _add_wall_with_door(modelspace, y, x_min, x_max, door_x, door_side):
+    """Adds a horizontal wall at y from x_min to x_max with a door opening
+    at door_x. The door leaf is drawn open, perpendicular to the wall, on
+    door_side (1 above, -1 below) with its swing arc."""
+    _add_wall(modelspace, (x_min, y), (door_x, y))
+    _add_wall(modelspace, (door_x + DOOR_WIDTH, y), (x_max, y))
+    modelspace.add_lwpolyline(
+        [(door_x, y), (door_x, y + door_side*DOOR_WIDTH)],
+        dxfattribs={"layer": "ARDOOR"},
+    )
+    start_angle, end_angle = (0, 90) if door_side > 0 else (270, 360)
+    modelspace.add_arc(
+        (door_x, y),
+        DOOR_WIDTH,
+        start_angle,
+        end_angle,
+        dxfattribs={"layer": "ARDOOR"},
+    )
+
+
+def _add_leader(modelspace, vertices, layer="ROOMNO"):
+    """Adds a LEADER through vertices. ezdxf 0.8.9 can read leaders but has
+    no add_leader, so the vertex tags of the entity are written directly."""
+    leader = modelspace.build_and_add_entity("LEADER", {"layer": layer, "n_vertices": len(vertices)})
+    tags = leader.AcDbLeader
+    index = next(index for index, tag in enumerate(tags) if tag.code == 10)
+    tags[index:index + 1] = [DXFVertex(10, (x, y, 0.0)) for x, y in vertices]
+    return leader
+
+
+def _add_room_label(modelspace, position, room_number, room_type, leader_from=None):
+    tag = modelspace.add_blockref(ROOM_TAG_BLOCK, position, dxfattribs={"layer": "ROOMNO"})
+    tag.add_attrib("RMNU", room_number, position)
+    tag.add_attrib("RMNAC", room_type, position)
+    if leader_from is not None:
+        # the reader moves labels from the last vertex of a leader to its first
+        _add_leader(modelspace, [position, leader_from])
+
+
+def generate_floor_plan(
+        outfile: str,
+        floor_area: float=1.5e6,
+        num_rooms: int=20,
+        leader_ratio: float=0.25,
+        seed: int=0,
+):
+    """Writes a synthetic floor plan in the layout of the hospital CAD files:
+    a rectangular floor (EXWALL) with a corridor along its length and rooms
+    on both sides (ARWALL), each with a door to the corridor (ARDOOR) and a
+    ROOMNO label block with RMNU and RMNAC attributes. Some labels are put
+    next to their room's door and pointed at the room with a leader.
+
+    Architecture and labels are written to the same file, which can be used
+    as both architecture_filename and label_filename.
+
+    :param outfile: The dxf file to write.
+    :param floor_area: The area of the floor in drawing units (inches).
+    :param num_rooms: The number of rooms.
+    :param leader_ratio: The fraction of labels placed with a leader. At
+           least one label always has a leader.
+    :param seed: The seed of the room widths and types.
+    """
+    rng = random.Random(seed)
+    width = math.sqrt(2 * floor_area)
+    height = floor_area / width
+    rooms_per_side = max(int(math.ceil(num_rooms / 2)), 1)
+    room_depth = (height - CORRIDOR_WIDTH) / 2
+    if width / rooms_per_side < 2 * DOOR_WIDTH or room_depth < 2 * DOOR_WIDTH:
+        raise ValueError(f"{num_rooms} rooms do not fit on a floor of area {floor_area}")
+
+    drawing = dx.new("R2000")
+    for layer in ("EXWALL", "ARWALL", "ARDOOR", "ROOMNO"):
+        drawing.layers.new(layer)
+    tag_block = drawing.blocks.new(name=ROOM_TAG_BLOCK)
+    tag_block.add_attdef("RMNU", (0, 0))
+    tag_block.add_attdef("RMNAC", (0, 0))
+    modelspace = drawing.modelspace()
+
+    corners = [(0, 0), (width, 0), (width, height), (0, height)]
+    for start, end in zip(corners, corners[1:] + corners[:1]):
+        _add_wall(modelspace, start, end, layer="EXWALL")
+
+    corridor_bottom = room_depth
+    corridor_top = room_depth + CORRIDOR_WIDTH
+    room_number = 100
+    num_leaders = 0
+    for side, wall_y, door_side in ((0, corridor_bottom, -1), (1, corridor_top, 1)):
+        rooms = min(rooms_per_side, num_rooms - side * rooms_per_side)
+        if rooms <= 0:
+            continue
+        # random room widths that add up to the floor width
+        shares = [rng.uniform(0.7, 1.3) for _ in range(rooms)]
+        edges = [0.0]
+        for share in shares:
+            edges.append(edges[-1] + width * share / sum(shares))
+        edges[-1] = width
+
+        wall_x = edges[0]
+        for left, right in zip(edges, edges[1:]):
+            door_x = rng.uniform(left + DOOR_WIDTH / 2, right - 1.5 * DOOR_WIDTH)
+            _add_wall_with_door(modelspace, wall_y, wall_x, right, door_x, door_side)
+            wall_x = right
+            if right < width:
+                far_y = 0 if side == 0 else height
+                _add_wall(modelspace, (right, wall_y), (right, far_y))
+
+            room_number += 1
+            center = ((left + right) / 2, wall_y + door_side * room_depth / 2)
+            if num_leaders == 0 or rng.random() < leader_ratio:
+                tag_position = (door_x + DOOR_WIDTH / 2, wall_y + door_side * DOOR_WIDTH / 2)
+                _add_room_label(modelspace, tag_position, str(room_number), rng.choice(ROOM_TYPES), center)
+                num_leaders += 1
+            else:
+                _add_room_label(modelspace, center, str(room_number), rng.choice(ROOM_TYPES))
+
+    drawing.saveas(outfile)
+    logging.info(f"{outfile}: {width:.0f}x{height:.0f}, {num_rooms} rooms, {num_leaders} leaders")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--outfile', type=str, required=True, help="path to the output dxf file")
+    parser.add_argument('-a', '--area', type=float, default=1.5e6, help="floor area in drawing units")
+    parser.add_argument('-r', '--rooms', type=int, default=20, help="number of rooms")
+    parser.add_argument('-s', '--seed', type=int, default=0, help="random seed")
+    parser.add_argument('-v', '--verbose', action="store_true", help='turn verbose mode on')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    generate_floor_plan(args.outfile, floor_area=args.area, num_rooms=args.rooms, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
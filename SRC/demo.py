@@ -18,8 +18,9 @@ from graph.grid_to_graph_converter import make_graph_from_grid
 from graph.graph_utils import collect_labelled_nodes, collect_stair_nodes, collect_elev_nodes
 from graph.labels_computer import propagate_labels
 from graph_to_svg.svg_saver import export_graph_overlay_on_cad
+from post_formatting.building_composer import compose_building_graph
+from post_formatting.graph_npz import write_graph_npz
 from post_formatting.graph_serializer import make_4d_nodes
-from util.constants import GRID_RATIO
 from util.constants import MIN_COMPONENT_SIZE
 from util.constants import SPARSITY_LEVEL
 from networkx import shortest_path
@@ -66,6 +67,7 @@ for i in floors:
     large_components_graph = remove_small_components(
         sparsified_graph,
         minsize=MIN_COMPONENT_SIZE,
+        copy=False,
     )
     
     # dis_dic = collect_path_len_bw_labeled_nodes(large_components_graph)
@@ -94,10 +96,11 @@ for i in floors:
             
     propagate_labels(large_components_graph)
     
-    large_components_graph = remove_components_without_labels(large_components_graph)
-    graphs_each_floor.append(large_components_graph)
+    large_components_graph = remove_components_without_labels(large_components_graph, copy=False)
+    graphs_each_floor.append((i, large_components_graph))
     
     nx.write_edgelist(large_components_graph, "../Results/"+prefix+str(i)+"_edgelist.txt", data=["type", "weight2"])
+    write_graph_npz(large_components_graph, "../Results/"+prefix+str(i)+"_graph.npz")
     
     print("edge list")
     node_dic = {}
@@ -113,7 +116,7 @@ for i in floors:
     export_graph_overlay_on_cad(
     dxf_info,
     large_components_graph,
-    int(dxf_info.step_size/GRID_RATIO),
+    dxf_info.grid_size,
     dxf_info.new_canvas_dimensions,
     "../Results/graph"+str(i)+prefix+".svg"
     )
@@ -125,6 +128,9 @@ for i in floors:
 json.dump(stairs, open("../Results/stairs_"+prefix+".json", 'w'))
 json.dump(elevs, open("../Results/elevs_"+prefix+".json", 'w'))
 
+building_graph = compose_building_graph(graphs_each_floor, building)
+write_graph_npz(building_graph, "../Results/"+prefix+"_building.npz")
+
     
 
 ####from util.data_containers import Node_4d
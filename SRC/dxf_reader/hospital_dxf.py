@@ -10,19 +10,29 @@ from dxf_reader.dxf_utils import is_relevant_layer
 from dxf_reader.step_size_estimation import get_arcs, get_polylines
 from util.constants import DEFAULT_WALL_LAYERS, DEFAULT_DOOR_LAYERS, DEFAULT_LABEL_LAYERS, GRID_RATIO
 from util.data_containers import Point, RoomInfo
+from util.stage_tracer import trace_stage
 
 import math
 
 class DXF:
 
-    def __init__(self, floor_architecture: Drawing, floor_labels: Drawing, step_size: int=None):
+    def __init__(
+            self,
+            floor_architecture: Drawing,
+            floor_labels: Drawing,
+            step_size: int=None,
+            grid_ratio: float=GRID_RATIO,
+    ):
         self.floor_architecture = floor_architecture
         self.floor_labels = floor_labels
+        self.grid_ratio = grid_ratio
         
-        self.step_size = step_size if step_size else self.get_step_size()
+        with trace_stage("step size"):
+            self.step_size = step_size if step_size else self.get_step_size()
         print("step_size", self.step_size)
         
-        canvas_limits, offsets = get_canvas_size(floor_architecture, DEFAULT_WALL_LAYERS)
+        with trace_stage("canvas size"):
+            canvas_limits, offsets = get_canvas_size(floor_architecture, DEFAULT_WALL_LAYERS)
         
         self.offsets = offsets
         self.new_canvas_dimensions = [
@@ -30,11 +40,28 @@ class DXF:
             canvas_limits[1]-self.offsets[1],
         ]
         
-        self.walls = self.get_walls()
-        self.doors = self.get_doors()
-        self.room_labels = self.get_all_roomlabels()
+        with trace_stage("walls") as counts:
+            self.walls = self.get_walls()
+            counts["walls"] = len(self.walls)
+        with trace_stage("doors") as counts:
+            self.doors = self.get_doors()
+            counts["doors"] = len(self.doors)
+        with trace_stage("room labels") as counts:
+            self.room_labels = self.get_all_roomlabels()
+            counts["room_labels"] = len(self.room_labels)
         logging.info(f"step_size {self.step_size}")
 
+    @property
+    def grid_size(self) -> int:
+        """The size of a grid cell, step_size/grid_ratio."""
+        return int(self.step_size/self.grid_ratio)
+
+    def set_grid_ratio(self, grid_ratio: float):
+        """Changes the resolution of the grid, and recomputes the room label
+        positions, which are in grid cells."""
+        self.grid_ratio = grid_ratio
+        self.room_labels = self.get_all_roomlabels()
+
     def get_walls(self):
         walls = get_shapely_objects_from_relevant_layers(
             dxf=self.floor_architecture,
@@ -80,13 +107,13 @@ class DXF:
             if is_relevant_layer(entity.dxf.layer, DEFAULT_LABEL_LAYERS) and entity.dxftype() == "LEADER":
                 leader_vertices = [x for x in entity.get_vertices()]
                 leader_start = Point(
-                    x=int((leader_vertices[-1][0]-self.offsets[0])/int(self.step_size/GRID_RATIO)),
-                    y=int((leader_vertices[-1][1]-self.offsets[1])/int(self.step_size/GRID_RATIO)),
+                    x=int((leader_vertices[-1][0]-self.offsets[0])/self.grid_size),
+                    y=int((leader_vertices[-1][1]-self.offsets[1])/self.grid_size),
                 )
 
                 leader_end = Point(
-                    x=int((leader_vertices[0][0]-self.offsets[0])/int(self.step_size/GRID_RATIO)),
-                    y=int((leader_vertices[0][1]-self.offsets[1])/int(self.step_size/GRID_RATIO)),
+                    x=int((leader_vertices[0][0]-self.offsets[0])/self.grid_size),
+                    y=int((leader_vertices[0][1]-self.offsets[1])/self.grid_size),
                 )
                 leader_positions.append((leader_start, leader_end))
 
@@ -94,8 +121,8 @@ class DXF:
             if is_relevant_layer(entity.dxf.layer, DEFAULT_LABEL_LAYERS) and entity.dxftype() == "INSERT":
                 # these are room labels
                 label_pos = Point(
-                    x=int((entity.dxf.insert[0]-self.offsets[0])/int(self.step_size/GRID_RATIO)),
-                    y=int((entity.dxf.insert[1]-self.offsets[1])/int(self.step_size/GRID_RATIO)),
+                    x=int((entity.dxf.insert[0]-self.offsets[0])/self.grid_size),
+                    y=int((entity.dxf.insert[1]-self.offsets[1])/self.grid_size),
                 )
                 prev_label_pos = label_pos
                 label_pos = move_label_if_leader_found(label_pos, leader_positions)
@@ -1,21 +1,54 @@
 import argparse
+import json
 import logging
+import sys
 
 import ezdxf as dx
 from networkx import write_yaml
 
 from dxf_reader.hospital_dxf import DXF
 from graph.extract_grid_from_dxf import get_grid
+from graph.extract_grid_from_dxf import grid_shape
 from graph.extract_grid_from_dxf import mark_exterior
 from graph.graph_sparsifier import remove_small_components
 from graph.graph_sparsifier import sparsify_graph
+from graph.grid_array import grid_to_array
+from graph.grid_array import unmark_exterior
+from graph.grid_memmap import DEFAULT_BAND_ROWS
+from graph.grid_memmap import MemmapGrid
+from graph.grid_memmap import make_graph_from_grid_memmap
+from graph.grid_memmap import mark_exterior_memmap
+from graph.grid_memmap import rasterize_grid_memmap
+from graph.grid_resolution import choose_grid_ratio
+from graph.grid_resolution import scaled_sparsity_level
+from graph.grid_snapshot import write_grid_snapshot
 from graph.grid_to_graph_converter import make_graph_from_grid
+from graph.incremental_conversion import copy_room_labels
+from graph.incremental_conversion import floor_cache_filepath
+from graph.incremental_conversion import is_cache_compatible
+from graph.incremental_conversion import make_floor_cache
+from graph.incremental_conversion import read_floor_cache
+from graph.incremental_conversion import update_floor_graph
+from graph.incremental_conversion import write_floor_cache
 from graph.labels_computer import propagate_labels
+from graph.parallel_raster import get_grid_parallel
+from graph.quadtree_grid import make_graph_from_quadtree
+from graph.resource_planner import ResourceBudget
+from graph.resource_planner import ResourceBudgetExceeded
+from graph.resource_planner import check_budget
+from graph.resource_planner import plan_conversion
+from graph.skeleton_graph import make_skeleton_graph
+from graph_to_svg.png_saver import export_graph_overlay_png
 from graph_to_svg.svg_saver import export_graph_overlay_on_cad
+from graph_to_svg.svg_tiles import export_tiled_graph_overlay
+from post_formatting.graph_npz import write_graph_npz
 from post_formatting.graph_serializer import make_4d_nodes
-from util.constants import GRID_RATIO
 from util.constants import MIN_COMPONENT_SIZE
+from util.constants import MIN_SKELETON_COMPONENT_SIZE
 from util.constants import SPARSITY_LEVEL
+from util.stage_tracer import StageTracer
+from util.stage_tracer import active_tracer
+from util.stage_tracer import trace_stage
 
 def show_all_entity_types(drawing_obj):
     a_set = set()
@@ -26,49 +59,277 @@ def show_all_entity_types(drawing_obj):
         print(a)
 
 
-def extract_graph_from_dxf(architecture_filename, label_filename, outfile, building_name, step_size=None):
+def extract_graph_from_dxf(
+        architecture_filename,
+        label_filename,
+        outfile,
+        building_name,
+        step_size=None,
+        compress_svg=False,
+        tiled_svg=False,
+        png=False,
+        incremental=False,
+        trace=False,
+        trace_memory=False,
+        dry_run=False,
+        budget=ResourceBudget(),
+        auto_resolution=False,
+        quadtree=False,
+        skeleton=False,
+        out_of_core=False,
+        grid_snapshot=False,
+        raster_workers=None,
+):
     """Converts an architecture CAD file into a graph with nodes and edges, then
     saves this graph as an SVG. Handles inputs in .dxf format only.
 
     :param architecture_filename: Name of the dxf file with walls, and doors.
     :param label_filename: Name of the dxf file with label information (This
            can be the same as architecture_filename)
-    :param outfile: Name of the output svg file. This file will have the
-           computed graph overlayed on the floor plan.
-    :return: a graph representation of the CAD file.
+    :param outfile: Name of the output files (without extension). The svg
+           file will have the computed graph overlayed on the floor plan, and
+           the graph itself is saved as both .yaml and .npz.
+    :param compress_svg: If True, the svg is gzip compressed (.svgz).
+    :param tiled_svg: If True, the overlay is also exported as zoomable svg
+           tiles in the directory `{outfile}_tiles`.
+    :param png: If True, the graph on the occupancy grid is also saved as
+           `{outfile}.png`.
+    :param incremental: If True, the conversion is cached in
+           `{outfile}.cache.pkl`, and if a cache of a previous version of the
+           floor exists, only the parts of the graph near the walls, doors
+           and labels that changed are recomputed.
+    :param trace: If True, the wall time, cpu time, peak memory and item
+           counts of every stage are saved as `{outfile}.trace.json` and as
+           a Chrome trace, `{outfile}.chrome_trace.json`.
+    :param trace_memory: If True, the traces also include the peak memory
+           allocated by python in every stage (slow).
+    :param dry_run: If True, only the dxf files are read and the plan of
+           the conversion (grid size, estimated graph sizes, memory and time
+           of every stage) is returned, nothing is written.
+    :param budget: The memory, cells and time the conversion may use. The
+           conversion raises ResourceBudgetExceeded before building the grid
+           if it would not fit with the chosen quadtree, skeleton and
+           out_of_core modes, or rasterizes the grid in bands if that is
+           enough to make it fit.
+    :param auto_resolution: If True, the coarsest grid that still connects
+           the rooms and doors like the default grid is used, with the
+           sparsity level scaled to keep the nodes of the graph as far
+           apart. The grids compared are rasterized like the conversion's
+           (tiled, out of core or by raster_workers) and the chosen one is
+           used as is.
+    :param quadtree: If True, the graph that is sparsified has a node per
+           leaf of a quadtree of the grid instead of a node per cell, which
+           is much smaller for floors with large open areas. Incremental
+           conversions need the graph of every cell, so this cannot be
+           combined with incremental.
+    :param skeleton: If True, the sparse graph is built from the skeleton
+           of the open space of the grid instead of by sparsifying the
+           graph of its cells, which is much faster. Its components are
+           pruned with MIN_SKELETON_COMPONENT_SIZE, as it has far fewer
+           nodes. Cannot be combined with incremental or quadtree.
+    :param out_of_core: If True, the grid is kept in the file
+           `{outfile}.grid` while it is rasterized, its exterior marked and
+           the graph of its cells built, a band of rows at a time, so huge
+           floors do not need the whole grid in memory. Cannot be combined
+           with incremental.
+    :param grid_snapshot: If True, the grid after mark_exterior is saved
+           with the room labels and grid geometry as `{outfile}.grid.npz`
+           (see write_grid_snapshot), from which the graph can be built
+           again without the dxf files.
+    :param raster_workers: If given, the walls and doors are rasterized by
+           this many threads, a band of rows each (see
+           rasterize_grid_parallel). The bands of a tiled plan are split
+           between the threads. Cannot be combined with out_of_core.
+    :return: The plan of the conversion if dry_run is True.
     """
-    floor_architecture = dx.readfile(architecture_filename)
-    floor_labels = dx.readfile(label_filename)
-    dxf_info = DXF(
-        floor_architecture=floor_architecture,
-        floor_labels=floor_labels,
-        step_size=step_size,
-    )
+    if (quadtree or skeleton) and incremental:
+        raise ValueError("incremental conversions do not support quadtree or skeleton graphs")
+    if out_of_core and incremental:
+        raise ValueError("incremental conversions keep their grids in memory")
+    if out_of_core and raster_workers is not None:
+        raise ValueError("out of core grids are rasterized a band at a time")
+    if quadtree and skeleton:
+        raise ValueError("skeleton graphs are not built from quadtrees")
+    tracer = StageTracer(outfile, trace_memory=trace_memory) if trace else None
+    grid_file = None
+    try:
+        with active_tracer(tracer), trace_stage("extract graph from dxf"):
+            with trace_stage("read dxf"):
+                floor_architecture = dx.readfile(architecture_filename)
+                floor_labels = dx.readfile(label_filename)
+            with trace_stage("dxf features"):
+                dxf_info = DXF(
+                    floor_architecture=floor_architecture,
+                    floor_labels=floor_labels,
+                    step_size=step_size,
+                )
+            plan = plan_conversion(
+                dxf_info,
+                budget,
+                SPARSITY_LEVEL,
+                out_of_core=out_of_core,
+                quadtree=quadtree,
+                skeleton=skeleton,
+            )
+            if dry_run:
+                return plan
+            check_budget(plan)
+            sparsity_level = SPARSITY_LEVEL
+            resolution = None
+            if auto_resolution:
+                with trace_stage("choose grid resolution") as counts:
+                    resolution = choose_grid_ratio(
+                        dxf_info,
+                        tile_rows=plan.tile_rows,
+                        raster_workers=raster_workers,
+                        grid_filepath=f"{outfile}.grid" if out_of_core else None,
+                    )
+                    if out_of_core:
+                        grid_file = resolution.grid
+                    sparsity_level = scaled_sparsity_level(resolution.grid_ratio)
+                    rows, columns = grid_shape(dxf_info)
+                    counts["cells"] = rows * columns
+                    counts["grid_ratio"] = resolution.grid_ratio
+                    counts["nodes_saved"] = resolution.nodes_saved
+                logging.info(
+                    f"grid ratio {resolution.grid_ratio} saves {resolution.nodes_saved} "
+                    f"of {resolution.reference_nodes} nodes"
+                )
 
-    grid = get_grid(dxf_info)
-    mark_exterior(grid)
+            cache_filepath = floor_cache_filepath(outfile)
+            cache = read_floor_cache(cache_filepath) if incremental else None
+            if cache is not None and is_cache_compatible(cache, dxf_info):
+                logging.info(f"updating {outfile} from {cache_filepath}")
+                with trace_stage("incremental update") as counts:
+                    raw_grid, grid, sparsified_graph, room_labels = update_floor_graph(
+                        cache,
+                        dxf_info,
+                        sparsity_level,
+                    )
+                    counts["nodes"] = sparsified_graph.number_of_nodes()
+                if grid_snapshot:
+                    with trace_stage("write grid snapshot"):
+                        write_grid_snapshot(grid, dxf_info, f"{outfile}.grid.npz", room_labels)
+            else:
+                if resolution is not None:
+                    # the grid resolution was chosen from grids rasterized
+                    # the same way, the chosen grid is already marked
+                    grid = grid_file.array() if out_of_core else resolution.grid
+                    # mark_exterior only marks open cells
+                    raw_grid = unmark_exterior(grid) if incremental else None
+                elif out_of_core:
+                    grid_file = MemmapGrid.create(
+                        f"{outfile}.grid",
+                        grid_shape(dxf_info),
+                        plan.tile_rows or DEFAULT_BAND_ROWS,
+                    )
+                    with trace_stage("get grid") as counts:
+                        rasterize_grid_memmap(dxf_info, grid_file)
+                        counts["cells"] = grid_file.shape[0] * grid_file.shape[1]
+                    with trace_stage("mark exterior"):
+                        mark_exterior_memmap(grid_file)
+                    grid = grid_file.array()
+                else:
+                    with trace_stage("get grid") as counts:
+                        if raster_workers is not None:
+                            grid = get_grid_parallel(
+                                dxf_info,
+                                workers=raster_workers,
+                                max_band_rows=plan.tile_rows,
+                            )
+                        else:
+                            grid = get_grid(dxf_info, tile_rows=plan.tile_rows)
+                        counts["cells"] = len(grid) * len(grid[0])
+                    raw_grid = grid_to_array(grid) if incremental else None
+                    with trace_stage("mark exterior"):
+                        mark_exterior(grid)
+                if grid_snapshot:
+                    with trace_stage("write grid snapshot"):
+                        write_grid_snapshot(grid, dxf_info, f"{outfile}.grid.npz")
 
-    graph = make_graph_from_grid(grid, dxf_info.room_labels)
-    logging.info("edges added")
-    sparsified_graph = sparsify_graph(graph, SPARSITY_LEVEL)
-    logging.info("graph_sparsified")
-    large_components_graph = remove_small_components(
-        sparsified_graph,
-        minsize=MIN_COMPONENT_SIZE,
-    )
-    propagate_labels(large_components_graph)
+                room_labels = copy_room_labels(dxf_info.room_labels) if incremental else None
+                if skeleton:
+                    with trace_stage("skeleton graph") as counts:
+                        sparsified_graph = make_skeleton_graph(grid, dxf_info.room_labels, sparsity_level)
+                        counts["nodes"] = sparsified_graph.number_of_nodes()
+                        counts["edges"] = sparsified_graph.number_of_edges()
+                else:
+                    with trace_stage("make graph from grid") as counts:
+                        if quadtree:
+                            graph = make_graph_from_quadtree(grid, dxf_info.room_labels)
+                        elif grid_file is not None:
+                            graph = make_graph_from_grid_memmap(grid_file, dxf_info.room_labels)
+                        else:
+                            graph = make_graph_from_grid(grid, dxf_info.room_labels)
+                        counts["nodes"] = graph.number_of_nodes()
+                        counts["edges"] = graph.number_of_edges()
+                    logging.info("edges added")
+                    with trace_stage("sparsify graph") as counts:
+                        sparsified_graph = sparsify_graph(graph, sparsity_level)
+                        counts["nodes"] = sparsified_graph.number_of_nodes()
+                        counts["edges"] = sparsified_graph.number_of_edges()
+            logging.info("graph_sparsified")
+            if incremental:
+                with trace_stage("write floor cache"):
+                    write_floor_cache(
+                        make_floor_cache(dxf_info, raw_grid, grid_to_array(grid), sparsified_graph, room_labels),
+                        cache_filepath,
+                    )
+            with trace_stage("remove small components") as counts:
+                had_nodes = sparsified_graph.number_of_nodes() > 0
+                minsize = MIN_SKELETON_COMPONENT_SIZE if skeleton else MIN_COMPONENT_SIZE
+                large_components_graph = remove_small_components(
+                    sparsified_graph,
+                    minsize=minsize,
+                    copy=False,
+                )
+                counts["nodes"] = large_components_graph.number_of_nodes()
+            if had_nodes and large_components_graph.number_of_nodes() == 0:
+                logging.warning(f"{outfile}: every component has fewer than {minsize} nodes, the graph is empty")
+            with trace_stage("propagate labels"):
+                propagate_labels(large_components_graph)
 
-    export_graph_overlay_on_cad(
-        dxf_info,
-        large_components_graph,
-        int(dxf_info.step_size/GRID_RATIO),
-        dxf_info.new_canvas_dimensions,
-        f"{outfile}.svg"
-    )
+            with trace_stage("export svg"):
+                export_graph_overlay_on_cad(
+                    dxf_info,
+                    large_components_graph,
+                    dxf_info.grid_size,
+                    dxf_info.new_canvas_dimensions,
+                    f"{outfile}.svgz" if compress_svg else f"{outfile}.svg",
+                )
+            if png:
+                with trace_stage("export png"):
+                    export_graph_overlay_png(grid, large_components_graph, f"{outfile}.png")
+            if tiled_svg:
+                with trace_stage("export svg tiles"):
+                    export_tiled_graph_overlay(
+                        dxf_info,
+                        large_components_graph,
+                        dxf_info.grid_size,
+                        dxf_info.new_canvas_dimensions,
+                        f"{outfile}_tiles",
+                        compress=compress_svg,
+                    )
 
-    graph_4d = make_4d_nodes(large_components_graph, floor=outfile.split("/")[-1], building=building_name)
-    write_yaml(graph_4d, f"{outfile}.yaml")
-    logging.info(f"{outfile} created")
+            with trace_stage("write graph"):
+                graph_4d = make_4d_nodes(
+                    large_components_graph,
+                    floor=outfile.split("/")[-1],
+                    building=building_name,
+                    copy=False,
+                )
+                write_yaml(graph_4d, f"{outfile}.yaml")
+                write_graph_npz(graph_4d, f"{outfile}.npz")
+        logging.info(f"{outfile} created")
+    finally:
+        # the grid of an out of core conversion is only a working file
+        if grid_file is not None:
+            grid = None
+            grid_file.remove()
+        # the trace of a failed conversion shows the stage it failed in
+        if tracer is not None:
+            tracer.write_json(f"{outfile}.trace.json")
+            tracer.write_chrome_trace(f"{outfile}.chrome_trace.json")
 
 
 def main():
@@ -80,19 +341,59 @@ def main():
     parser.add_argument('-vv', '--very_verbose', action="store_true", help='turn debug mode on')
     parser.add_argument('-sz', '--step_size', type=int, help="Supply a step size")
     parser.add_argument('-bl', '--building_name', type=str, default="RCARLL", help="The name of the building for this CAD file")
+    parser.add_argument('--svgz', action="store_true", help="write the svg overlay gzip compressed")
+    parser.add_argument('--tiles', action="store_true", help="also write the svg overlay as zoomable tiles")
+    parser.add_argument('--png', action="store_true", help="also write a png of the graph on the occupancy grid")
+    parser.add_argument('--trace', action="store_true", help="write per stage timing and memory reports")
+    parser.add_argument('--trace_memory', action="store_true", help="also trace python memory allocations per stage (slow)")
+    parser.add_argument('--dry_run', action="store_true", help="only print the grid size and the estimated memory and time of the conversion")
+    parser.add_argument('--max_memory', type=float, help="memory budget in MB, the conversion aborts or rasterizes the grid in bands to stay below it")
+    parser.add_argument('--max_cells', type=int, help="abort if the grid would have more cells")
+    parser.add_argument('--max_seconds', type=float, help="abort if the conversion is estimated to take longer")
+    parser.add_argument('--auto_resolution', action="store_true", help="use the coarsest grid that keeps every door passable and every room connected")
+    parser.add_argument('--quadtree', action="store_true", help="merge large open areas of the grid into quadtree leaves before sparsifying")
+    parser.add_argument('--skeleton', action="store_true", help="build the sparse graph from the skeleton of the open space instead of sparsifying the grid graph")
+    parser.add_argument('--out_of_core', action="store_true", help="keep the grid in a file and process it in bands of rows instead of in memory")
+    parser.add_argument('--grid_snapshot', action="store_true", help="also save the grid after marking its exterior as a compact .grid.npz snapshot")
+    parser.add_argument('--raster_workers', type=int, help="rasterize the walls and doors with this many threads")
+    parser.add_argument('--incremental', action="store_true", help="cache the conversion and only recompute what changed since the cached version")
     args = parser.parse_args()
     if args.verbose:
         logging.basicConfig(level=logging.INFO)
     if args.very_verbose:
         logging.basicConfig(level=logging.DEBUG)
 
-    extract_graph_from_dxf(
-        architecture_filename=args.architecture_filename,
-        label_filename=args.label_filename,
-        outfile=args.outfile,
-        step_size=args.step_size,
-        building_name=args.building_name,
-    )
+    try:
+        plan = extract_graph_from_dxf(
+            architecture_filename=args.architecture_filename,
+            label_filename=args.label_filename,
+            outfile=args.outfile,
+            step_size=args.step_size,
+            building_name=args.building_name,
+            compress_svg=args.svgz,
+            tiled_svg=args.tiles,
+            png=args.png,
+            incremental=args.incremental,
+            trace=args.trace or args.trace_memory,
+            trace_memory=args.trace_memory,
+            dry_run=args.dry_run,
+            auto_resolution=args.auto_resolution,
+            quadtree=args.quadtree,
+            skeleton=args.skeleton,
+            out_of_core=args.out_of_core,
+            grid_snapshot=args.grid_snapshot,
+            raster_workers=args.raster_workers,
+            budget=ResourceBudget(
+                max_memory=args.max_memory * 2**20 if args.max_memory else None,
+                max_cells=args.max_cells,
+                max_seconds=args.max_seconds,
+            ),
+        )
+    except ResourceBudgetExceeded as error:
+        logging.error(f"{error}\n{json.dumps(error.plan._asdict(), indent=2)}")
+        sys.exit(1)
+    if args.dry_run:
+        print(json.dumps(plan._asdict(), indent=2))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,109 @@
+import logging
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+from typing import Tuple
+
+import numpy as np
+from networkx import Graph
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from graph.room_label_index import get_room_label_index
+
+DISTANCE_WEIGHTS = ("weight", "weight2")
+SOURCES_PER_TASK = 64
+
+# `nodes` are the labelled nodes, `labels` their room labels and
+# `distances[w][i, j]` the shortest path length from nodes[i] to nodes[j]
+# under weight DISTANCE_WEIGHTS[w] (inf if unreachable).
+LabelledDistances = namedtuple("LabelledDistances", ["nodes", "labels", "weights", "distances"])
+
+
+def graph_to_csr(graph: Graph, weight: str, nodes: List=None) -> Tuple[csr_matrix, List]:
+    """Exports a graph as a symmetric scipy CSR matrix. As in networkx,
+    edges without the weight attribute have weight 1.
+
+    :param graph: The graph to export.
+    :param weight: The edge attribute to use as weight.
+    :param nodes: The node order of the matrix. Defaults to graph order.
+    :return: The CSR matrix and its node order.
+    """
+    nodes = list(graph.nodes) if nodes is None else nodes
+    node_ids = {node: i for i, node in enumerate(nodes)}
+    rows, cols, weights = [], [], []
+    for u, v, edge_weight in graph.edges(data=weight, default=1):
+        if u == v:
+            continue
+        rows.append(node_ids[u])
+        cols.append(node_ids[v])
+        weights.append(edge_weight)
+    rows, cols = np.array(rows + cols, dtype=np.int32), np.array(cols + rows, dtype=np.int32)
+    weights = np.array(weights + weights, dtype=np.float64)
+    matrix = csr_matrix((weights, (rows, cols)), shape=(len(nodes), len(nodes)))
+    return matrix, nodes
+
+
+_worker_matrices = None
+
+
+def _init_worker(matrices):
+    global _worker_matrices
+    _worker_matrices = matrices
+
+
+def _distances_from_sources(task):
+    weight_id, _, sources, targets = task
+    return dijkstra(_worker_matrices[weight_id], directed=True, indices=sources)[:, targets]
+
+
+def compute_labelled_distances(
+        graph: Graph,
+        weights: Tuple[str]=DISTANCE_WEIGHTS,
+        processes: int=None,
+        dtype=np.float32,
+) -> LabelledDistances:
+    """Computes the shortest path lengths between all pairs of labelled
+    nodes, with one single-source Dijkstra per labelled node and weight,
+    run on a CSR export of the graph in a process pool.
+
+    :param graph: The sparsified graph.
+    :param weights: The edge attributes to compute distances for.
+    :param processes: The number of worker processes. None uses one per cpu,
+           0 runs everything in this process.
+    :param dtype: The dtype of the distance matrices.
+    :return: A LabelledDistances with one distance matrix per weight.
+    """
+    labelled_nodes = get_room_label_index(graph).labelled_nodes()
+    nodes = list(graph.nodes)
+    node_ids = {node: i for i, node in enumerate(nodes)}
+    targets = np.array([node_ids[node] for node in labelled_nodes], dtype=np.int32)
+    matrices = [graph_to_csr(graph, weight, nodes)[0] for weight in weights]
+
+    tasks = [
+        (weight_id, start, targets[start:start+SOURCES_PER_TASK], targets)
+        for weight_id in range(len(weights))
+        for start in range(0, len(targets), SOURCES_PER_TASK)
+    ]
+    if processes == 0:
+        _init_worker(matrices)
+        results = [_distances_from_sources(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(
+                max_workers=processes,
+                initializer=_init_worker,
+                initargs=(matrices,),
+        ) as executor:
+            results = list(executor.map(_distances_from_sources, tasks))
+
+    distances = np.empty((len(weights), len(targets), len(targets)), dtype=dtype)
+    for (weight_id, start, sources, _), result in zip(tasks, results):
+        distances[weight_id, start:start+len(sources)] = result
+    logging.info(f"distances computed between {len(targets)} labelled nodes")
+
+    return LabelledDistances(
+        nodes=labelled_nodes,
+        labels=[graph.nodes[node]["room_label"] for node in labelled_nodes],
+        weights=tuple(weights),
+        distances=distances,
+    )
@@ -1,5 +1,6 @@
 import logging
 from typing import List
+from typing import Tuple
 
 from rtree.index import Index
 from shapely.geometry import Polygon
@@ -8,7 +9,6 @@ from shapely.geometry.base import BaseGeometry
 
 from dxf_reader.hospital_dxf import DXF
 from util.constants import DELETE_LINE_SIZE
-from util.constants import GRID_RATIO
 from util.constants import OUTSIDE_COLOR
 from util.data_containers import Point
 from util.data_containers import SpaceType
@@ -133,22 +133,47 @@ def move_line_and_delete_horizontal(
             )
 
 
+def grid_shape(dxf_to_graph: DXF) -> Tuple[int, int]:
+    """The number of rows (first index) and columns of the grid of
+    get_grid, without building it.
+
+    :param dxf_to_graph: A DXF object which contains extracted features from
+           the CAD file.
+    """
+    grid_size = dxf_to_graph.grid_size
+    y_max, x_max = [int(lim/grid_size) for lim in dxf_to_graph.new_canvas_dimensions]
+    return y_max+1, x_max
+
+
 import math
 def get_grid(
         dxf_to_graph: DXF,
+        tile_rows: int=None,
 ) -> List[List[SpaceType]]:
     """Builds a grid representation of the CAD file by where the 0's represent
     empty space.
 
     :param dxf_to_graph: A DXF object which contains extracted features from
            the CAD file.
-    :param grid_val: The value to assign to non-empty spaces
+    :param tile_rows: If given, the grid is rasterized in bands of tile_rows
+           rows, so only the cell boxes of one band are in memory at a time.
+           The grid is the same either way.
     :return: A list of lists where each end value is an int. This provides a
              grid representation of the CAD file.
     """
-    grid_size = int(dxf_to_graph.step_size/GRID_RATIO)
-    y_max, x_max = [int(lim/grid_size) for lim in dxf_to_graph.new_canvas_dimensions]
-    grid = [[SpaceType.OPEN]*x_max for i in range(y_max+1)]
+    grid_size = dxf_to_graph.grid_size
+    rows, columns = grid_shape(dxf_to_graph)
+    grid = [[SpaceType.OPEN]*columns for i in range(rows)]
+    if tile_rows is not None and tile_rows < rows:
+        for min_i in range(0, rows, tile_rows):
+            logging.debug(f"rasterizing rows {min_i} to {min_i+tile_rows} of {rows}")
+            rasterize_grid_region(
+                grid,
+                dxf_to_graph,
+                (min_i, 0, min(min_i+tile_rows, rows), columns),
+            )
+        return grid
+
     grid_cells = []
     for i in range(len(grid)):
         for j in range(len(grid[0])):
@@ -187,6 +212,59 @@ def get_grid(
     return grid
 
 
+def rasterize_grid_region(
+        grid: List[List[SpaceType]],
+        dxf_to_graph: DXF,
+        region: Tuple[int, int, int, int],
+):
+    """Recomputes the cells of a rectangular region of a grid from get_grid
+    (before mark_exterior) from the walls and doors of dxf_to_graph, leaving
+    the rest of the grid as is.
+
+    :param grid: The grid to update in place.
+    :param dxf_to_graph: A DXF object with the (new) walls and doors.
+    :param region: The cells (min_i, min_j, max_i, max_j) to recompute, max
+           excluded.
+    """
+    grid_size = dxf_to_graph.grid_size
+    min_i, min_j, max_i, max_j = region
+    grid_cells = []
+    for i in range(min_i, max_i):
+        for j in range(min_j, max_j):
+            grid[i][j] = SpaceType.OPEN
+            grid_cells.append(
+                box(
+                    minx=i*grid_size,
+                    miny=j*grid_size,
+                    maxx=(i+1)*grid_size,
+                    maxy=(j+1)*grid_size,
+                )
+            )
+
+    rtree = Index()
+    for pos, cell in enumerate(grid_cells):
+        rtree.insert(pos, cell.bounds)
+
+    region_box = box(
+        minx=min_i*grid_size,
+        miny=min_j*grid_size,
+        maxx=max_i*grid_size,
+        maxy=max_j*grid_size,
+    )
+    for shapes, space_type in ((dxf_to_graph.doors, SpaceType.DOOR), (dxf_to_graph.walls, SpaceType.WALL)):
+        _calculate_shape_intersections_with_grid_cells(
+            shapes=[
+                shape for shape in shapes
+                if not shape.is_empty and region_box.intersects(box(*shape.bounds))
+            ],
+            space_type=space_type,
+            rtree=rtree,
+            grid_cells=grid_cells,
+            grid=grid,
+            grid_size=grid_size,
+        )
+
+
 def _calculate_shape_intersections_with_grid_cells(
         shapes: List[BaseGeometry],
         space_type: SpaceType,
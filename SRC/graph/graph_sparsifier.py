@@ -1,8 +1,9 @@
 import logging
+from typing import Iterable
 from typing import Set
 
 from networkx import Graph
-from networkx import connected_component_subgraphs
+from networkx import connected_components
 from networkx import single_source_shortest_path
 
 from graph.graph_utils import compute_neighborhood_cached
@@ -10,6 +11,7 @@ from graph.graph_utils import is_neighborhood_marked
 from graph.graph_utils import shortest_path_less_than_cutoff
 from util.data_containers import Node
 from util.data_containers import Point
+from util.stage_tracer import trace_stage
 
 
 def sparsify_graph(
@@ -26,13 +28,25 @@ def sparsify_graph(
     :return: A networkx graph that has been sparsified.
     """
     sparsified_graph = Graph()
-    sparsify_add_nodes_with_labels(graph, sparsified_graph)
-    sparsify_add_rooms(graph, sparsified_graph, sparsity_level)
-    sparsify_add_nodes(graph, sparsified_graph, sparsity_level)
-    sparsify_add_edges(graph, sparsified_graph, cutoff=int(1.5 * sparsity_level))
-    add_distance_reducing_edges(graph, sparsified_graph, cutoff=int(1.8*sparsity_level))
-    add_distance_reducing_edges(graph, sparsified_graph, cutoff=int(2*sparsity_level+1))
-    join_components(graph, sparsified_graph, sparsity_level)
+    with trace_stage("add labelled nodes") as counts:
+        sparsify_add_nodes_with_labels(graph, sparsified_graph)
+        counts["nodes"] = sparsified_graph.number_of_nodes()
+    with trace_stage("add rooms") as counts:
+        sparsify_add_rooms(graph, sparsified_graph, sparsity_level)
+        counts["nodes"] = sparsified_graph.number_of_nodes()
+    with trace_stage("add nodes") as counts:
+        sparsify_add_nodes(graph, sparsified_graph, sparsity_level)
+        counts["nodes"] = sparsified_graph.number_of_nodes()
+    with trace_stage("add edges") as counts:
+        sparsify_add_edges(graph, sparsified_graph, cutoff=int(1.5 * sparsity_level))
+        counts["edges"] = sparsified_graph.number_of_edges()
+    with trace_stage("add distance reducing edges") as counts:
+        add_distance_reducing_edges(graph, sparsified_graph, cutoff=int(1.8*sparsity_level))
+        add_distance_reducing_edges(graph, sparsified_graph, cutoff=int(2*sparsity_level+1))
+        counts["edges"] = sparsified_graph.number_of_edges()
+    with trace_stage("join components") as counts:
+        join_components(graph, sparsified_graph, sparsity_level)
+        counts["edges"] = sparsified_graph.number_of_edges()
 
     return sparsified_graph
 
@@ -81,6 +95,7 @@ def join_components(
         graph: Graph,
         sparsified_graph: Graph,
         sparsity_level: int,
+        sources: Set=None,
 ):
     """Joins disjoint graph components from the sparsified graph if they are
     close in graph.
@@ -89,19 +104,22 @@ def join_components(
     :param sparsified_graph: The sparsified graph with disjoint components.
     :param sparsity_level: Join nodes from the disjoint components that are
            closer than 2*sparsity_level+1
+    :param sources: If given, only joins from these nodes of sparsified_graph.
     :return:
     """
-    components = connected_component_subgraphs(sparsified_graph)
+    components = connected_components(sparsified_graph)
     edges_to_add = []
     for component in components:
-        for node in component.nodes:
+        for node in component:
+            if sources is not None and node not in sources:
+                continue
             nhood = compute_neighborhood_cached(
                 G=graph,
                 source=node,
                 cutoff=2*sparsity_level+1,
             )
             for neighbor in nhood:
-                if neighbor not in component.nodes:
+                if neighbor not in component:
                     if neighbor in sparsified_graph.nodes:
                         edges_to_add.append([node, neighbor])
 
@@ -113,6 +131,7 @@ def sparsify_add_nodes(
         graph: Graph,
         sparsified_graph: Graph,
         sparsity_level: int,
+        candidates: Iterable=None,
 ):
     """Adds any node u from graph to the sparsified graph if it can't find
     any node within distance sparsity_level of u in graph, in sparisified_graph
@@ -120,13 +139,14 @@ def sparsify_add_nodes(
     :param graph: the graph to search distances in.
     :param sparsified_graph: the sparsified_graph
     :param sparsity_level: the distance threshold.
+    :param candidates: The nodes of graph to consider, all nodes by default.
     :return:
     """
-    all_nodes = list(graph.nodes)
+    all_nodes = list(graph.nodes if candidates is None else candidates)
     i = 0
     percent_done = 0
     j = 0
-    for node in graph.nodes:
+    for node in all_nodes:
         i += 1
         if int(i/len(all_nodes)*100) != percent_done:
             percent_done = int(i/len(all_nodes)*100)
@@ -148,6 +168,7 @@ def sparsify_add_nodes(
 def sparsify_add_nodes_with_labels(
         graph: Graph,
         sparsified_graph:  Graph,
+        candidates: Iterable=None,
 ):
     """We add all nodes with labels in graph to sparsified_graph. These labels
     are normally associated with room centers so this is a good strategy.
@@ -156,9 +177,10 @@ def sparsify_add_nodes_with_labels(
            in the CAD file.
     :param sparsified_graph: A sparsified representation of `graph` which only has
            nodes but no edges.
+    :param candidates: The nodes of graph to consider, all nodes by default.
     :return:
     """
-    for node in graph.nodes:
+    for node in (graph.nodes if candidates is None else candidates):
         if graph.nodes[node]["room_label"]:
             sparsified_graph.add_node(
                 node,
@@ -170,6 +192,7 @@ def sparsify_add_rooms(
         graph: Graph,
         sparsified_graph: Graph,
         sparsity_level: int,
+        candidates: Iterable=None,
 ):
     """Adds nodes centrally located in a sufficiently sized empty space in
     graph to sparsified_graph. Our intution is that these should capture rooms
@@ -181,13 +204,14 @@ def sparsify_add_rooms(
            nodes but no edges.
     :param sparsity_level: The cutoff for distance in `graph` which will be used to
            connect nodes in sparsified graph.
+    :param candidates: The nodes of graph to consider, all nodes by default.
     :return:
     """
-    all_nodes = list(graph.nodes)
+    all_nodes = list(graph.nodes if candidates is None else candidates)
     i = 0
     percent_done = 0
     count = 0
-    for node in graph.nodes:
+    for node in all_nodes:
         i += 1
         if int(i/len(all_nodes)*100) != percent_done:
             percent_done = int(i/len(all_nodes)*100)
@@ -222,6 +246,7 @@ def sparsify_add_edges(
         graph: Graph,
         sparsified_graph: Graph,
         cutoff: int,
+        sources: Iterable=None,
 ):
     """Adds edges between nodes in `sparsified_graph` based on distance
     in `graph`.
@@ -232,10 +257,12 @@ def sparsify_add_edges(
            nodes but no edges.
     :param cutoff: The cutoff for distance in `graph` which will be used to connect
            nodes in sparsified graph.
+    :param sources: The nodes of sparsified_graph to add edges from, all
+           nodes by default.
     :return:
     """
     # sparse_nodes = set(sparsified_graph.nodes)
-    for node in sparsified_graph.nodes:
+    for node in (sparsified_graph.nodes if sources is None else sources):
         nhood = compute_neighborhood_cached(
             G=graph,
             source=node,
@@ -263,15 +290,18 @@ def add_distance_reducing_edges(
         graph: Graph,
         sparsified_graph: Graph,
         cutoff: int,
+        sources: Iterable=None,
 ):
     """
 
     :param graph:
     :param sparsified_graph:
     :param cutoff:
+    :param sources: The nodes of sparsified_graph to add edges from, all
+           nodes by default.
     :return:
     """
-    for node in sparsified_graph.nodes:
+    for node in (sparsified_graph.nodes if sources is None else sources):
         grid_nhood = compute_neighborhood_cached(
             G=graph,
             source=node,
@@ -312,31 +342,45 @@ def get_room_label(
     return None
 
 
-def remove_small_components(graph: Graph, minsize):
-    updated_graph = Graph()
-    components = connected_component_subgraphs(graph)
+def _remove_nodes(graph: Graph, nodes, copy: bool) -> Graph:
+    if copy:
+        removed = set(nodes)
+        return graph.subgraph(node for node in graph if node not in removed).copy()
+    graph.remove_nodes_from(nodes)
+    return graph
 
-    for component in components:
-        if component.number_of_nodes() > minsize:
-            updated_graph.add_nodes_from(component.nodes(data=True))
-            updated_graph.add_edges_from(component.edges(data=True))
-    return updated_graph
-    # return max(connected_component_subgraphs(graph), key=len)
-
-def remove_components_without_labels(graph: Graph):
-    updated_graph = Graph()
-    components = connected_component_subgraphs(graph)
-    
-    for component in components:
-        label_exist = False
-        for node in component.nodes:
-            if component.nodes[node]["room_label"]:
-                label_exist = True
-        if label_exist:
-            updated_graph.add_nodes_from(component.nodes(data=True))
-            updated_graph.add_edges_from(component.edges(data=True))
-        else:
+
+def remove_small_components(graph: Graph, minsize, copy: bool=True):
+    """Removes the connected components with at most minsize nodes.
+
+    :param graph: The graph to filter.
+    :param minsize: The largest size of the components to remove.
+    :param copy: If False, the components are removed from graph in place
+           instead of from a copy.
+    :return: The graph without small components.
+    """
+    small_components = [
+        component for component in connected_components(graph)
+        if len(component) <= minsize
+    ]
+    return _remove_nodes(
+        graph,
+        [node for component in small_components for node in component],
+        copy,
+    )
+
+
+def remove_components_without_labels(graph: Graph, copy: bool=True):
+    """Removes the connected components in which no node has a room label.
+
+    :param graph: The graph to filter.
+    :param copy: If False, the components are removed from graph in place
+           instead of from a copy.
+    :return: The graph without unlabelled components.
+    """
+    unlabelled_nodes = []
+    for component in connected_components(graph):
+        if not any(graph.nodes[node]["room_label"] for node in component):
+            unlabelled_nodes.extend(component)
             print("removed")
-        
-    return updated_graph
-    
+    return _remove_nodes(graph, unlabelled_nodes, copy)
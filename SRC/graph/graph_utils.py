@@ -2,12 +2,16 @@ import functools
 from typing import List
 
 from networkx import Graph
+from networkx import relabel_nodes
 from networkx import shortest_path
 from networkx import shortest_path_length
 from networkx import single_source_dijkstra_path_length
 from networkx.exception import NetworkXNoPath
 import numpy as np
 
+from graph.distance_matrix import compute_labelled_distances
+from graph.room_label_index import get_room_label_index
+from graph.room_label_index import invalidate_room_label_index
 from util.data_containers import Node
 
 
@@ -74,24 +78,24 @@ def shortest_path_less_than_cutoff(
 def add_graph_offsets(
         graph: Graph,
         offsets: List[int],
+        copy: bool=True,
 ):
-    graph_with_offsets = Graph()
+    """Moves the nodes of a graph by offsets, making them 2d Nodes.
 
-    for node in graph.nodes:
-        graph_with_offsets.add_node(
-            Node(node.x+offsets[0], node.y+offsets[1]),
-            **graph.nodes[node],
-        )
-    for edge in graph.edges:
-        u, v = edge[0], edge[1]
-        u1 = Node(u.x+offsets[0], u.y+offsets[1])
-        v1 = Node(v.x+offsets[0], v.y+offsets[1])
-        graph_with_offsets.add_edge(
-            u=u1,
-            v=v1,
-            **graph.edges[edge],
-        )
-    return graph_with_offsets
+    :param graph: A graph whose nodes have x and y fields.
+    :param offsets: The x and y offsets to add.
+    :param copy: If False, the nodes of graph are relabelled in place
+           instead of in a copy.
+    :return: The graph with moved nodes.
+    """
+    mapping = {
+        node: Node(node.x+offsets[0], node.y+offsets[1])
+        for node in graph.nodes
+    }
+    relabelled_graph = relabel_nodes(graph, mapping, copy=copy)
+    if not copy:
+        invalidate_room_label_index(graph)
+    return relabelled_graph
 
 
 def compute_hospital_graph_shortest_path(
@@ -99,17 +103,11 @@ def compute_hospital_graph_shortest_path(
         room_label_1: str,
         room_label_2: str,
 ):
-    room_id_1 = None
-    room_id_2 = None
-    for node in hospital_graph.nodes:
-        if hospital_graph.nodes[node]["room_label"] == room_label_1:
-            room_id_1 = node
-            if room_id_2:
-                return len(shortest_path(hospital_graph, room_id_1, room_id_2)) - 1
-        if hospital_graph.nodes[node]["room_label"] == room_label_2:
-            room_id_2 = node
-            if room_id_1:
-                return len(shortest_path(hospital_graph, room_id_1, room_id_2)) - 1
+    index = get_room_label_index(hospital_graph)
+    room_id_1 = index.first_node(room_label_1)
+    room_id_2 = index.first_node(room_label_2)
+    if room_id_1 is not None and room_id_2 is not None:
+        return len(shortest_path(hospital_graph, room_id_1, room_id_2)) - 1
 
 
 def add_edge_by_room_labels(
@@ -117,27 +115,16 @@ def add_edge_by_room_labels(
         room_label_1: str,
         room_label_2: str,
 ):
-    room_id_1 = None
-    room_id_2 = None
-    for node in hospital_graph.nodes:
-        if hospital_graph.nodes[node]["room_label"] == room_label_1:
-            room_id_1 = node
-            if room_id_2:
-                return hospital_graph.add_edge(
-                    room_id_1,
-                    room_id_2,
-                    weight=1,
-                    weight2=1,
-                )
-        if hospital_graph.nodes[node]["room_label"] == room_label_2:
-            room_id_2 = node
-            if room_id_1:
-                return hospital_graph.add_edge(
-                    room_id_1,
-                    room_id_2,
-                    weight=1,
-                    weight2=1,
-                )
+    index = get_room_label_index(hospital_graph)
+    room_id_1 = index.first_node(room_label_1)
+    room_id_2 = index.first_node(room_label_2)
+    if room_id_1 is not None and room_id_2 is not None:
+        return hospital_graph.add_edge(
+            room_id_1,
+            room_id_2,
+            weight=1,
+            weight2=1,
+        )
 
 def show_all_entity_types(drawing_obj):
     a_set = set()
@@ -152,11 +139,11 @@ def show_node_details(graph):
         print(node.details) 
         
 def collect_labelled_nodes(sparsified_graph):
-    dic = {}
-    for node in sparsified_graph.nodes:
-        if sparsified_graph.nodes[node]["room_label"]:
-            dic[node] = sparsified_graph.nodes[node]
-    return dic
+    nodes = sparsified_graph.nodes
+    return {
+        node: nodes[node]
+        for node in get_room_label_index(sparsified_graph).labelled_nodes()
+    }
 
 def collect_stair_nodes(labeled_nodes):
     lst = []
@@ -172,28 +159,34 @@ def collect_elev_nodes(labeled_nodes):
             lst.append((key, labeled_nodes[key]["RMNAC"]))
     return lst
     
-def collect_path_len_bw_labeled_nodes(sparsified_graph, weight="weight"):
-    l_nodes = collect_labelled_nodes(sparsified_graph)
+def collect_path_len_bw_labeled_nodes(sparsified_graph, weight="weight", processes=0):
+    """The path length and euclidean distance between every pair of
+    connected labelled nodes.
+
+    :param sparsified_graph: The sparsified graph.
+    :param weight: The edge attribute of the path lengths.
+    :param processes: The number of worker processes of
+           compute_labelled_distances. 0 runs everything in this process,
+           None uses one per cpu.
+    :return: A dict from pairs of labelled nodes to their path length and
+             euclidean distance.
+    """
+    distances = compute_labelled_distances(
+        sparsified_graph,
+        weights=(weight,),
+        processes=processes,
+        dtype=np.float64,
+    )
+    l_nodes = distances.nodes
     dic = {}
-    for source in l_nodes:
-        for target in l_nodes:
-            if (target, source) in dic:
-                continue
-            if source != target: 
-                try:
-                    path_len = shortest_path_length(
-                    G=sparsified_graph,
-                    source=source,
-                    target=target,
-                    weight=weight
-                )
-                    eu_dis = compute_distance(source, target)
-                    dic[(source,target)] = (path_len, eu_dis)
-                except:
-                    continue
-                
-                
-    return dic 
+    for i, j in zip(*np.triu_indices(len(l_nodes), k=1)):
+        path_len = distances.distances[0, i, j]
+        if np.isfinite(path_len):
+            dic[(l_nodes[i], l_nodes[j])] = (
+                float(path_len),
+                compute_distance(l_nodes[i], l_nodes[j]),
+            )
+    return dic
 
 def compute_distance(node1, node2):
         
@@ -0,0 +1,57 @@
+from typing import List
+
+import numpy as np
+
+from util.constants import OUTSIDE_COLOR
+from util.data_containers import SpaceType
+
+# The grid cells as small integer codes. They fit in 2 bits.
+OPEN_CODE = SpaceType.OPEN.value
+WALL_CODE = SpaceType.WALL.value
+DOOR_CODE = SpaceType.DOOR.value
+OUTSIDE_CODE = OUTSIDE_COLOR
+
+_CELL_CODES = {
+    SpaceType.OPEN: OPEN_CODE,
+    SpaceType.WALL: WALL_CODE,
+    SpaceType.DOOR: DOOR_CODE,
+    OUTSIDE_COLOR: OUTSIDE_CODE,
+}
+_CODE_CELLS = {code: cell for cell, code in _CELL_CODES.items()}
+
+
+def grid_to_array(grid: List[List[SpaceType]]) -> np.ndarray:
+    """Converts a grid from get_grid (optionally marked by mark_exterior)
+    into a uint8 array of cell codes, indexed the same way as the grid.
+
+    :param grid: A list of lists of SpaceType or OUTSIDE_COLOR cells.
+    :return: A 2d uint8 numpy array of cell codes.
+    """
+    if isinstance(grid, np.ndarray):
+        return grid.astype(np.uint8, copy=False)
+    width = len(grid[0]) if grid else 0
+    array = np.empty((len(grid), width), dtype=np.uint8)
+    for i, row in enumerate(grid):
+        array[i] = np.fromiter(map(_CELL_CODES.__getitem__, row), dtype=np.uint8, count=width)
+    return array
+
+
+def array_to_grid(array: np.ndarray) -> List[List[SpaceType]]:
+    """Converts an array of cell codes back into the list of lists grid used
+    by the rest of the pipeline.
+
+    :param array: A 2d array of cell codes.
+    :return: A list of lists of SpaceType or OUTSIDE_COLOR cells.
+    """
+    return [[_CODE_CELLS[code] for code in row] for row in np.asarray(array).tolist()]
+
+
+def unmark_exterior(grid: List[List[SpaceType]]) -> np.ndarray:
+    """The cell codes of a grid as they were before mark_exterior, which only
+    marks open cells as outside.
+
+    :param grid: A grid marked by mark_exterior, or an array of cell codes.
+    :return: A 2d uint8 numpy array of cell codes.
+    """
+    cells = grid_to_array(grid)
+    return np.where(cells == OUTSIDE_CODE, OPEN_CODE, cells).astype(np.uint8)
@@ -0,0 +1,369 @@
+import logging
+import os
+import tempfile
+from collections import deque
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+import numpy as np
+from networkx import Graph
+
+from dxf_reader.hospital_dxf import DXF
+from graph.extract_grid_from_dxf import grid_shape
+from graph.extract_grid_from_dxf import rasterize_grid_region
+from graph.grid_array import DOOR_CODE
+from graph.grid_array import OPEN_CODE
+from graph.grid_array import OUTSIDE_CODE
+from graph.grid_array import WALL_CODE
+from graph.grid_array import grid_to_array
+from util.constants import DELETE_LINE_SIZE
+from util.data_containers import Node_4d
+from util.data_containers import Point
+from util.data_containers import RoomInfo
+from util.data_containers import SpaceType
+
+DEFAULT_BAND_ROWS = 256
+
+_FLAG_DOWN = 1
+_FLAG_TOP = 2
+_FLAG_VERTICAL = 4
+_FLAG_BOTTOM = 8
+
+
+class MemmapGrid:
+    """A grid of cell codes (see grid_array) stored in a file instead of in
+    memory. It is only mapped a band of rows at a time, so the memory used
+    does not grow with the size of the grid.
+
+    :param filepath: The file of the cell codes, one byte per cell, row by
+           row.
+    :param shape: The number of rows (first grid index) and columns.
+    :param band_rows: The number of rows processed at a time.
+    """
+
+    def __init__(self, filepath: str, shape: Tuple[int, int], band_rows: int=DEFAULT_BAND_ROWS):
+        self.filepath = filepath
+        self.shape = tuple(shape)
+        self.band_rows = max(int(band_rows), 1)
+
+    @classmethod
+    def create(cls, filepath: str, shape: Tuple[int, int], band_rows: int=DEFAULT_BAND_ROWS) -> "MemmapGrid":
+        """Creates the file of an open grid of the given shape."""
+        with open(filepath, "wb") as grid_file:
+            grid_file.truncate(shape[0] * shape[1])
+        return cls(filepath, shape, band_rows)
+
+    def band(self, min_i: int, max_i: int, mode: str="r") -> np.memmap:
+        """Maps the rows min_i to max_i (excluded)."""
+        return np.memmap(
+            self.filepath,
+            dtype=np.uint8,
+            mode=mode,
+            offset=min_i * self.shape[1],
+            shape=(max_i - min_i, self.shape[1]),
+        )
+
+    def bands(self, reverse: bool=False) -> Iterator[Tuple[int, int]]:
+        """The (min_i, max_i) of the bands, in order of their rows or in
+        reverse."""
+        starts = range(0, self.shape[0], self.band_rows)
+        for min_i in (reversed(starts) if reverse else starts):
+            yield min_i, min(min_i + self.band_rows, self.shape[0])
+
+    def rows(self, reverse: bool=False) -> Iterator[Tuple[int, np.ndarray]]:
+        """Every row with its index, mapped a band at a time."""
+        for min_i, max_i in self.bands(reverse):
+            band = self.band(min_i, max_i)
+            for i in (range(max_i - 1, min_i - 1, -1) if reverse else range(min_i, max_i)):
+                yield i, np.array(band[i - min_i])
+            del band
+
+    def array(self, mode: str="r") -> np.memmap:
+        """Maps the whole grid, for code that needs random access to it."""
+        return self.band(0, self.shape[0], mode)
+
+    def remove(self):
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+
+
+def rasterize_grid_memmap(dxf_to_graph: DXF, grid_file: MemmapGrid):
+    """Fills grid_file with the grid of get_grid (before mark_exterior), a
+    band of rows at a time.
+
+    :param dxf_to_graph: A DXF object which contains extracted features from
+           the CAD file.
+    :param grid_file: A grid of shape grid_shape(dxf_to_graph).
+    """
+    rows, columns = grid_file.shape
+    if grid_file.shape != grid_shape(dxf_to_graph):
+        raise ValueError(f"the grid has shape {grid_file.shape} instead of {grid_shape(dxf_to_graph)}")
+    for min_i, max_i in grid_file.bands():
+        logging.debug(f"rasterizing rows {min_i} to {max_i} of {rows}")
+        # rasterize_grid_region only touches the rows of the region
+        band_grid = [None] * rows
+        for i in range(min_i, max_i):
+            band_grid[i] = [SpaceType.OPEN] * columns
+        rasterize_grid_region(band_grid, dxf_to_graph, (min_i, 0, max_i, columns))
+        band = grid_file.band(min_i, max_i, "r+")
+        band[:] = grid_to_array(band_grid[min_i:max_i])
+        band.flush()
+        del band
+
+
+def get_grid_via_memmap(dxf_to_graph: DXF, band_rows: int=DEFAULT_BAND_ROWS) -> np.ndarray:
+    """get_grid through a temporary grid file, as an array of cell codes."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        grid_file = MemmapGrid.create(os.path.join(tmpdir, "grid"), grid_shape(dxf_to_graph), band_rows)
+        rasterize_grid_memmap(dxf_to_graph, grid_file)
+        return np.array(grid_file.array())
+
+
+def mark_exterior_via_memmap(grid: List[List[SpaceType]], band_rows: int=DEFAULT_BAND_ROWS) -> np.ndarray:
+    """mark_exterior through a temporary grid file, as an array of cell
+    codes. grid is left as is."""
+    cells = grid_to_array(grid)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        grid_file = MemmapGrid.create(os.path.join(tmpdir, "grid"), cells.shape, band_rows)
+        band = grid_file.array("r+")
+        band[:] = cells
+        band.flush()
+        del band
+        mark_exterior_memmap(grid_file)
+        return np.array(grid_file.array())
+
+
+def _free_lines(blocked_rows: np.ndarray) -> np.ndarray:
+    """Whether the DELETE_LINE_SIZE cells of a row starting at every column
+    are free of walls and doors."""
+    columns = blocked_rows.shape[-1]
+    free = np.zeros(columns, dtype=bool)
+    if columns >= DELETE_LINE_SIZE:
+        counts = np.concatenate(([0], np.cumsum(blocked_rows, dtype=np.int64)))
+        free[:columns - DELETE_LINE_SIZE + 1] = counts[DELETE_LINE_SIZE:] == counts[:-DELETE_LINE_SIZE]
+    return free
+
+
+def _seeded_runs(free: np.ndarray, seeds: np.ndarray) -> np.ndarray:
+    """The runs of free cells that contain a seed."""
+    starts = free & ~np.concatenate(([False], free[:-1]))
+    run_ids = np.cumsum(starts)
+    seeded = np.unique(run_ids[free & seeds])
+    return free & np.isin(run_ids, seeded)
+
+
+def _rows_with_lines(grid_file: MemmapGrid, reverse: bool=False) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+    """Yields every row i with the free horizontal lines of mark_exterior
+    starting in it, i.e. whether the cells of rows i to i+DELETE_LINE_SIZE-1
+    in every column are free of walls and doors."""
+    rows, columns = grid_file.shape
+    window = deque()
+    for i, row in grid_file.rows(reverse):
+        blocked = (row == WALL_CODE) | (row == DOOR_CODE)
+        if reverse:
+            # rows i+1 to i+DELETE_LINE_SIZE-1 have been read already
+            window.appendleft(blocked)
+            if len(window) > DELETE_LINE_SIZE:
+                window.pop()
+            yield i, row, _free_window(window, i, rows, columns)
+        else:
+            window.append((i, row, blocked))
+            if len(window) == DELETE_LINE_SIZE:
+                yield _first_of_window(window, rows, columns)
+                window.popleft()
+    if not reverse:
+        while window:
+            yield _first_of_window(window, rows, columns)
+            window.popleft()
+
+
+def _free_window(window: deque, i: int, rows: int, columns: int) -> np.ndarray:
+    if i + DELETE_LINE_SIZE > rows or len(window) < DELETE_LINE_SIZE:
+        return np.zeros(columns, dtype=bool)
+    return ~np.any(list(window), axis=0)
+
+
+def _first_of_window(window: deque, rows: int, columns: int) -> Tuple[int, np.ndarray, np.ndarray]:
+    i, row, _ = window[0]
+    return i, row, _free_window(deque(blocked for _, _, blocked in window), i, rows, columns)
+
+
+def _sweeps_from_sides(free_lines: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """The lines of a row the sweeps from the left and right edges of the
+    grid mark, and where they start sweeps in the other direction: one step
+    past every line they mark."""
+    from_left = np.logical_and.accumulate(free_lines)
+    from_right = np.logical_and.accumulate(free_lines[::-1])[::-1]
+    seeds = np.zeros_like(free_lines)
+    seeds[1:] |= from_left[:-1]
+    seeds[:-1] |= from_right[1:]
+    return from_left | from_right, seeds
+
+
+def mark_exterior_memmap(grid_file: MemmapGrid):
+    """Marks the exterior of a grid file like mark_exterior does for a grid
+    in memory, with the same result, in three passes over the rows.
+
+    mark_exterior sweeps lines of DELETE_LINE_SIZE cells in from the edges
+    of the grid until they hit a wall or door, and from every step of these
+    sweeps it sweeps once more in the perpendicular directions. The cells
+    it marks never stop a sweep, so the marked cells only depend on the
+    walls and doors, and each sweep can be computed a row at a time: the
+    vertical ones by carrying their state from row to row, down and then up
+    the grid, the horizontal ones from a window of the next rows.
+
+    :param grid_file: A grid from rasterize_grid_memmap.
+    """
+    rows, columns = grid_file.shape
+    flags = MemmapGrid.create(f"{grid_file.filepath}.flags", grid_file.shape, grid_file.band_rows)
+    try:
+        # 1. down: vertical sweeps from the top edge, and the downward half
+        # of the vertical sweeps started by the horizontal ones
+        down = np.ones(columns, dtype=bool)
+        top = np.ones(columns, dtype=bool)
+        band = None
+        for i, row, free_lines in _rows_with_lines(grid_file):
+            _, seeds = _sweeps_from_sides(free_lines)
+            free_columns = _free_lines((row == WALL_CODE) | (row == DOOR_CODE))
+            down = free_columns & (down | seeds)
+            top = free_columns & top
+            band = _mapped_band(flags, band, i)
+            band[i - band.min_i] = np.where(down, _FLAG_DOWN, 0) | np.where(top, _FLAG_TOP, 0)
+        _flush(band)
+
+        # 2. up: the same from the bottom edge
+        up = np.ones(columns, dtype=bool)
+        bottom = np.ones(columns, dtype=bool)
+        band = None
+        for i, row, free_lines in _rows_with_lines(grid_file, reverse=True):
+            _, seeds = _sweeps_from_sides(free_lines)
+            free_columns = _free_lines((row == WALL_CODE) | (row == DOOR_CODE))
+            up = free_columns & (up | seeds)
+            bottom = free_columns & bottom
+            band = _mapped_band(flags, band, i)
+            row_flags = band[i - band.min_i]
+            vertical = up | ((row_flags & _FLAG_DOWN) > 0)
+            band[i - band.min_i] = (
+                (row_flags & _FLAG_TOP) |
+                np.where(vertical, _FLAG_VERTICAL, 0) |
+                np.where(bottom, _FLAG_BOTTOM, 0)
+            )
+        _flush(band)
+
+        # 3. down: the horizontal sweeps, started from the sides and by the
+        # vertical sweeps from the top and bottom, and the marking
+        horizontal = deque(maxlen=DELETE_LINE_SIZE)
+        previous_flags = np.zeros(columns, dtype=np.uint8)
+        flag_rows = flags.rows()
+        next_flags = next(flag_rows, (None, None))[1]
+        band = None
+        for i, row, free_lines in _rows_with_lines(grid_file):
+            row_flags = next_flags
+            next_flags = next(flag_rows, (None, None))[1]
+            seeds = (previous_flags & _FLAG_TOP) > 0
+            if next_flags is not None:
+                seeds |= (next_flags & _FLAG_BOTTOM) > 0
+            from_sides, _ = _sweeps_from_sides(free_lines)
+            horizontal.append(from_sides | _seeded_runs(free_lines, seeds))
+            previous_flags = row_flags
+
+            # a horizontal line marks its column in the DELETE_LINE_SIZE rows
+            # from its row, a vertical one the DELETE_LINE_SIZE columns from
+            # its column
+            outside = np.any(list(horizontal), axis=0)
+            vertical = (row_flags & _FLAG_VERTICAL) > 0
+            for offset in range(min(DELETE_LINE_SIZE, columns)):
+                outside[offset:] |= vertical[:columns - offset]
+            band = _mapped_band(grid_file, band, i)
+            band[i - band.min_i] = np.where(outside, OUTSIDE_CODE, row)
+        _flush(band)
+    finally:
+        flags.remove()
+
+
+class _Band:
+    """A mapped band of a MemmapGrid with the index of its first row."""
+
+    def __init__(self, grid_file: MemmapGrid, min_i: int):
+        self.min_i = min_i
+        self.max_i = min(min_i + grid_file.band_rows, grid_file.shape[0])
+        self.array = grid_file.band(min_i, self.max_i, "r+")
+
+    def __getitem__(self, index):
+        return self.array[index]
+
+    def __setitem__(self, index, value):
+        self.array[index] = value
+
+
+def _mapped_band(grid_file: MemmapGrid, band: _Band, i: int) -> _Band:
+    """The band of grid_file with row i, band if it has it."""
+    if band is not None and band.min_i <= i < band.max_i:
+        return band
+    _flush(band)
+    return _Band(grid_file, i - i % grid_file.band_rows)
+
+
+def _flush(band: _Band):
+    if band is not None:
+        band.array.flush()
+
+
+def make_graph_from_grid_memmap(
+        grid_file: MemmapGrid,
+        room_infos: Dict[Point, RoomInfo],
+        floor=0,
+        building="",
+) -> Graph:
+    """Builds the same graph as make_graph_from_grid from a grid file, a
+    band of rows at a time.
+
+    :param grid_file: A grid after mark_exterior_memmap.
+    :param room_infos: The room labels, keyed by cell.
+    :param floor: The floor of the nodes.
+    :param building: The building of the nodes.
+    :return: The graph of the open and door cells.
+    """
+    graph = Graph()
+    columns = grid_file.shape[1]
+    previous_row = None
+    for min_i, max_i in grid_file.bands():
+        band = grid_file.band(min_i, max_i)
+        # with the last row of the previous band, to connect the bands
+        cells = np.array(band) if previous_row is None else np.vstack([previous_row, band])
+        del band
+        first_new_row = 0 if previous_row is None else 1
+        row_offset = min_i - first_new_row
+        walkable = (cells == OPEN_CODE) | (cells == DOOR_CODE)
+
+        for i, j in zip(*map(np.ndarray.tolist, np.nonzero(walkable[first_new_row:]))):
+            i += first_new_row
+            room_info = room_infos.get(Point(x=i + row_offset, y=j))
+            node_details = dict(room_info.details) if room_info is not None else {}
+            node_details["room_label"] = room_info.room_label if room_info is not None else ""
+            node_details["type"] = SpaceType(int(cells[i, j]))
+            graph.add_node(Node_4d(x=i + row_offset, y=j, floor=floor, building=building), **node_details)
+
+        rows = cells.shape[0]
+        for di, dj, weight in ((0, 1, 1), (1, 0, 1), (1, 1, 1.4), (1, -1, 1.4)):
+            pairs = (
+                walkable[:rows-di, max(-dj, 0):columns-max(dj, 0)] &
+                walkable[di:, max(dj, 0):columns-max(-dj, 0)]
+            )
+            if di == 0:
+                # the edges within the previous row are already there
+                pairs[:first_new_row] = False
+            for i, j in zip(*map(np.ndarray.tolist, np.nonzero(pairs))):
+                j += max(-dj, 0)
+                is_door = cells[i, j] == DOOR_CODE or cells[i+di, j+dj] == DOOR_CODE
+                graph.add_edge(
+                    Node_4d(x=i + row_offset, y=j, floor=floor, building=building),
+                    Node_4d(x=i + di + row_offset, y=j + dj, floor=floor, building=building),
+                    type="door" if is_door else "normal",
+                    weight=weight,
+                    weight2=1000 if is_door else weight,
+                )
+        previous_row = cells[-1:]
+    return graph
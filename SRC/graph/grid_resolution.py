@@ -0,0 +1,262 @@
+import logging
+import os
+import tempfile
+from collections import namedtuple
+from typing import List
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+from scipy import ndimage
+
+from dxf_reader.hospital_dxf import DXF
+from graph.extract_grid_from_dxf import get_grid
+from graph.extract_grid_from_dxf import grid_shape
+from graph.extract_grid_from_dxf import mark_exterior
+from graph.grid_array import DOOR_CODE
+from graph.grid_array import OPEN_CODE
+from graph.grid_array import grid_to_array
+from graph.grid_memmap import DEFAULT_BAND_ROWS
+from graph.grid_memmap import MemmapGrid
+from graph.grid_memmap import mark_exterior_memmap
+from graph.grid_memmap import rasterize_grid_memmap
+from graph.parallel_raster import get_grid_parallel
+from util.constants import GRID_RATIO
+from util.constants import SPARSITY_LEVEL
+from util.data_containers import SpaceType
+
+# grid ratios tried by choose_grid_ratio, coarsest first
+CANDIDATE_GRID_RATIOS = (1, 1.5, 2, 2.5, 3)
+
+GridConnectivity = namedtuple("GridConnectivity", ["nodes", "label_components", "door_components"])
+# grid is the grid at the chosen ratio after mark_exterior, a MemmapGrid if
+# it was rasterized out of core
+GridResolution = namedtuple("GridResolution", [
+    "grid_ratio",
+    "nodes",
+    "reference_nodes",
+    "nodes_saved",
+    "rejected",
+    "grid",
+])
+
+# make_graph_from_grid connects diagonal neighbours too
+_CONNECTIVITY_STRUCTURE = np.ones((3, 3))
+
+
+def grid_connectivity(grid: Union[List[List[SpaceType]], MemmapGrid], dxf_to_graph: DXF) -> GridConnectivity:
+    """Finds how the rooms and doors of a floor are connected on a grid, i.e.
+    in the graph make_graph_from_grid would build from it.
+
+    :param grid: A grid from get_grid, after mark_exterior, at the
+           resolution of dxf_to_graph. The components of a MemmapGrid are
+           labelled in files next to it instead of in memory.
+    :param dxf_to_graph: The DXF the grid was made from.
+    :return: The number of nodes (open and door cells), the connected
+             component of every room label (0 if the label is not on an open
+             cell) in the order of dxf_to_graph.room_labels, and for every
+             door the components of the open cells around it, within half a
+             step of the door.
+    """
+    if not isinstance(grid, MemmapGrid):
+        cells = grid_to_array(grid)
+        walkable = (cells == OPEN_CODE) | (cells == DOOR_CODE)
+        components, _ = ndimage.label(walkable, structure=_CONNECTIVITY_STRUCTURE)
+        return _connectivity(walkable, components, dxf_to_graph)
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(grid.filepath))) as tmpdir:
+        walkable = np.memmap(os.path.join(tmpdir, "walkable"), dtype=bool, mode="w+", shape=grid.shape)
+        for min_i, max_i in grid.bands():
+            band = grid.band(min_i, max_i)
+            walkable[min_i:max_i] = (band == OPEN_CODE) | (band == DOOR_CODE)
+            del band
+        components = np.memmap(os.path.join(tmpdir, "components"), dtype=np.int32, mode="w+", shape=grid.shape)
+        ndimage.label(walkable, structure=_CONNECTIVITY_STRUCTURE, output=components)
+        connectivity = _connectivity(walkable, components, dxf_to_graph)
+        del walkable, components
+    return connectivity
+
+
+def _connectivity(walkable: np.ndarray, components: np.ndarray, dxf_to_graph: DXF) -> GridConnectivity:
+    label_components = []
+    for position in dxf_to_graph.room_labels:
+        inside = 0 <= position.x < components.shape[0] and 0 <= position.y < components.shape[1]
+        label_components.append(int(components[position.x, position.y]) if inside else 0)
+
+    grid_size = dxf_to_graph.grid_size
+    margin = dxf_to_graph.step_size / 2
+    door_components = []
+    for door in dxf_to_graph.doors:
+        if door.is_empty:
+            continue
+        min_x, min_y, max_x, max_y = door.bounds
+        window = components[
+            max(int((min_x - margin) / grid_size), 0):max(int((max_x + margin) / grid_size) + 1, 0),
+            max(int((min_y - margin) / grid_size), 0):max(int((max_y + margin) / grid_size) + 1, 0),
+        ]
+        door_components.append(set(np.unique(window[window > 0]).tolist()))
+
+    return GridConnectivity(
+        nodes=int(walkable.sum()),
+        label_components=label_components,
+        door_components=door_components,
+    )
+
+
+def connectivity_differences(reference: GridConnectivity, candidate: GridConnectivity) -> List[str]:
+    """Compares the connectivity of a floor at a coarser resolution with its
+    connectivity at the reference resolution.
+
+    :return: A description of every room label that is lost or connected
+             differently, and of every door that is no longer passable. An
+             empty list if the coarser grid connects the floor the same way.
+    """
+    differences = []
+    if len(candidate.label_components) != len(reference.label_components):
+        differences.append(
+            f"{len(reference.label_components) - len(candidate.label_components)} "
+            f"room labels fall in the same cell"
+        )
+        return differences
+
+    reference_to_candidate = {}
+    candidate_to_reference = {}
+    for label, (reference_component, candidate_component) in enumerate(
+            zip(reference.label_components, candidate.label_components)):
+        if not reference_component:
+            continue
+        if not candidate_component:
+            differences.append(f"room label {label} is not on open space")
+            continue
+        if reference_to_candidate.setdefault(reference_component, candidate_component) != candidate_component:
+            differences.append(f"room label {label} is disconnected from its rooms")
+        if candidate_to_reference.setdefault(candidate_component, reference_component) != reference_component:
+            differences.append(f"room label {label} is connected to other rooms")
+
+    for door, (reference_components, candidate_components) in enumerate(
+            zip(reference.door_components, candidate.door_components)):
+        if reference_components and not 0 < len(candidate_components) <= len(reference_components):
+            differences.append(f"door {door} is not passable")
+    return differences
+
+
+def scaled_sparsity_level(grid_ratio: float, sparsity_level: int=SPARSITY_LEVEL) -> int:
+    """The sparsity level that keeps the sparsified nodes as far apart (in
+    drawing units) at grid_ratio as sparsity_level does at GRID_RATIO."""
+    return max(int(round(sparsity_level * grid_ratio / GRID_RATIO)), 1)
+
+
+def _marked_grid(
+        dxf_to_graph: DXF,
+        grid_ratio: float,
+        tile_rows: int=None,
+        raster_workers: int=None,
+        grid_filepath: str=None,
+) -> Union[List[List[SpaceType]], MemmapGrid]:
+    dxf_to_graph.set_grid_ratio(grid_ratio)
+    if grid_filepath is not None:
+        # the grids of the different ratios are kept side by side
+        grid_file = MemmapGrid.create(f"{grid_filepath}.{grid_ratio}", grid_shape(dxf_to_graph), tile_rows or DEFAULT_BAND_ROWS)
+        try:
+            rasterize_grid_memmap(dxf_to_graph, grid_file)
+            mark_exterior_memmap(grid_file)
+        except BaseException:
+            grid_file.remove()
+            raise
+        return grid_file
+    if raster_workers is not None:
+        grid = get_grid_parallel(dxf_to_graph, workers=raster_workers, max_band_rows=tile_rows)
+    else:
+        grid = get_grid(dxf_to_graph, tile_rows=tile_rows)
+    mark_exterior(grid)
+    return grid
+
+
+def _discard(grid: Union[List[List[SpaceType]], MemmapGrid]):
+    if isinstance(grid, MemmapGrid):
+        grid.remove()
+
+
+def choose_grid_ratio(
+        dxf_to_graph: DXF,
+        candidate_ratios: Tuple[float]=CANDIDATE_GRID_RATIOS,
+        reference_ratio: float=GRID_RATIO,
+        tile_rows: int=None,
+        raster_workers: int=None,
+        grid_filepath: str=None,
+) -> GridResolution:
+    """Picks the coarsest grid for a floor that connects its rooms and doors
+    the same way as the grid at the reference ratio: every room label is
+    still on open space and connected to the same labels, and every door
+    is still passable (see connectivity_differences).
+
+    The grids are rasterized the way the conversion would (tiled, by a
+    thread pool or out of core), and the chosen one is returned so that it
+    is not rasterized again. At most the reference grid and one candidate
+    are kept at a time. dxf_to_graph is left at the chosen ratio, which is
+    the reference ratio if no candidate is good enough.
+
+    :param dxf_to_graph: A DXF object which contains extracted features from
+           the CAD file.
+    :param candidate_ratios: The grid ratios (step size / cell size) to try.
+           Only those below the reference ratio are tried, coarsest first.
+    :param reference_ratio: The ratio the candidates are checked against.
+    :param tile_rows: The rows rasterized at a time, e.g. the tile_rows of a
+           conversion plan, or the band rows of an out of core grid.
+    :param raster_workers: If given, the grids are rasterized by this many
+           threads (see rasterize_grid_parallel).
+    :param grid_filepath: If given, the grids are kept in MemmapGrid files
+           named after it instead of in memory. Only the file of the chosen
+           grid is left, the caller removes it.
+    :return: The chosen ratio, its number of nodes (open and door cells), the
+             number of nodes at the reference ratio, the nodes saved, the
+             reasons every coarser ratio was rejected for, and the grid at
+             the chosen ratio after mark_exterior.
+    """
+    reference_grid = _marked_grid(dxf_to_graph, reference_ratio, tile_rows, raster_workers, grid_filepath)
+    candidate_grid = None
+    try:
+        reference = grid_connectivity(reference_grid, dxf_to_graph)
+        chosen_ratio = reference_ratio
+        chosen = reference
+        rejected = {}
+        for grid_ratio in sorted(ratio for ratio in candidate_ratios if ratio < reference_ratio):
+            if int(dxf_to_graph.step_size/grid_ratio) < 1:
+                continue
+            candidate_grid = _marked_grid(dxf_to_graph, grid_ratio, tile_rows, raster_workers, grid_filepath)
+            candidate = grid_connectivity(candidate_grid, dxf_to_graph)
+            differences = connectivity_differences(reference, candidate)
+            if not differences:
+                chosen_ratio = grid_ratio
+                chosen = candidate
+                break
+            logging.debug(f"grid ratio {grid_ratio} rejected: {differences}")
+            rejected[grid_ratio] = differences
+            _discard(candidate_grid)
+            candidate_grid = None
+    except BaseException:
+        _discard(reference_grid)
+        if candidate_grid is not None:
+            _discard(candidate_grid)
+        raise
+    if candidate_grid is None:
+        chosen_grid = reference_grid
+    else:
+        chosen_grid = candidate_grid
+        _discard(reference_grid)
+    del reference_grid, candidate_grid
+
+    dxf_to_graph.set_grid_ratio(chosen_ratio)
+    resolution = GridResolution(
+        grid_ratio=chosen_ratio,
+        nodes=chosen.nodes,
+        reference_nodes=reference.nodes,
+        nodes_saved=reference.nodes - chosen.nodes,
+        rejected=rejected,
+        grid=chosen_grid,
+    )
+    logging.info(
+        f"grid ratio {chosen_ratio}: {chosen.nodes} nodes instead of {reference.nodes} "
+        f"at grid ratio {reference_ratio}"
+    )
+    return resolution
@@ -0,0 +1,145 @@
+import json
+import zlib
+from collections import namedtuple
+from typing import Dict
+from typing import List
+
+import numpy as np
+
+from dxf_reader.hospital_dxf import DXF
+from graph.grid_array import OUTSIDE_CODE
+from graph.grid_array import array_to_grid
+from graph.grid_array import grid_to_array
+from util.data_containers import Point
+from util.data_containers import RoomInfo
+from util.data_containers import SpaceType
+
+GRID_SNAPSHOT_VERSION = 1
+# cells per byte of the packed grid, the codes of grid_array fit in 2 bits
+_CELLS_PER_BYTE = 4
+_CODE_BITS = 2
+_ZLIB_LEVEL = 6
+
+# grid is a list of lists grid, or an array of cell codes if the snapshot
+# was read with as_array. offsets are the drawing coordinates of cell (0, 0)
+GridSnapshot = namedtuple("GridSnapshot", [
+    "grid",
+    "step_size",
+    "grid_ratio",
+    "grid_size",
+    "offsets",
+    "canvas_dimensions",
+    "room_labels",
+])
+
+
+def pack_cells(cells: np.ndarray) -> bytes:
+    """Packs an array of cell codes 4 cells to a byte, row by row, and
+    compresses it with zlib. Grids are long runs of the same code, so this
+    is usually a few hundred times smaller than the array.
+
+    :param cells: A 2d array of cell codes.
+    :return: The compressed cells.
+    """
+    flat = np.ascontiguousarray(cells, dtype=np.uint8).ravel()
+    if flat.size and int(flat.max()) > OUTSIDE_CODE:
+        raise ValueError(f"cell code {int(flat.max())} does not fit in {_CODE_BITS} bits")
+    padded = np.zeros(-(-flat.size // _CELLS_PER_BYTE) * _CELLS_PER_BYTE, dtype=np.uint8)
+    padded[:flat.size] = flat
+    quads = padded.reshape(-1, _CELLS_PER_BYTE)
+    packed = np.zeros(len(quads), dtype=np.uint8)
+    for k in range(_CELLS_PER_BYTE):
+        packed |= quads[:, k] << (_CODE_BITS * (_CELLS_PER_BYTE - 1 - k))
+    return zlib.compress(packed.tobytes(), _ZLIB_LEVEL)
+
+
+def unpack_cells(data: bytes, shape) -> np.ndarray:
+    """Reverses pack_cells.
+
+    :param data: The compressed cells.
+    :param shape: The shape of the array that was packed.
+    :return: A 2d uint8 array of cell codes.
+    """
+    packed = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    shifts = _CODE_BITS * np.arange(_CELLS_PER_BYTE - 1, -1, -1, dtype=np.uint8)
+    flat = (packed[:, None] >> shifts) & (2**_CODE_BITS - 1)
+    rows, columns = shape
+    return flat.ravel()[:rows * columns].reshape(rows, columns)
+
+
+def _room_label_records(room_labels: Dict[Point, RoomInfo]) -> List:
+    # make_graph_from_grid adds room_label and type to the details in place
+    return [
+        [int(position.x), int(position.y), info.room_label, {
+            key: value for key, value in info.details.items()
+            if key not in ("room_label", "type")
+        }]
+        for position, info in room_labels.items()
+    ]
+
+
+def write_grid_snapshot(
+        grid: List[List[SpaceType]],
+        dxf_info: DXF,
+        filepath: str,
+        room_labels: Dict[Point, RoomInfo]=None,
+):
+    """Saves a grid with what is needed to build a graph from it again, or
+    to map it back onto the drawing, without the dxf files: the cells
+    packed by pack_cells, the step size, grid ratio, grid size, offsets and
+    canvas of dxf_info, and the room labels. The file is an npz archive.
+
+    :param grid: A grid from get_grid, usually after mark_exterior, or an
+           array of cell codes.
+    :param dxf_info: The DXF the grid was made from.
+    :param filepath: Name of the output file.
+    :param room_labels: The room labels, keyed by cell. Defaults to
+           dxf_info.room_labels.
+    """
+    cells = grid_to_array(grid)
+    metadata = {
+        "step_size": dxf_info.step_size,
+        "grid_ratio": dxf_info.grid_ratio,
+        "grid_size": dxf_info.grid_size,
+        "offsets": [float(offset) for offset in dxf_info.offsets],
+        "canvas_dimensions": [float(dimension) for dimension in dxf_info.new_canvas_dimensions],
+        "room_labels": _room_label_records(
+            dxf_info.room_labels if room_labels is None else room_labels
+        ),
+    }
+    with open(filepath, "wb") as outfile:
+        np.savez(
+            outfile,
+            format_version=np.array([GRID_SNAPSHOT_VERSION], dtype=np.int64),
+            shape=np.array(cells.shape, dtype=np.int64),
+            cells=np.frombuffer(pack_cells(cells), dtype=np.uint8),
+            metadata=np.array(json.dumps(metadata)),
+        )
+
+
+def read_grid_snapshot(filepath: str, as_array: bool=False) -> GridSnapshot:
+    """Reads a grid saved by write_grid_snapshot. The grid and room labels
+    can go straight into make_graph_from_grid.
+
+    :param filepath: Path to the snapshot.
+    :param as_array: If True, the grid is returned as an array of cell
+           codes instead of a list of lists.
+    :return: The snapshot.
+    """
+    with np.load(filepath, allow_pickle=False) as archive:
+        if int(archive["format_version"][0]) > GRID_SNAPSHOT_VERSION:
+            raise ValueError(f"{filepath} uses an unsupported grid snapshot version")
+        cells = unpack_cells(archive["cells"].tobytes(), archive["shape"].tolist())
+        metadata = json.loads(str(archive["metadata"]))
+    return GridSnapshot(
+        grid=cells if as_array else array_to_grid(cells),
+        step_size=metadata["step_size"],
+        grid_ratio=metadata["grid_ratio"],
+        grid_size=metadata["grid_size"],
+        offsets=metadata["offsets"],
+        canvas_dimensions=metadata["canvas_dimensions"],
+        room_labels={
+            Point(x=x, y=y): RoomInfo(room_label=room_label, details=details)
+            for x, y, room_label, details in metadata["room_labels"]
+        },
+    )
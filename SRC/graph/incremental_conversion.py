@@ -0,0 +1,259 @@
+import logging
+import os
+import pickle
+from collections import Counter
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+from networkx import Graph
+from scipy.ndimage import maximum_filter
+from shapely import wkb
+
+from dxf_reader.hospital_dxf import DXF
+from graph.extract_grid_from_dxf import mark_exterior
+from graph.extract_grid_from_dxf import rasterize_grid_region
+from graph.graph_sparsifier import add_distance_reducing_edges
+from graph.graph_sparsifier import join_components
+from graph.graph_sparsifier import sparsify_add_edges
+from graph.graph_sparsifier import sparsify_add_nodes
+from graph.graph_sparsifier import sparsify_add_nodes_with_labels
+from graph.graph_sparsifier import sparsify_add_rooms
+from graph.grid_array import array_to_grid
+from graph.grid_array import grid_to_array
+from graph.grid_to_graph_converter import make_graph_from_grid
+from util.constants import SPARSITY_LEVEL
+from util.data_containers import RoomInfo
+from util.data_containers import SpaceType
+
+FLOOR_CACHE_VERSION = 2
+
+
+def floor_cache_filepath(outfile: str) -> str:
+    """The file the conversion of a floor is cached in, next to its outputs."""
+    return f"{outfile}.cache.pkl"
+
+
+def _geometry_keys(shapes) -> List[bytes]:
+    return [wkb.dumps(shape) for shape in shapes]
+
+
+def copy_room_labels(room_labels: Dict) -> Dict:
+    """Copies the room labels of a DXF. make_graph_from_grid adds room_label
+    and type to their details in place, the cache keeps them as read from
+    the dxf."""
+    return {
+        position: RoomInfo(room_label=info.room_label, details=dict(info.details))
+        for position, info in room_labels.items()
+    }
+
+
+def make_floor_cache(
+        dxf_info: DXF,
+        raw_grid: np.ndarray,
+        grid: np.ndarray,
+        sparsified_graph: Graph,
+        room_labels: Dict,
+) -> Dict:
+    """Collects what an incremental conversion of the floor needs.
+
+    :param dxf_info: The DXF the floor was converted from.
+    :param raw_grid: The grid from get_grid, as cell codes.
+    :param grid: The grid after mark_exterior, as cell codes.
+    :param sparsified_graph: The graph from sparsify_graph.
+    :param room_labels: A copy of dxf_info.room_labels made before the
+           graph was built from the grid.
+    :return: The floor cache.
+    """
+    return {
+        "version": FLOOR_CACHE_VERSION,
+        "step_size": dxf_info.step_size,
+        "grid_ratio": dxf_info.grid_ratio,
+        "offsets": list(dxf_info.offsets),
+        "canvas_dimensions": list(dxf_info.new_canvas_dimensions),
+        "walls": _geometry_keys(dxf_info.walls),
+        "doors": _geometry_keys(dxf_info.doors),
+        "room_labels": room_labels,
+        "raw_grid": raw_grid,
+        "grid": grid,
+        "sparsified_graph": sparsified_graph,
+    }
+
+
+def write_floor_cache(cache: Dict, filepath: str):
+    with open(filepath, "wb") as cache_file:
+        pickle.dump(cache, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def read_floor_cache(filepath: str) -> Optional[Dict]:
+    """Reads a floor cache.
+
+    :param filepath: The cache file.
+    :return: The floor cache, or None if there is no cache of the current
+             version.
+    """
+    if not os.path.exists(filepath):
+        return None
+    with open(filepath, "rb") as cache_file:
+        cache = pickle.load(cache_file)
+    if cache.get("version") != FLOOR_CACHE_VERSION:
+        logging.info(f"ignoring {filepath}, it has an old cache version")
+        return None
+    return cache
+
+
+def is_cache_compatible(cache: Dict, dxf_info: DXF) -> bool:
+    """A cache can only be updated incrementally if the grid has not moved
+    or changed size, i.e. the step size, grid ratio and canvas are the
+    same."""
+    return (
+        cache["step_size"] == dxf_info.step_size and
+        cache["grid_ratio"] == dxf_info.grid_ratio and
+        cache["offsets"] == list(dxf_info.offsets) and
+        cache["canvas_dimensions"] == list(dxf_info.new_canvas_dimensions)
+    )
+
+
+def _changed_geometries(old_keys: List[bytes], new_shapes) -> List:
+    new_keys = _geometry_keys(new_shapes)
+    changed = (Counter(old_keys) - Counter(new_keys)) + (Counter(new_keys) - Counter(old_keys))
+    return [wkb.loads(key) for key in changed]
+
+
+def changed_grid_regions(
+        cache: Dict,
+        dxf_info: DXF,
+        grid_shape: Tuple[int, int],
+) -> List[Tuple[int, int, int, int]]:
+    """Finds the grid regions covered by walls and doors that were added to
+    or removed from the floor since the cache was made.
+
+    :param cache: The floor cache.
+    :param dxf_info: The DXF of the revised floor.
+    :param grid_shape: The shape of the grid.
+    :return: Non overlapping (min_i, min_j, max_i, max_j) cell regions, max
+             excluded.
+    """
+    grid_size = dxf_info.grid_size
+    changed = _changed_geometries(cache["walls"], dxf_info.walls)
+    changed += _changed_geometries(cache["doors"], dxf_info.doors)
+    logging.info(f"{len(changed)} walls and doors changed")
+
+    regions = []
+    for shape in changed:
+        if shape.is_empty:
+            continue
+        minx, miny, maxx, maxy = shape.bounds
+        region = [
+            max(int(minx/grid_size) - 1, 0),
+            max(int(miny/grid_size) - 1, 0),
+            min(int(maxx/grid_size) + 2, grid_shape[0]),
+            min(int(maxy/grid_size) + 2, grid_shape[1]),
+        ]
+        # merge with the regions it overlaps, until none is left
+        overlapping = True
+        while overlapping:
+            overlapping = False
+            for other in regions:
+                if other[0] < region[2] and region[0] < other[2] and \
+                        other[1] < region[3] and region[1] < other[3]:
+                    regions.remove(other)
+                    region = [
+                        min(region[0], other[0]),
+                        min(region[1], other[1]),
+                        max(region[2], other[2]),
+                        max(region[3], other[3]),
+                    ]
+                    overlapping = True
+                    break
+        regions.append(region)
+    return [tuple(region) for region in regions]
+
+
+def _changed_label_cells(old_labels: Dict, new_labels: Dict) -> List:
+    return [
+        position
+        for position in set(old_labels) | set(new_labels)
+        if old_labels.get(position) != new_labels.get(position)
+    ]
+
+
+def _dilate(mask: np.ndarray, radius: int) -> np.ndarray:
+    """Grows a mask of cells by radius cells in every direction (including
+    diagonals), which bounds how far a graph search of that cutoff reaches."""
+    return maximum_filter(mask.astype(np.uint8), size=2*radius+1, mode="constant") > 0
+
+
+def update_floor_graph(
+        cache: Dict,
+        dxf_info: DXF,
+        sparsity_level: int=SPARSITY_LEVEL,
+) -> Tuple[np.ndarray, List[List[SpaceType]], Graph, Dict]:
+    """Updates the conversion of a floor to a revised dxf.
+
+    Only the grid regions of the walls and doors that changed are
+    rasterized again. The sparsified graph is then only recomputed near the
+    cells whose type or room label changed: sparse nodes within
+    sparsity_level of a changed cell are reselected (from the candidates
+    within 2*sparsity_level), and the edges of sparse nodes within the
+    reach of the edge cutoffs of those are rebuilt. Nodes and edges further
+    away are kept as they are.
+
+    :param cache: The floor cache of the previous conversion.
+    :param dxf_info: The DXF of the revised floor.
+    :param sparsity_level: The sparsity level the cache was made with.
+    :return: The raw grid (cell codes), the grid after mark_exterior, the
+             sparsified graph and a copy of the room labels, as needed by
+             make_floor_cache.
+    """
+    room_labels = copy_room_labels(dxf_info.room_labels)
+    raw_grid = array_to_grid(cache["raw_grid"])
+    regions = changed_grid_regions(cache, dxf_info, (len(raw_grid), len(raw_grid[0])))
+    for region in regions:
+        rasterize_grid_region(raw_grid, dxf_info, region)
+    raw_grid_codes = grid_to_array(raw_grid)
+    grid = raw_grid
+    mark_exterior(grid)
+    grid_codes = grid_to_array(grid)
+
+    changed = grid_codes != cache["grid"]
+    for position in _changed_label_cells(cache["room_labels"], room_labels):
+        if 0 <= position.x < changed.shape[0] and 0 <= position.y < changed.shape[1]:
+            changed[position.x, position.y] = True
+    logging.info(f"{int(changed.sum())} grid cells changed in {len(regions)} regions")
+
+    graph = make_graph_from_grid(grid, dxf_info.room_labels)
+    sparsified_graph = cache["sparsified_graph"].copy()
+    if not changed.any():
+        return raw_grid_codes, grid, sparsified_graph, room_labels
+
+    reselected = _dilate(changed, sparsity_level)
+    candidate_cells = _dilate(changed, 2*sparsity_level)
+    rewired = _dilate(candidate_cells, 2*sparsity_level+1)
+
+    removed_nodes = [
+        node for node in sparsified_graph.nodes
+        if reselected[node.x, node.y] or node not in graph
+    ]
+    sparsified_graph.remove_nodes_from(removed_nodes)
+    candidates = [node for node in graph.nodes if candidate_cells[node.x, node.y]]
+    number_of_nodes = sparsified_graph.number_of_nodes()
+    sparsify_add_nodes_with_labels(graph, sparsified_graph, candidates=candidates)
+    sparsify_add_rooms(graph, sparsified_graph, sparsity_level, candidates=candidates)
+    sparsify_add_nodes(graph, sparsified_graph, sparsity_level, candidates=candidates)
+    logging.info(
+        f"{len(removed_nodes)} sparse nodes removed, "
+        f"{sparsified_graph.number_of_nodes() - number_of_nodes} added"
+    )
+
+    sources = {node for node in sparsified_graph.nodes if rewired[node.x, node.y]}
+    sparsified_graph.remove_edges_from(list(sparsified_graph.edges(sources)))
+    sparsify_add_edges(graph, sparsified_graph, cutoff=int(1.5 * sparsity_level), sources=sources)
+    add_distance_reducing_edges(graph, sparsified_graph, cutoff=int(1.8*sparsity_level), sources=sources)
+    add_distance_reducing_edges(graph, sparsified_graph, cutoff=int(2*sparsity_level+1), sources=sources)
+    join_components(graph, sparsified_graph, sparsity_level, sources=sources)
+    logging.info(f"edges of {len(sources)} sparse nodes rebuilt")
+
+    return raw_grid_codes, grid, sparsified_graph, room_labels
@@ -1,30 +1,53 @@
+import heapq
+import itertools
 import logging
 
 from networkx import Graph
 
-from graph.graph_utils import compute_neighborhood_cached
+from graph.room_label_index import invalidate_room_label_index
+
+LABEL_PROPAGATION_CUTOFF = 5
 
 
 def propagate_labels(
         sparsified_graph: Graph,
+        cutoff: float=LABEL_PROPAGATION_CUTOFF,
 ):
+    """Gives every unlabelled node the label of its nearest labelled node
+    (by `weight2` distance, up to `cutoff`), marked with a trailing '~~'.
+    This is a single multi-source Dijkstra seeded from all labelled nodes.
+    Ties between equally near rooms are broken by the smallest room label,
+    then by the smallest source node, so the result does not depend on node
+    iteration order.
+
+    :param sparsified_graph: The graph to label. It is modified in place.
+    :param cutoff: The maximum `weight2` distance a label is propagated.
+    """
     logging.info("Propagating Labels")
-    labelled_nodes = set()
-    for node in sparsified_graph.nodes:
-        if sparsified_graph.nodes[node]["room_label"]:
-            labelled_nodes.add(node)
-            
-    print("len labeled node", len(labelled_nodes))
+    nodes = sparsified_graph.nodes
+    seeds = sorted(
+        (nodes[node]["room_label"], node)
+        for node in nodes
+        if nodes[node]["room_label"]
+    )
+    logging.info(f"len labeled node {len(seeds)}")
 
-    for node in labelled_nodes:
-        for cutoff in range(1, 6):
-            nhood = compute_neighborhood_cached(
-                G=sparsified_graph,
-                source=node,
-                cutoff=cutoff,
-                weight="weight2",
-            )
-            for neighbor in nhood:
-                if not sparsified_graph.nodes[neighbor]["room_label"]:
-                    sparsified_graph.nodes[neighbor]["room_label"] = \
-                        f'{sparsified_graph.nodes[node]["room_label"]}~~'
+    counter = itertools.count()
+    heap = [(0, rank, next(counter), node) for rank, (_, node) in enumerate(seeds)]
+    heapq.heapify(heap)
+    settled = set()
+    adjacency = sparsified_graph.adj
+    while heap:
+        distance, rank, _, node = heapq.heappop(heap)
+        if node in settled:
+            continue
+        settled.add(node)
+        if not nodes[node]["room_label"]:
+            nodes[node]["room_label"] = f"{seeds[rank][0]}~~"
+        for neighbor, edge_attributes in adjacency[node].items():
+            if neighbor in settled:
+                continue
+            neighbor_distance = distance + edge_attributes.get("weight2", 1)
+            if neighbor_distance <= cutoff:
+                heapq.heappush(heap, (neighbor_distance, rank, next(counter), neighbor))
+    invalidate_room_label_index(sparsified_graph)
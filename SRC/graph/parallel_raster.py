@@ -0,0 +1,178 @@
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from typing import Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry import box
+from shapely.prepared import prep
+
+from dxf_reader.hospital_dxf import DXF
+from graph.extract_grid_from_dxf import grid_shape
+from graph.grid_array import DOOR_CODE
+from graph.grid_array import WALL_CODE
+from graph.grid_array import array_to_grid
+from util.data_containers import SpaceType
+
+# bands per worker, so that a band crowded with walls does not hold up
+# the others
+BANDS_PER_WORKER = 4
+# shapely 2 has vectorized functions that run without the GIL, with shapely
+# 1 (see README.md) the shapes are tested one box at a time
+VECTORIZED_SHAPELY = int(shapely.__version__.split(".")[0]) >= 2
+
+
+def _shape_cell_bounds(shapes: np.ndarray, grid_size: float) -> np.ndarray:
+    """The (min_i, min_j, max_i, max_j) cells, max included, whose boxes may
+    touch the bounds of every shape. Like the rtree of get_grid, cells that
+    only touch a shape's bounds are included, intersects decides."""
+    bounds = np.array([shape.bounds for shape in shapes], dtype=float).reshape(-1, 4)
+    cell_bounds = np.empty(bounds.shape, dtype=np.int64)
+    cell_bounds[:, :2] = np.ceil(bounds[:, :2] / grid_size) - 1
+    cell_bounds[:, 2:] = np.floor(bounds[:, 2:] / grid_size)
+    return cell_bounds
+
+
+def _candidate_cells(cell_bounds: np.ndarray, min_i: int, max_i: int, columns: int) -> Tuple[np.ndarray, ...]:
+    """Every (shape, i, j) with the cell (i, j) of rows min_i to max_i
+    (excluded) in the cell bounds of the shape."""
+    min_is = np.maximum(cell_bounds[:, 0], min_i)
+    max_is = np.minimum(cell_bounds[:, 2], max_i - 1)
+    min_js = np.maximum(cell_bounds[:, 1], 0)
+    max_js = np.minimum(cell_bounds[:, 3], columns - 1)
+    heights = np.maximum(max_is - min_is + 1, 0)
+    widths = np.maximum(max_js - min_js + 1, 0)
+    counts = heights * widths
+    shape_ids = np.repeat(np.arange(len(cell_bounds)), counts)
+    # the position of every candidate among those of its shape
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    row_widths = np.maximum(widths[shape_ids], 1)
+    i = min_is[shape_ids] + offsets // row_widths
+    j = min_js[shape_ids] + offsets % row_widths
+    return shape_ids, i, j
+
+
+def _prepare(shapes: np.ndarray) -> np.ndarray:
+    """Prepares the shapes for many intersects calls."""
+    if VECTORIZED_SHAPELY:
+        shapely.prepare(shapes)
+        return shapes
+    prepared = np.empty(len(shapes), dtype=object)
+    prepared[:] = [prep(shape) for shape in shapes]
+    return prepared
+
+
+def _intersects(
+        shapes: np.ndarray,
+        i: np.ndarray,
+        j: np.ndarray,
+        grid_size: float,
+) -> np.ndarray:
+    """Whether the box of cell (i[k], j[k]) intersects shapes[k], for
+    every k."""
+    if VECTORIZED_SHAPELY:
+        # vectorized GEOS calls, which run without the GIL
+        boxes = shapely.box(i * grid_size, j * grid_size, (i + 1) * grid_size, (j + 1) * grid_size)
+        return shapely.intersects(boxes, shapes)
+    hits = np.zeros(len(shapes), dtype=bool)
+    for k, (shape, cell_i, cell_j) in enumerate(zip(shapes, i.tolist(), j.tolist())):
+        cell = box(cell_i * grid_size, cell_j * grid_size, (cell_i + 1) * grid_size, (cell_j + 1) * grid_size)
+        hits[k] = shape.intersects(cell)
+    return hits
+
+
+def _rasterize_band(
+        cells: np.ndarray,
+        layers: List[Tuple[np.ndarray, np.ndarray, int]],
+        grid_size: float,
+        min_i: int,
+        max_i: int,
+):
+    """Burns the prepared shapes of every layer into the rows min_i to
+    max_i (excluded) of cells, layer after layer, so that the later layers
+    overwrite the earlier ones. Writes nothing outside these rows."""
+    for shapes, cell_bounds, code in layers:
+        in_band = (cell_bounds[:, 2] >= min_i) & (cell_bounds[:, 0] < max_i)
+        shape_ids, i, j = _candidate_cells(cell_bounds[in_band], min_i, max_i, cells.shape[1])
+        if not len(shape_ids):
+            continue
+        hits = _intersects(shapes[in_band][shape_ids], i, j, grid_size)
+        cells[i[hits], j[hits]] = code
+
+
+def rasterize_grid_parallel(
+        dxf_to_graph: DXF,
+        workers: int=None,
+        band_rows: int=None,
+        max_band_rows: int=None,
+) -> np.ndarray:
+    """Rasterizes the walls and doors of a floor like get_grid, from a
+    thread pool. The rows of the grid are split into bands, every band is
+    rasterized by one thread from the shapes that overlap it, doors first
+    and then walls so that walls overwrite doors as in get_grid. The bands
+    do not overlap, so the threads never write the same cells.
+
+    :param dxf_to_graph: A DXF object which contains extracted features from
+           the CAD file.
+    :param workers: The number of threads, os.cpu_count() if None. 0
+           rasterizes the bands in the calling thread.
+    :param band_rows: The rows of a band. By default the grid is split into
+           BANDS_PER_WORKER bands per thread.
+    :param max_band_rows: The most rows rasterized at once by all threads
+           together, e.g. the tile_rows of a conversion plan. The candidate
+           cells of a band are all made at once, so this bounds the memory.
+    :return: The grid as a uint8 array of cell codes (see grid_array).
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    grid_size = dxf_to_graph.grid_size
+    rows, columns = grid_shape(dxf_to_graph)
+    cells = np.zeros((rows, columns), dtype=np.uint8)
+    if band_rows is None:
+        band_rows = max(math.ceil(rows / (max(workers, 1) * BANDS_PER_WORKER)), 1)
+    if max_band_rows is not None:
+        band_rows = max(min(band_rows, max_band_rows // max(workers, 1)), 1)
+
+    layers = []
+    for shapes, code in ((dxf_to_graph.doors, DOOR_CODE), (dxf_to_graph.walls, WALL_CODE)):
+        shapes = np.array([shape for shape in shapes if not shape.is_empty], dtype=object)
+        if not len(shapes):
+            continue
+        layers.append((_prepare(shapes), _shape_cell_bounds(shapes, grid_size), code))
+
+    bands = [(min_i, min(min_i + band_rows, rows)) for min_i in range(0, rows, band_rows)]
+    logging.info(f"rasterizing {len(bands)} bands of {band_rows} rows with {workers} threads")
+    if workers == 0:
+        for min_i, max_i in bands:
+            _rasterize_band(cells, layers, grid_size, min_i, max_i)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_rasterize_band, cells, layers, grid_size, min_i, max_i)
+                for min_i, max_i in bands
+            ]
+            for future in futures:
+                future.result()
+    return cells
+
+
+def get_grid_parallel(
+        dxf_to_graph: DXF,
+        workers: int=None,
+        band_rows: int=None,
+        max_band_rows: int=None,
+) -> List[List[SpaceType]]:
+    """get_grid with rasterize_grid_parallel.
+
+    :param dxf_to_graph: A DXF object which contains extracted features from
+           the CAD file.
+    :param workers: The number of threads, see rasterize_grid_parallel.
+    :param band_rows: The rows of a band, see rasterize_grid_parallel.
+    :param max_band_rows: The most rows rasterized at once, see
+           rasterize_grid_parallel.
+    :return: The grid, the same as get_grid's.
+    """
+    return array_to_grid(rasterize_grid_parallel(dxf_to_graph, workers, band_rows, max_band_rows))
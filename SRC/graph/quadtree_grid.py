@@ -0,0 +1,174 @@
+from collections import namedtuple
+from typing import Dict
+from typing import List
+
+import numpy as np
+from networkx import Graph
+from scipy import ndimage
+
+from graph.grid_array import DOOR_CODE
+from graph.grid_array import OPEN_CODE
+from graph.grid_array import WALL_CODE
+from graph.grid_array import grid_to_array
+from util.data_containers import Node
+from util.data_containers import Node_4d
+from util.data_containers import Point
+from util.data_containers import RoomInfo
+from util.data_containers import SpaceType
+
+# the largest leaves, in cells. Leaves no wider than the sparsity level keep
+# the centres of neighbouring leaves within the edge cutoff of the sparsifier
+QUADTREE_MAX_BLOCK = 8
+# cells this close to a wall or door are never merged
+QUADTREE_MARGIN = 2
+
+# a square block of size x size cells with its lowest corner at cell (i, j)
+QuadtreeLeaf = namedtuple("QuadtreeLeaf", ["i", "j", "size"])
+
+
+def _integral(mask: np.ndarray) -> np.ndarray:
+    integral = np.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype=np.int64)
+    integral[1:, 1:] = mask.cumsum(axis=0).cumsum(axis=1)
+    return integral
+
+
+def _block_sum(integral: np.ndarray, i: int, j: int, size: int) -> int:
+    max_i = min(i + size, integral.shape[0] - 1)
+    max_j = min(j + size, integral.shape[1] - 1)
+    return int(integral[max_i, max_j] - integral[i, max_j] - integral[max_i, j] + integral[i, j])
+
+
+def build_quadtree(
+        grid: List[List[SpaceType]],
+        room_infos: Dict[Point, RoomInfo]=None,
+        max_block: int=QUADTREE_MAX_BLOCK,
+        margin: int=QUADTREE_MARGIN,
+) -> List[QuadtreeLeaf]:
+    """Decomposes the open space of a grid into square leaves: blocks of up
+    to max_block cells that are open, at least margin cells away from walls
+    and doors and without room labels are merged, everything else is kept
+    at full resolution.
+
+    :param grid: A grid from get_grid, after mark_exterior.
+    :param room_infos: The room labels, their cells are never merged.
+    :param max_block: The size of the largest leaves, rounded down to a power
+           of 2.
+    :param margin: Cells within margin cells of a wall or door are not
+           merged.
+    :return: The leaves that cover the open and door cells of the grid.
+    """
+    cells = grid_to_array(grid)
+    walkable = (cells == OPEN_CODE) | (cells == DOOR_CODE)
+    mergeable = cells == OPEN_CODE
+    if margin > 0:
+        obstacles = (cells == WALL_CODE) | (cells == DOOR_CODE)
+        mergeable &= ~ndimage.binary_dilation(
+            obstacles,
+            structure=np.ones((3, 3), dtype=bool),
+            iterations=margin,
+        )
+    for position in room_infos or ():
+        if 0 <= position.x < cells.shape[0] and 0 <= position.y < cells.shape[1]:
+            mergeable[position.x, position.y] = False
+    walkable_integral = _integral(walkable)
+    mergeable_integral = _integral(mergeable)
+
+    block = 1
+    while block * 2 <= max_block:
+        block *= 2
+    leaves = []
+    stack = [
+        (i, j, block)
+        for i in range(0, cells.shape[0], block)
+        for j in range(0, cells.shape[1], block)
+    ]
+    while stack:
+        i, j, size = stack.pop()
+        if not _block_sum(walkable_integral, i, j, size):
+            continue
+        inside = i + size <= cells.shape[0] and j + size <= cells.shape[1]
+        if size == 1 or (inside and _block_sum(mergeable_integral, i, j, size) == size * size):
+            leaves.append(QuadtreeLeaf(i=i, j=j, size=size))
+            continue
+        half = size // 2
+        stack.extend((
+            (i, j, half),
+            (i + half, j, half),
+            (i, j + half, half),
+            (i + half, j + half, half),
+        ))
+    return leaves
+
+
+def make_graph_from_quadtree(
+        grid: List[List[SpaceType]],
+        room_infos: Dict[Point, RoomInfo],
+        floor=0,
+        building="",
+        max_block: int=QUADTREE_MAX_BLOCK,
+        margin: int=QUADTREE_MARGIN,
+) -> Graph:
+    """Builds a graph like make_graph_from_grid, with a node for every leaf of
+    build_quadtree instead of every cell, which can be sparsified the same
+    way. A leaf's node is at its central cell, leaves are connected if they
+    touch, also diagonally, with the octile distance between their nodes as
+    weight. Away from walls and doors this has far fewer nodes than the grid
+    graph, near them the graphs are the same.
+
+    :param grid: A grid from get_grid, after mark_exterior.
+    :param room_infos: The room labels, keyed by cell.
+    :param floor: The floor of the nodes.
+    :param building: The building of the nodes.
+    :param max_block: The size of the largest leaves.
+    :param margin: Cells within margin cells of a wall or door are not
+           merged.
+    :return: The graph over the leaves.
+    """
+    cells = grid_to_array(grid)
+    leaves = build_quadtree(cells, room_infos, max_block, margin)
+    leaf_ids = np.full(cells.shape, -1, dtype=np.int64)
+    nodes = []
+    graph = Graph()
+    for leaf_id, leaf in enumerate(leaves):
+        leaf_ids[leaf.i:leaf.i+leaf.size, leaf.j:leaf.j+leaf.size] = leaf_id
+        x = leaf.i + leaf.size // 2
+        y = leaf.j + leaf.size // 2
+        node = Node_4d(x=x, y=y, floor=floor, building=building)
+        nodes.append(node)
+        room_info = room_infos.get(Node(x=x, y=y)) if leaf.size == 1 else None
+        node_details = dict(room_info.details) if room_info is not None else {}
+        node_details["room_label"] = room_info.room_label if room_info is not None else ""
+        node_details["type"] = SpaceType(int(cells[x, y]))
+        graph.add_node(node, **node_details)
+
+    rows, columns = cells.shape
+    for di, dj in ((1, 0), (0, 1), (1, 1), (1, -1)):
+        source = leaf_ids[:rows-di, max(-dj, 0):columns-max(dj, 0)]
+        target = leaf_ids[di:, max(dj, 0):columns-max(-dj, 0)]
+        touching = (source >= 0) & (target >= 0) & (source != target)
+        pairs = np.unique(
+            np.sort(np.stack([source[touching], target[touching]], axis=1), axis=1),
+            axis=0,
+        )
+        for u_id, v_id in pairs.tolist():
+            u = nodes[u_id]
+            v = nodes[v_id]
+            if graph.has_edge(u, v):
+                continue
+            dx = abs(u.x - v.x)
+            dy = abs(u.y - v.y)
+            weight = max(dx, dy) + 0.4 * min(dx, dy)
+            if graph.nodes[u]["type"] == SpaceType.DOOR or graph.nodes[v]["type"] == SpaceType.DOOR:
+                weight2 = 1000
+                edge_type = "door"
+            else:
+                weight2 = weight
+                edge_type = "normal"
+            graph.add_edge(
+                u,
+                v,
+                type=edge_type,
+                weight=weight,
+                weight2=weight2,
+            )
+    return graph
@@ -0,0 +1,263 @@
+import logging
+from collections import namedtuple
+from typing import Dict
+
+import numpy as np
+
+from dxf_reader.hospital_dxf import DXF
+from graph.extract_grid_from_dxf import grid_shape
+from graph.grid_memmap import DEFAULT_BAND_ROWS
+from graph.graph_utils import compute_neighborhood_cached
+from util.constants import SPARSITY_LEVEL
+
+# Calibrated on synthetic floors (python 3, shapely 2, networkx 2). These
+# are rough estimates to catch grids that are orders of magnitude too large,
+# not predictions to the megabyte.
+
+# a reference to SpaceType.OPEN in the grid's lists
+GRID_CELL_BYTES = 8
+# the shapely box and rtree entry of a cell while get_grid rasterizes it
+RASTER_CELL_BYTES = 480
+# a node of the grid graph with its attributes and ~4 edges
+GRAPH_NODE_BYTES = 1700
+# an entry of compute_neighborhood_cached for SPARSITY_LEVEL hops
+NEIGHBORHOOD_BYTES = 13000
+# the fraction of the cells inside the floor that are open, i.e. not walls
+OPEN_FRACTION = 0.9
+# the leaves of build_quadtree per open cell
+QUADTREE_NODE_FRACTION = 0.35
+# the cell codes, integral images and leaf ids of build_quadtree
+QUADTREE_CELL_BYTES = 40
+# the images of skeletonize and the labels of make_skeleton_graph
+SKELETON_CELL_BYTES = 90
+# the resolution of the coarse grid used to estimate the floor's extent
+EXTENT_BLOCKS = 32
+# edges per node of the grid graph and of the sparsified graph
+GRAPH_EDGES_PER_NODE = 3.75
+SPARSE_EDGES_PER_NODE = 3.2
+
+GET_GRID_SECONDS_PER_CELL = 1.1e-4
+MARK_EXTERIOR_SECONDS_PER_CELL = 1e-5
+MAKE_GRAPH_SECONDS_PER_NODE = 2e-4
+SPARSIFY_SECONDS_PER_NODE = 1.5e-3
+SKELETON_SECONDS_PER_CELL = 1e-5
+
+PROCEED = "proceed"
+TILED = "tiled"
+ABORT = "abort"
+
+ResourceBudget = namedtuple("ResourceBudget", ["max_memory", "max_cells", "max_seconds"])
+ResourceBudget.__new__.__defaults__ = (None, None, None)
+ConversionPlan = namedtuple("ConversionPlan", [
+    "canvas",
+    "grid_size",
+    "grid_shape",
+    "cells",
+    "interior_fraction",
+    "nodes",
+    "edges",
+    "sparsified_nodes",
+    "sparsified_edges",
+    "stages",
+    "peak_memory",
+    "seconds",
+    "action",
+    "tile_rows",
+    "reasons",
+])
+
+
+class ResourceBudgetExceeded(RuntimeError):
+    def __init__(self, message: str, plan: ConversionPlan):
+        super().__init__(message)
+        self.plan = plan
+
+
+def estimate_interior_fraction(dxf_to_graph: DXF, blocks: int=EXTENT_BLOCKS) -> float:
+    """Estimates the fraction of the canvas that mark_exterior leaves inside
+    the floor, from the bounding boxes of the walls and doors on a coarse
+    blocks x blocks grid: a block is inside if there are walls or doors
+    before and after it both along its row and along its column. A stray
+    entity far away from the floor enlarges the canvas, but not the inside.
+
+    :param dxf_to_graph: A DXF object which contains extracted features from
+           the CAD file.
+    :param blocks: The resolution of the coarse grid.
+    :return: The estimated fraction, between 0 and 1.
+    """
+    width, height = dxf_to_graph.new_canvas_dimensions
+    if width <= 0 or height <= 0:
+        return 0.0
+    occupied = np.zeros((blocks, blocks), dtype=bool)
+    for shape in list(dxf_to_graph.walls) + list(dxf_to_graph.doors):
+        if shape.is_empty:
+            continue
+        min_x, min_y, max_x, max_y = shape.bounds
+        occupied[
+            max(int(min_x / width * blocks), 0):min(int(max_x / width * blocks), blocks-1) + 1,
+            max(int(min_y / height * blocks), 0):min(int(max_y / height * blocks), blocks-1) + 1,
+        ] = True
+    # inside the first and last occupied block of the row / column
+    along_rows = np.maximum.accumulate(occupied, axis=1) & np.maximum.accumulate(occupied[:, ::-1], axis=1)[:, ::-1]
+    along_columns = np.maximum.accumulate(occupied, axis=0) & np.maximum.accumulate(occupied[::-1], axis=0)[::-1]
+    return float((along_rows & along_columns).mean())
+
+
+def _stage_estimates(
+        rows: int,
+        columns: int,
+        nodes: int,
+        sparsity_level: int,
+        tile_rows: int=None,
+        out_of_core: bool=False,
+        quadtree: bool=False,
+        skeleton: bool=False,
+) -> Dict[str, Dict[str, float]]:
+    """The memory in use at the peak of, and the run time of the stages of
+    a conversion from get_grid to the sparse graph, for the graph the
+    conversion builds: nodes are the nodes of the grid or quadtree graph."""
+    cells = rows * columns
+    grid_bytes = _grid_bytes(cells, out_of_core)
+    raster_cells = min(tile_rows or (DEFAULT_BAND_ROWS if out_of_core else rows), rows) * columns
+    stages = {
+        "get grid": {
+            "memory": grid_bytes + raster_cells * RASTER_CELL_BYTES,
+            "seconds": cells * GET_GRID_SECONDS_PER_CELL,
+        },
+        "mark exterior": {
+            "memory": grid_bytes,
+            "seconds": cells * MARK_EXTERIOR_SECONDS_PER_CELL,
+        },
+    }
+    if skeleton:
+        stages["skeleton graph"] = {
+            "memory": grid_bytes + cells * SKELETON_CELL_BYTES,
+            "seconds": cells * SKELETON_SECONDS_PER_CELL,
+        }
+        return stages
+
+    graph_bytes = nodes * GRAPH_NODE_BYTES
+    if quadtree:
+        graph_bytes += cells * QUADTREE_CELL_BYTES
+    cached_neighborhoods = min(nodes, compute_neighborhood_cached.cache_info().maxsize or nodes)
+    neighborhood_bytes = NEIGHBORHOOD_BYTES * (sparsity_level / SPARSITY_LEVEL)**2
+    stages["make graph from grid"] = {
+        "memory": grid_bytes + graph_bytes,
+        "seconds": nodes * MAKE_GRAPH_SECONDS_PER_NODE,
+    }
+    stages["sparsify graph"] = {
+        "memory": grid_bytes + graph_bytes + cached_neighborhoods * neighborhood_bytes,
+        "seconds": nodes * SPARSIFY_SECONDS_PER_NODE,
+    }
+    return stages
+
+
+def _grid_bytes(cells: int, out_of_core: bool) -> int:
+    """The memory of the grid, none for the file of an out of core grid,
+    whose pages the os can drop."""
+    return 0 if out_of_core else cells * GRID_CELL_BYTES
+
+
+def plan_conversion(
+        dxf_to_graph: DXF,
+        budget: ResourceBudget=ResourceBudget(),
+        sparsity_level: int=SPARSITY_LEVEL,
+        out_of_core: bool=False,
+        quadtree: bool=False,
+        skeleton: bool=False,
+) -> ConversionPlan:
+    """Estimates the size of the grid and graphs of a conversion and the
+    memory and time its stages need, before anything is rasterized, and
+    decides how to go on under a budget:
+
+    - proceed: everything fits in the budget.
+    - tiled: only rasterizing the grid does not fit in max_memory, it fits
+      when get_grid rasterizes bands of tile_rows rows at a time (the bands
+      of an out of core grid).
+    - abort: the grid has more than max_cells cells, the conversion would
+      take more than max_seconds, or even a tiled conversion would not fit
+      in max_memory. A far away stray entity or a wrong step size are the
+      usual causes, so the canvas is part of the plan.
+
+    :param dxf_to_graph: A DXF object which contains extracted features from
+           the CAD file.
+    :param budget: The limits, in bytes, cells and seconds. None means no
+           limit.
+    :param sparsity_level: The sparsity level of sparsify_graph.
+    :param out_of_core: If True, the grid is kept in a file and processed in
+           bands, as with extract_graph_from_dxf's out_of_core.
+    :param quadtree: If True, the graph has a node per quadtree leaf.
+    :param skeleton: If True, the sparse graph is built from the skeleton of
+           the grid, no grid graph is built or sparsified.
+    :return: The plan.
+    """
+    rows, columns = grid_shape(dxf_to_graph)
+    cells = rows * columns
+    interior_fraction = estimate_interior_fraction(dxf_to_graph)
+    nodes = int(cells * interior_fraction * OPEN_FRACTION)
+    sparsified_nodes = int(nodes / sparsity_level**2)
+    if quadtree:
+        nodes = int(nodes * QUADTREE_NODE_FRACTION)
+    modes = dict(out_of_core=out_of_core, quadtree=quadtree, skeleton=skeleton)
+    stages = _stage_estimates(rows, columns, nodes, sparsity_level, **modes)
+    peak_memory = max(stage["memory"] for stage in stages.values())
+    seconds = sum(stage["seconds"] for stage in stages.values())
+
+    action = PROCEED
+    tile_rows = None
+    reasons = []
+    if budget.max_cells is not None and cells > budget.max_cells:
+        reasons.append(f"{cells} cells > {budget.max_cells}")
+    if budget.max_seconds is not None and seconds > budget.max_seconds:
+        reasons.append(f"{seconds:.0f}s > {budget.max_seconds}s")
+    if budget.max_memory is not None and peak_memory > budget.max_memory:
+        tile_rows = int(
+            (budget.max_memory - _grid_bytes(cells, out_of_core)) / (columns * RASTER_CELL_BYTES)
+        )
+        if tile_rows >= 1:
+            tiled_stages = _stage_estimates(rows, columns, nodes, sparsity_level, tile_rows, **modes)
+            tiled_peak = max(stage["memory"] for stage in tiled_stages.values())
+        if tile_rows < 1 or tiled_peak > budget.max_memory:
+            reasons.append(f"{peak_memory/2**20:.0f}MB > {budget.max_memory/2**20:.0f}MB")
+            tile_rows = None
+        else:
+            stages = tiled_stages
+            peak_memory = tiled_peak
+            action = TILED
+    if reasons:
+        action = ABORT
+        tile_rows = None
+
+    plan = ConversionPlan(
+        canvas=tuple(dxf_to_graph.new_canvas_dimensions),
+        grid_size=dxf_to_graph.grid_size,
+        grid_shape=(rows, columns),
+        cells=cells,
+        interior_fraction=interior_fraction,
+        nodes=nodes,
+        edges=int(nodes * GRAPH_EDGES_PER_NODE),
+        sparsified_nodes=sparsified_nodes,
+        sparsified_edges=int(sparsified_nodes * SPARSE_EDGES_PER_NODE),
+        stages=stages,
+        peak_memory=peak_memory,
+        seconds=seconds,
+        action=action,
+        tile_rows=tile_rows,
+        reasons=reasons,
+    )
+    logging.info(
+        f"{rows}x{columns} grid, ~{nodes} nodes, ~{peak_memory/2**20:.0f}MB, "
+        f"~{seconds:.0f}s: {action}"
+    )
+    return plan
+
+
+def check_budget(plan: ConversionPlan):
+    """Raises ResourceBudgetExceeded if the plan is to abort."""
+    if plan.action == ABORT:
+        raise ResourceBudgetExceeded(
+            f"{plan.grid_shape[0]}x{plan.grid_shape[1]} grid for a "
+            f"{plan.canvas[0]}x{plan.canvas[1]} canvas exceeds the budget: "
+            + ", ".join(plan.reasons),
+            plan,
+        )
@@ -0,0 +1,144 @@
+import weakref
+from collections import defaultdict
+from typing import Callable
+from typing import Dict
+from typing import List
+
+from networkx import Graph
+
+from util.data_containers import Node
+
+
+def identity(word: str) -> str:
+    return word
+
+
+def remove_hyphens(word: str) -> str:
+    word = word.split("-")
+    return "".join(word)
+
+
+def drop_extensions(word: str) -> str:
+    return word.split("-")[0]
+
+
+class RoomLabelIndex:
+    """An index from room labels to the nodes of a graph carrying them.
+    Besides exact labels, the index can be queried through a normalizing
+    transform (e.g. remove_hyphens or drop_extensions): the transformed
+    labels of all nodes are computed once, the first time a transform is
+    used, and kept up to date by set_room_label.
+
+    The index only keeps a weak reference to its graph. Lookups never scan
+    the graph: room labels must be written through set_room_label, or the
+    index dropped with invalidate_room_label_index after writing them
+    directly. Only nodes added or removed are noticed by themselves.
+
+    Use get_room_label_index to get the shared index of a graph.
+    """
+
+    def __init__(self, graph: Graph):
+        self._graph = weakref.ref(graph)
+        self._num_nodes = graph.number_of_nodes()
+        self._labelled_nodes = {}
+        for node, room_label in graph.nodes(data="room_label"):
+            if room_label:
+                self._labelled_nodes[node] = room_label
+        self._variants = {}
+        self._build_variant(identity)
+
+    def _build_variant(self, transform: Callable[[str], str]) -> Dict[str, List[Node]]:
+        variant = defaultdict(list)
+        for node, room_label in self._labelled_nodes.items():
+            variant[transform(room_label)].append(node)
+        self._variants[transform] = variant
+        return variant
+
+    def _variant(self, transform: Callable[[str], str]) -> Dict[str, List[Node]]:
+        if transform in self._variants:
+            return self._variants[transform]
+        return self._build_variant(transform)
+
+    @property
+    def graph(self) -> Graph:
+        return self._graph()
+
+    def is_stale(self) -> bool:
+        """True if the graph is gone, or nodes were added or removed since
+        the index was built. This is O(1), room labels written directly to
+        the graph are not noticed (see invalidate_room_label_index)."""
+        graph = self.graph
+        return graph is None or graph.number_of_nodes() != self._num_nodes
+
+    def nodes(self, room_label: str, transform: Callable[[str], str]=identity) -> List[Node]:
+        """Returns the nodes whose transformed label equals the transformed
+        room_label, in graph order.
+
+        :param room_label: The room label to look up.
+        :param transform: The normalization applied to both labels.
+        :return: A list of nodes (empty if there are none).
+        """
+        return self._variant(transform).get(transform(room_label), [])
+
+    def first_node(self, room_label: str, transform: Callable[[str], str]=identity):
+        """Returns the first node carrying room_label, or None."""
+        nodes = self.nodes(room_label, transform)
+        return nodes[0] if nodes else None
+
+    def has_label(self, room_label: str, transform: Callable[[str], str]=identity) -> bool:
+        return bool(self.nodes(room_label, transform))
+
+    def labels(self, transform: Callable[[str], str]=identity):
+        """Returns the set-like view of all (transformed) labels."""
+        return self._variant(transform).keys()
+
+    def labelled_nodes(self) -> List[Node]:
+        """Returns all nodes with a non-empty room label."""
+        return list(self._labelled_nodes)
+
+    def set_room_label(self, node: Node, room_label: str):
+        """Sets the room label of a node in the graph and in the index.
+
+        :param node: A node of the graph.
+        :param room_label: The new room label.
+        """
+        attributes = self.graph.nodes[node]
+        old_label = self._labelled_nodes.pop(node, None)
+        if old_label:
+            for transform, variant in self._variants.items():
+                nodes = variant[transform(old_label)]
+                nodes.remove(node)
+                if not nodes:
+                    del variant[transform(old_label)]
+        attributes["room_label"] = room_label
+        if room_label:
+            self._labelled_nodes[node] = room_label
+            for transform, variant in self._variants.items():
+                variant[transform(room_label)].append(node)
+
+
+_room_label_indexes = weakref.WeakKeyDictionary()
+
+
+def get_room_label_index(graph: Graph) -> RoomLabelIndex:
+    """Returns the room label index of a graph, building it on first use
+    and again whenever it is stale (see RoomLabelIndex.is_stale).
+
+    :param graph: The graph to index.
+    :return: The RoomLabelIndex of the graph.
+    """
+    index = _room_label_indexes.get(graph)
+    if index is None or index.is_stale():
+        index = RoomLabelIndex(graph)
+        _room_label_indexes[graph] = index
+    return index
+
+
+def invalidate_room_label_index(graph: Graph):
+    """Drops the cached index of a graph. Must be called after room labels
+    are written to the graph other than through set_room_label, or nodes
+    are relabelled.
+
+    :param graph: The graph whose index is outdated.
+    """
+    _room_label_indexes.pop(graph, None)
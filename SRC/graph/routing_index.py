@@ -0,0 +1,173 @@
+import heapq
+import itertools
+import logging
+from collections import defaultdict
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from networkx import Graph
+from networkx import NetworkXNoPath
+from networkx import dijkstra_predecessor_and_distance
+
+from util.data_containers import Node_4d
+
+ROUTING_WEIGHTS = ("weight", "weight2")
+
+
+def node_cell(node) -> Tuple:
+    """The routing cell of a node: its building and floor."""
+    return getattr(node, "building", None), getattr(node, "floor", None)
+
+
+def _path_from_predecessors(predecessors: Dict, target) -> List:
+    path = [target]
+    while predecessors[path[-1]]:
+        path.append(predecessors[path[-1]][0])
+    path.reverse()
+    return path
+
+
+class FloorOverlayRouter:
+    """A shortest path accelerator for composed campus or building graphs.
+
+    Preprocessing splits the graph into cells (one per building floor) and
+    finds the portal nodes, i.e. the nodes with edges to another cell (the
+    stairs and elevators linked by BuildingGraphComposer, or connections
+    between buildings). It then builds a small overlay graph on the portals
+    whose edges are the shortest paths between portals of the same cell and
+    the edges between cells.
+
+    A query only searches the source cell and the target cell of the full
+    graph, and the overlay graph in between, instead of the whole campus.
+    Results are exact.
+    """
+
+    def __init__(self, graph: Graph, weight: str="weight"):
+        self.graph = graph
+        self.weight = weight
+        self.portals = defaultdict(list)
+        self.overlay = defaultdict(list)
+
+        for u, v in graph.edges:
+            if node_cell(u) != node_cell(v):
+                for node in (u, v):
+                    if node not in self.overlay:
+                        self.portals[node_cell(node)].append(node)
+                        self.overlay[node]
+                edge_weight = graph.edges[u, v].get(weight, 1)
+                self.overlay[u].append((v, edge_weight, [u, v]))
+                self.overlay[v].append((u, edge_weight, [v, u]))
+
+        for cell, portals in self.portals.items():
+            for portal in portals:
+                predecessors, distances = self._search_cell(portal)
+                for other in portals:
+                    if other != portal and other in distances:
+                        self.overlay[portal].append((
+                            other,
+                            distances[other],
+                            _path_from_predecessors(predecessors, other),
+                        ))
+        logging.info(
+            f"routing index on {weight}: {len(self.portals)} cells, "
+            f"{len(self.overlay)} portals"
+        )
+
+    def _intra_cell_weight(self, u, v, data):
+        if node_cell(u) != node_cell(v):
+            return None
+        return data.get(self.weight, 1)
+
+    def _search_cell(self, source):
+        """Runs Dijkstra from source restricted to the cell of source.
+
+        :return: The predecessor and distance dicts of the search.
+        """
+        return dijkstra_predecessor_and_distance(
+            self.graph,
+            source,
+            weight=self._intra_cell_weight,
+        )
+
+    def shortest_path(self, source: Node_4d, target: Node_4d) -> Tuple[float, List[Node_4d]]:
+        """Finds a shortest path between two nodes.
+
+        :param source: The source node.
+        :param target: The target node.
+        :return: The cost of the path and the list of its nodes.
+        :raises NetworkXNoPath: if target cannot be reached from source.
+        """
+        source_predecessors, source_distances = self._search_cell(source)
+        best_cost = source_distances.get(target, float("inf"))
+        best_path = None
+        if target in source_distances:
+            best_path = _path_from_predecessors(source_predecessors, target)
+
+        target_predecessors, target_distances = self._search_cell(target)
+        target_portals = {
+            portal: target_distances[portal]
+            for portal in self.portals.get(node_cell(target), [])
+            if portal in target_distances
+        }
+
+        # Dijkstra on the overlay, seeded with the portals of the source cell
+        counter = itertools.count()
+        heap = [
+            (source_distances[portal], next(counter), portal)
+            for portal in self.portals.get(node_cell(source), [])
+            if portal in source_distances
+        ]
+        heapq.heapify(heap)
+        distances = {}
+        tentative = {}
+        overlay_predecessors = {}
+        best_portal = None
+        while heap:
+            cost, _, portal = heapq.heappop(heap)
+            if portal in distances:
+                continue
+            if cost >= best_cost:
+                break
+            distances[portal] = cost
+            if portal in target_portals and cost + target_portals[portal] < best_cost:
+                best_cost = cost + target_portals[portal]
+                best_portal = portal
+            for neighbor, edge_cost, segment in self.overlay[portal]:
+                new_cost = cost + edge_cost
+                if neighbor not in distances and new_cost < tentative.get(neighbor, float("inf")):
+                    tentative[neighbor] = new_cost
+                    overlay_predecessors[neighbor] = (portal, segment)
+                    heapq.heappush(heap, (new_cost, next(counter), neighbor))
+
+        if best_portal is not None:
+            # walk back over overlay edges until reaching the seed portal the
+            # path left the source cell from
+            overlay_path = [best_portal]
+            portal = best_portal
+            while portal in overlay_predecessors and tentative[portal] == distances[portal]:
+                previous, segment = overlay_predecessors[portal]
+                overlay_path = segment[:-1] + overlay_path
+                portal = previous
+            best_path = (
+                _path_from_predecessors(source_predecessors, portal)[:-1]
+                + overlay_path
+                + _path_from_predecessors(target_predecessors, best_portal)[::-1][1:]
+            )
+
+        if best_path is None:
+            raise NetworkXNoPath(f"No path between {source} and {target}.")
+        return best_cost, best_path
+
+
+def build_routing_index(
+        graph: Graph,
+        weights: Tuple[str]=ROUTING_WEIGHTS,
+) -> Dict[str, FloorOverlayRouter]:
+    """Preprocesses a (composed) graph for fast shortest path queries.
+
+    :param graph: The graph to route on.
+    :param weights: The edge attributes to build routers for.
+    :return: A dict from weight names to their FloorOverlayRouter.
+    """
+    return {weight: FloorOverlayRouter(graph, weight) for weight in weights}
@@ -0,0 +1,197 @@
+import logging
+from typing import Dict
+from typing import List
+
+import numpy as np
+from networkx import Graph
+from networkx import multi_source_dijkstra
+from networkx import single_source_dijkstra_path_length
+from scipy import ndimage
+
+from graph.grid_array import DOOR_CODE
+from graph.grid_array import OPEN_CODE
+from graph.grid_array import grid_to_array
+from util.data_containers import Node_4d
+from util.data_containers import Point
+from util.data_containers import RoomInfo
+from util.data_containers import SpaceType
+
+# the 8 neighbours of a pixel in clockwise order, starting above it
+_NEIGHBOUR_OFFSETS = ((-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1))
+
+
+def _neighbours(image: np.ndarray) -> List[np.ndarray]:
+    """The 8 neighbours of every pixel of a zero padded image, in the order
+    of _NEIGHBOUR_OFFSETS, cropped to the unpadded image."""
+    rows, columns = image.shape[0] - 2, image.shape[1] - 2
+    return [
+        image[1+di:1+di+rows, 1+dj:1+dj+columns]
+        for di, dj in _NEIGHBOUR_OFFSETS
+    ]
+
+
+def _transitions(neighbours: List[np.ndarray]) -> np.ndarray:
+    """The number of 0 to 1 transitions around every pixel."""
+    return sum(
+        (neighbours[k] == 0) & (neighbours[(k+1) % 8] == 1)
+        for k in range(8)
+    )
+
+
+def skeletonize(mask: np.ndarray) -> np.ndarray:
+    """Thins a binary image to its one pixel wide skeleton with the
+    Zhang-Suen algorithm, which approximates the medial axis and keeps its
+    topology.
+
+    :param mask: A 2d boolean array.
+    :return: A boolean array of the skeleton pixels.
+    """
+    image = np.pad(mask.astype(np.uint8), 1, mode="constant")
+    center = image[1:-1, 1:-1]
+    changed = True
+    while changed:
+        changed = False
+        for step in (0, 1):
+            p2, p3, p4, p5, p6, p7, p8, p9 = _neighbours(image)
+            count = p2 + p3 + p4 + p5 + p6 + p7 + p8 + p9
+            if step == 0:
+                sides = (p2 * p4 * p6 == 0) & (p4 * p6 * p8 == 0)
+            else:
+                sides = (p2 * p4 * p8 == 0) & (p2 * p6 * p8 == 0)
+            delete = (
+                (center == 1) & (count >= 2) & (count <= 6) &
+                (_transitions([p2, p3, p4, p5, p6, p7, p8, p9]) == 1) & sides
+            )
+            if delete.any():
+                center[delete] = 0
+                changed = True
+    return center.astype(bool)
+
+
+def _pixel_graph(skeleton: np.ndarray) -> Graph:
+    """The 8-connected graph of the skeleton pixels, weighted like
+    make_graph_from_grid."""
+    pixels = Graph()
+    rows, columns = skeleton.shape
+    pixels.add_nodes_from(zip(*map(np.ndarray.tolist, np.nonzero(skeleton))))
+    for di, dj, weight in ((1, 0, 1), (0, 1, 1), (1, 1, 1.4), (1, -1, 1.4)):
+        source = skeleton[:rows-di, max(-dj, 0):columns-max(dj, 0)]
+        target = skeleton[di:, max(dj, 0):columns-max(-dj, 0)]
+        for i, j in zip(*map(np.ndarray.tolist, np.nonzero(source & target))):
+            j += max(-dj, 0)
+            pixels.add_edge((i, j), (i+di, j+dj), weight=weight)
+    return pixels
+
+
+def _snap_room_labels(
+        room_infos: Dict[Point, RoomInfo],
+        skeleton: np.ndarray,
+        components: np.ndarray,
+) -> Dict:
+    """Moves every room label on open space to the closest skeleton pixel of
+    its connected component that has no label yet. Labels in components
+    without a skeleton stay where they are."""
+    skeleton_pixels = np.argwhere(skeleton)
+    pixel_components = components[skeleton_pixels[:, 0], skeleton_pixels[:, 1]]
+    snapped = {}
+    for position, room_info in room_infos.items():
+        if not (0 <= position.x < components.shape[0] and 0 <= position.y < components.shape[1]):
+            continue
+        component = components[position.x, position.y]
+        if not component:
+            continue
+        candidates = skeleton_pixels[pixel_components == component]
+        distances = np.hypot(candidates[:, 0] - position.x, candidates[:, 1] - position.y)
+        pixel = (position.x, position.y)
+        for index in np.argsort(distances, kind="stable"):
+            candidate = tuple(candidates[index].tolist())
+            if candidate not in snapped:
+                pixel = candidate
+                break
+        snapped[pixel] = room_info
+    return snapped
+
+
+def make_skeleton_graph(
+        grid: List[List[SpaceType]],
+        room_infos: Dict[Point, RoomInfo],
+        sparsity_level: int,
+        floor=0,
+        building="",
+) -> Graph:
+    """Builds a sparse graph of the open space of a grid from its skeleton
+    instead of by sparsifying the graph of all its cells: the open and door
+    cells are thinned to their medial axis, nodes are put at its junctions
+    and ends, at the room labels (snapped to the skeleton) and every
+    sparsity_level cells along it, and nodes are connected if they are
+    neighbours along the skeleton.
+
+    The nodes and edges have the same attributes as those of sparsify_graph,
+    so the graph can go through the rest of the pipeline the same way.
+
+    :param grid: A grid from get_grid, after mark_exterior.
+    :param room_infos: The room labels, keyed by cell.
+    :param sparsity_level: The spacing of the nodes along the skeleton.
+    :param floor: The floor of the nodes.
+    :param building: The building of the nodes.
+    :return: The sparse graph.
+    """
+    cells = grid_to_array(grid)
+    walkable = (cells == OPEN_CODE) | (cells == DOOR_CODE)
+    components, _ = ndimage.label(walkable, structure=np.ones((3, 3)))
+    skeleton = skeletonize(walkable)
+    snapped_labels = _snap_room_labels(room_infos, skeleton, components)
+    pixels = _pixel_graph(skeleton)
+    pixels.add_nodes_from(snapped_labels)
+
+    # junctions (3 or more branches) and ends (a single run of neighbours)
+    # of the skeleton, and the labels, are always nodes
+    transitions = _transitions(_neighbours(np.pad(skeleton.astype(np.uint8), 1, mode="constant")))
+    key_pixels = set(snapped_labels)
+    for pixel in pixels:
+        if transitions[pixel] != 2:
+            key_pixels.add(pixel)
+    node_pixels = set(key_pixels)
+    # then every pixel farther than sparsity_level along the skeleton from
+    # the nodes so far, walking the skeleton away from the key pixels
+    pixel_order = list(multi_source_dijkstra(pixels, key_pixels)[0]) if key_pixels else []
+    ordered = set(pixel_order)
+    pixel_order += [pixel for pixel in pixels if pixel not in ordered]
+    for pixel in pixel_order:
+        nhood = single_source_dijkstra_path_length(pixels, pixel, cutoff=sparsity_level)
+        if not any(neighbour in node_pixels for neighbour in nhood):
+            node_pixels.add(pixel)
+
+    graph = Graph()
+    for pixel in node_pixels:
+        room_info = snapped_labels.get(pixel)
+        node_details = dict(room_info.details) if room_info is not None else {}
+        node_details["room_label"] = room_info.room_label if room_info is not None else ""
+        node_details["type"] = SpaceType(int(cells[pixel]))
+        graph.add_node(Node_4d(x=pixel[0], y=pixel[1], floor=floor, building=building), **node_details)
+
+    # nodes whose regions of closest skeleton pixels touch are neighbours
+    if node_pixels:
+        _, paths = multi_source_dijkstra(pixels, node_pixels)
+    else:
+        paths = {}
+    for u, v in pixels.edges:
+        path = paths[u] + paths[v][::-1]
+        if path[0] == path[-1]:
+            continue
+        source = Node_4d(x=path[0][0], y=path[0][1], floor=floor, building=building)
+        target = Node_4d(x=path[-1][0], y=path[-1][1], floor=floor, building=building)
+        is_door = any(cells[pixel] == DOOR_CODE for pixel in path)
+        if graph.has_edge(source, target) and graph.edges[source, target]["type"] == "normal":
+            continue
+        graph.add_edge(
+            source,
+            target,
+            weight2=1000 if is_door else 1,
+            type="door" if is_door else "normal",
+        )
+    logging.info(
+        f"skeleton of {len(pixels)} pixels, {graph.number_of_nodes()} nodes, "
+        f"{graph.number_of_edges()} edges"
+    )
+    return graph
@@ -0,0 +1,146 @@
+import struct
+import zlib
+from typing import List
+
+import numpy as np
+
+from graph.grid_array import DOOR_CODE
+from graph.grid_array import OPEN_CODE
+from graph.grid_array import OUTSIDE_CODE
+from graph.grid_array import WALL_CODE
+from graph.grid_array import grid_to_array
+from util.data_containers import SpaceType
+
+# rgb colors of the grid cells, indexed by cell code
+GRID_PALETTE = np.zeros((4, 3), dtype=np.uint8)
+GRID_PALETTE[OPEN_CODE] = (255, 255, 255)
+GRID_PALETTE[WALL_CODE] = (40, 40, 40)
+GRID_PALETTE[DOOR_CODE] = (255, 0, 255)
+GRID_PALETTE[OUTSIDE_CODE] = (200, 200, 200)
+
+NODE_PNG_COLORS = {
+    SpaceType.OPEN: (0, 0, 0),
+    SpaceType.DOOR: (255, 0, 0),
+}
+EDGE_PNG_COLORS = {
+    None: (153, 0, 0),
+    "door": (153, 76, 0),
+}
+DEFAULT_EDGE_PNG_COLOR = (0, 0, 255)
+DEFAULT_CELL_PIXELS = 2
+# node disks are drawn smaller than the svg circles so that nodes
+# sparsity_level cells apart stay distinguishable
+NODE_RADIUS_CELLS = 0.75
+
+
+def _stamp_disks(image: np.ndarray, xs: np.ndarray, ys: np.ndarray, radius: float, color):
+    """Paints filled disks centered at every (xs[i], ys[i]) pixel."""
+    reach = int(radius)
+    dx, dy = np.meshgrid(np.arange(-reach, reach+1), np.arange(-reach, reach+1))
+    inside = dx**2 + dy**2 <= radius**2
+    px = (xs[:, None] + dx[inside][None, :]).ravel()
+    py = (ys[:, None] + dy[inside][None, :]).ravel()
+    on_image = (px >= 0) & (px < image.shape[1]) & (py >= 0) & (py < image.shape[0])
+    image[py[on_image], px[on_image]] = color
+
+
+def _draw_segments(
+        image: np.ndarray,
+        x1: np.ndarray,
+        y1: np.ndarray,
+        x2: np.ndarray,
+        y2: np.ndarray,
+        color,
+):
+    """Paints line segments by sampling every segment once per pixel along
+    its longer axis, for all segments at once.
+    """
+    if not len(x1):
+        return
+    steps = np.maximum(np.abs(x2 - x1), np.abs(y2 - y1)).astype(np.int64) + 1
+    segment = np.repeat(np.arange(len(steps)), steps)
+    offsets = np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+    t = offsets / np.maximum(steps - 1, 1)[segment]
+    px = np.rint(x1[segment] + t * (x2 - x1)[segment]).astype(np.int64)
+    py = np.rint(y1[segment] + t * (y2 - y1)[segment]).astype(np.int64)
+    on_image = (px >= 0) & (px < image.shape[1]) & (py >= 0) & (py < image.shape[0])
+    image[py[on_image], px[on_image]] = color
+
+
+def render_graph_overlay(
+        grid,
+        graph,
+        cell_pixels: int=DEFAULT_CELL_PIXELS,
+) -> np.ndarray:
+    """Renders the occupancy grid with the graph drawn on top as an rgb
+    image, with the same orientation as the svg overlay (x to the right, y
+    down). Each grid cell becomes cell_pixels x cell_pixels pixels.
+
+    :param grid: The grid from get_grid/mark_exterior, or its array of cell
+           codes (see graph.grid_array).
+    :param graph: The graph to draw, with nodes in grid coordinates.
+    :param cell_pixels: The size of a grid cell in pixels.
+    :return: A (height, width, 3) uint8 image.
+    """
+    cells = grid_to_array(grid)
+    image = GRID_PALETTE[cells.T]
+    if cell_pixels > 1:
+        image = np.repeat(np.repeat(image, cell_pixels, axis=0), cell_pixels, axis=1)
+
+    edges_by_color = {}
+    for u, v, edge_type in graph.edges(data="type"):
+        color = EDGE_PNG_COLORS.get(edge_type, DEFAULT_EDGE_PNG_COLOR)
+        edges_by_color.setdefault(color, []).append((u.x, u.y, v.x, v.y))
+    for color, edges in edges_by_color.items():
+        coords = (np.array(edges, dtype=np.float64) + 0.5) * cell_pixels
+        _draw_segments(image, coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3], color)
+
+    nodes_by_color = {}
+    for node, node_type in graph.nodes(data="type"):
+        color = NODE_PNG_COLORS.get(node_type, (0, 0, 0))
+        nodes_by_color.setdefault(color, []).append((node.x, node.y))
+    for color, nodes in nodes_by_color.items():
+        coords = ((np.array(nodes, dtype=np.float64) + 0.5) * cell_pixels).astype(np.int64)
+        _stamp_disks(image, coords[:, 0], coords[:, 1], NODE_RADIUS_CELLS * cell_pixels, color)
+
+    return image
+
+
+def write_png(image: np.ndarray, outfile: str, compression_level: int=6):
+    """Writes an rgb uint8 image as a png file.
+
+    :param image: A (height, width, 3) uint8 array.
+    :param outfile: Name of the output file.
+    :param compression_level: The zlib compression level.
+    """
+    height, width = image.shape[:2]
+    # every png scanline starts with its filter type, 0 (none)
+    scanlines = np.zeros((height, width*3 + 1), dtype=np.uint8)
+    scanlines[:, 1:] = np.ascontiguousarray(image, dtype=np.uint8).reshape(height, width*3)
+
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + chunk_type + data + \
+            struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff)
+
+    with open(outfile, "wb") as png:
+        png.write(b"\x89PNG\r\n\x1a\n")
+        png.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        png.write(chunk(b"IDAT", zlib.compress(scanlines.tobytes(), compression_level)))
+        png.write(chunk(b"IEND", b""))
+
+
+def export_graph_overlay_png(
+        grid: List[List[SpaceType]],
+        graph,
+        outfile: str,
+        cell_pixels: int=DEFAULT_CELL_PIXELS,
+):
+    """Renders the graph on the occupancy grid and saves it as a png. This
+    is much faster than rasterizing the svg overlay for large floors.
+
+    :param grid: The grid from get_grid/mark_exterior, or its cell codes.
+    :param graph: The graph to draw.
+    :param outfile: Name of the output png file.
+    :param cell_pixels: The size of a grid cell in pixels.
+    """
+    write_png(render_graph_overlay(grid, graph, cell_pixels), outfile)
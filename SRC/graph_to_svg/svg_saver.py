@@ -1,70 +1,71 @@
+from collections import defaultdict
+
 from dxf_reader.hospital_dxf import DXF
-from graph_to_svg.svg_utils import draw_edge, draw_circle, write_text
+from graph_to_svg.svg_utils import draw_edges, draw_geometries, draw_nodes, write_texts
+from graph_to_svg.svg_writer import SvgWriter
 from util.data_containers import SpaceType
 
+DEFAULT_SVG_PRECISION = 2
+NODE_COLORS = {
+    SpaceType.OPEN: "rgb(0,0,0)",
+    SpaceType.DOOR: "rgb(255,0,0)",
+}
+EDGE_COLORS = {
+    None: "rgb(153,0,0)",
+    "door": "rgb(153,76,0)",
+}
+DEFAULT_EDGE_COLOR = "rgb(0,0,255)"
 
-def export_graph_overlay_on_cad(dxf: DXF, graph, grid_size, canvas_lims, outfile):
-    with open(outfile, "w+") as dwg:
-        header = "<?xml version='1.0' encoding='utf-8' ?> <svg baseProfile='tiny' \n"
-        header += f"height='{canvas_lims[1]}' version='1.1' width='{canvas_lims[0]}' xmlns='http://www.w3.org/2000/svg' \n"
-        header += "xmlns:ev='http://www.w3.org/2001/xml-events' xmlns:xlink='http://www.w3.org/1999/xlink'><defs />"
-        dwg.write(header)
 
-        for wall in dxf.walls:
-            dwg.write(wall.svg())
-            dwg.write("\n")
+def export_graph_overlay_on_cad(
+        dxf: DXF,
+        graph,
+        grid_size,
+        canvas_lims,
+        outfile,
+        precision: int=DEFAULT_SVG_PRECISION,
+):
+    """Draws the graph on top of the walls and doors of the CAD file and
+    saves it as an svg (or gzip compressed .svgz) file. Each layer of walls
+    and doors is a single path, and nodes and edges are grouped by color.
 
-        for door in dxf.doors:
-            dwg.write(door.svg())
-            dwg.write("\n")
-        print("draw node")
-        for node in graph.nodes:
-            if graph.nodes[node]["type"] == SpaceType.OPEN:
-                dwg.write(draw_circle(node.x, node.y, grid_size, "rgb(0,0,0)"))
-            elif graph.nodes[node]["type"] == SpaceType.DOOR:
-                dwg.write(draw_circle(node.x, node.y, grid_size, "rgb(255,0,0)"))
-            else:
-                dwg.write(draw_circle(node.x, node.y, grid_size, "rgb(0,0,0)"))
-                
-            label = graph.nodes[node].get("room_label") or 'NA'
-            dwg.write(
-                write_text(
-                    x=node.x,
-                    y=node.y,
-                    grid_size=grid_size,
-                    text=f'{label}+{node.x}+{node.y}',
-                ),
-            )
+    :param dxf: The DXF object the graph was computed from.
+    :param graph: The graph to draw.
+    :param grid_size: The size of a grid cell.
+    :param canvas_lims: The width and height of the canvas.
+    :param outfile: Name of the output file. Names ending in .svgz are
+           compressed.
+    :param precision: The number of decimals kept in coordinates.
+    """
+    nodes_by_color = defaultdict(list)
+    for node, node_type in graph.nodes(data="type"):
+        nodes_by_color[NODE_COLORS.get(node_type, "rgb(0,0,0)")].append(node)
 
-            dwg.write("\n")
+    edges_by_color = defaultdict(list)
+    for u, v, edge_type in graph.edges(data="type"):
+        edges_by_color[EDGE_COLORS.get(edge_type, DEFAULT_EDGE_COLOR)].append((u, v))
 
-        for edge in graph.edges:
-            if "type" not in graph.edges[edge]:
-                dwg.write(draw_edge(edge, grid_size, color="rgb(153,0,0)"))
-            elif graph.edges[edge]["type"] == "door":
-                dwg.write(draw_edge(edge, grid_size, color="rgb(153,76,0)"))
-            else:
-                dwg.write(draw_edge(edge, grid_size))
-                # dwg.write(draw_edge(edge, 20))
-            dwg.write("\n")
+    with SvgWriter(outfile, width=canvas_lims[0], height=canvas_lims[1]) as svg:
+        svg.write(draw_geometries(dxf.walls, precision) + "\n")
+        svg.write(draw_geometries(dxf.doors, precision) + "\n")
+        print("draw node")
+        for color, nodes in nodes_by_color.items():
+            svg.write(draw_nodes(nodes, grid_size, color, precision) + "\n")
+        svg.write(write_texts(
+            (
+                (node.x, node.y, f'{label or "NA"}+{node.x}+{node.y}')
+                for node, label in graph.nodes(data="room_label")
+            ),
+            grid_size,
+            precision,
+        ) + "\n")
 
-        dwg.write("</svg>")
+        for color, edges in edges_by_color.items():
+            svg.write(draw_edges(edges, grid_size, color, precision) + "\n")
 
 
-def export_dxf_as_svg(dxf: DXF, outfile):
+def export_dxf_as_svg(dxf: DXF, outfile, precision: int=DEFAULT_SVG_PRECISION):
     canvas_lims = dxf.new_canvas_dimensions
-    with open(outfile, "w+") as dwg:
-        header = "<?xml version='1.0' encoding='utf-8' ?> <svg baseProfile='tiny' \n"
-        header += f"height='{canvas_lims[1]}' version='1.1' width='{canvas_lims[0]}' xmlns='http://www.w3.org/2000/svg' \n"
-        header += "xmlns:ev='http://www.w3.org/2001/xml-events' xmlns:xlink='http://www.w3.org/1999/xlink'><defs />"
-        dwg.write(header)
-
-        for wall in dxf.walls:
-            dwg.write(wall.svg())
-            dwg.write("\n")
-
-        for door in dxf.doors:
-            dwg.write(door.svg(stroke_color='rgb(255,0,255)'))
-            dwg.write("\n")
-
-        dwg.write("</svg>")
+    with SvgWriter(outfile, width=canvas_lims[0], height=canvas_lims[1]) as svg:
+        svg.write(draw_geometries(dxf.walls, precision) + "\n")
+        svg.write(draw_geometries(dxf.doors, precision, stroke_color="rgb(255,0,255)") + "\n")
@@ -0,0 +1,268 @@
+import json
+import logging
+import math
+import os
+from collections import defaultdict
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from shapely.errors import TopologicalError
+from shapely.geometry import box
+from shapely.geometry.base import BaseGeometry
+
+try:
+    from shapely.errors import GEOSException
+except ImportError:
+    # shapely 1 raises TopologicalError for failed operations
+    GEOSException = TopologicalError
+
+from dxf_reader.hospital_dxf import DXF
+from graph_to_svg.svg_saver import DEFAULT_EDGE_COLOR
+from graph_to_svg.svg_saver import DEFAULT_SVG_PRECISION
+from graph_to_svg.svg_saver import EDGE_COLORS
+from graph_to_svg.svg_saver import NODE_COLORS
+from graph_to_svg.svg_utils import NODE_RADIUS_CELLS
+from graph_to_svg.svg_utils import draw_edges, draw_geometries, draw_nodes, write_texts
+from graph_to_svg.svg_writer import SvgWriter
+
+TILE_PIXELS = 1024
+DEFAULT_MAX_ZOOM = 3
+TILE_INDEX_FILENAME = "index.json"
+# below max zoom, nodes are merged into one marker per square of this many
+# pixels, or of a marker's diameter if that is larger, as closer markers are
+# drawn on top of each other
+NODE_CLUSTER_PIXELS = 4
+_POLYGONAL_TYPES = ("Polygon", "MultiPolygon")
+
+
+def _tile_range(
+        minx: float,
+        miny: float,
+        maxx: float,
+        maxy: float,
+        tile_width: float,
+        tile_height: float,
+        tiles_per_axis: int,
+) -> Tuple[range, range]:
+    """Returns the columns and rows of the tiles that a bounding box overlaps."""
+    first_col = min(max(int(minx // tile_width), 0), tiles_per_axis-1)
+    last_col = min(max(int(maxx // tile_width), 0), tiles_per_axis-1)
+    first_row = min(max(int(miny // tile_height), 0), tiles_per_axis-1)
+    last_row = min(max(int(maxy // tile_height), 0), tiles_per_axis-1)
+    return range(first_col, last_col+1), range(first_row, last_row+1)
+
+
+def _bucket_geometries(
+        geometries: List[BaseGeometry],
+        tile_width: float,
+        tile_height: float,
+        tiles_per_axis: int,
+        tolerance: float,
+) -> Dict[Tuple[int, int], List[BaseGeometry]]:
+    """Simplifies geometries to the given tolerance and clips them to every
+    tile they overlap.
+
+    :return: A dict from (col, row) to the clipped geometries of that tile.
+    """
+    buckets = defaultdict(list)
+    for geometry in geometries:
+        if tolerance:
+            geometry = geometry.simplify(tolerance, preserve_topology=False)
+            # simplifying without preserving topology can make polygons
+            # self-intersect, which clipping them would fail on
+            if geometry.geom_type in _POLYGONAL_TYPES and not geometry.is_valid:
+                geometry = geometry.buffer(0)
+        if geometry.is_empty:
+            continue
+        cols, rows = _tile_range(*geometry.bounds, tile_width, tile_height, tiles_per_axis)
+        if len(cols) == 1 and len(rows) == 1:
+            buckets[(cols[0], rows[0])].append(geometry)
+            continue
+        for col in cols:
+            for row in rows:
+                tile_box = box(
+                    col*tile_width,
+                    row*tile_height,
+                    (col+1)*tile_width,
+                    (row+1)*tile_height,
+                )
+                try:
+                    clipped = geometry.intersection(tile_box)
+                except (GEOSException, TopologicalError) as e:
+                    logging.warning(f"could not clip {geometry.geom_type} to tile {col}_{row}: {e}")
+                    continue
+                if not clipped.is_empty:
+                    buckets[(col, row)].append(clipped)
+    return buckets
+
+
+def _cluster_nodes(nodes: List[Tuple], grid_size: float, cluster_size: float) -> Tuple[List[Tuple], Dict]:
+    """Merges the nodes of each type that fall in the same square of
+    cluster_size drawing units into the first of them.
+
+    :param nodes: (node, type, room label) of every node.
+    :param grid_size: The size of a grid cell.
+    :param cluster_size: The side of the squares, 0 keeps every node.
+    :return: The (node, type, room label) of the kept nodes, and a dict
+             from every node to the kept node it was merged into.
+    """
+    if not cluster_size:
+        return nodes, {node: node for node, _, _ in nodes}
+    kept = {}
+    representatives = {}
+    for node, node_type, label in nodes:
+        key = (
+            node_type,
+            int((node.x+0.5)*grid_size // cluster_size),
+            int((node.y+0.5)*grid_size // cluster_size),
+        )
+        if key not in kept:
+            kept[key] = (node, node_type, label)
+        representatives[node] = kept[key][0]
+    return list(kept.values()), representatives
+
+
+def _thin_edges(edges: List[Tuple], representatives: Dict, grid_size: float, min_length: float) -> List[Tuple]:
+    """Moves the ends of the edges to the nodes they were merged into,
+    and drops the edges shorter than min_length, those within a cluster, and
+    duplicates.
+
+    :param edges: (u, v, type) of every edge.
+    :param representatives: The kept node of every node, see _cluster_nodes.
+    :param grid_size: The size of a grid cell.
+    :param min_length: The shortest edge kept, in drawing units.
+    :return: The (u, v, type) of the kept edges.
+    """
+    thinned = {}
+    for u, v, edge_type in edges:
+        if min_length and math.hypot(u.x-v.x, u.y-v.y)*grid_size < min_length:
+            continue
+        u, v = representatives[u], representatives[v]
+        if u == v:
+            continue
+        key = (u, v) if (u.x, u.y) <= (v.x, v.y) else (v, u)
+        thinned.setdefault(key, edge_type)
+    return [(u, v, edge_type) for (u, v), edge_type in thinned.items()]
+
+
+def export_tiled_graph_overlay(
+        dxf: DXF,
+        graph,
+        grid_size,
+        canvas_lims,
+        outdir: str,
+        max_zoom: int=DEFAULT_MAX_ZOOM,
+        precision: int=DEFAULT_SVG_PRECISION,
+        compress: bool=False,
+) -> Dict:
+    """Exports the graph overlay on the CAD file as a pyramid of svg tiles.
+    Zoom level z splits the canvas into 2**z x 2**z tiles that are each
+    rendered at TILE_PIXELS wide, so walls and doors are simplified to about
+    a pixel at that scale. Below max_zoom, the nodes of a type are merged
+    into one marker per NODE_CLUSTER_PIXELS pixels square (at least a
+    marker wide), and edges shorter
+    than a pixel or within a marker are dropped, so that the coarse tiles
+    stay small. Room labels are only drawn at max_zoom. Empty tiles are
+    skipped, and an index.json describing the tiles is written to outdir.
+
+    :param dxf: The DXF object the graph was computed from.
+    :param graph: The graph to draw.
+    :param grid_size: The size of a grid cell.
+    :param canvas_lims: The width and height of the canvas.
+    :param outdir: The directory to write the tiles and index into.
+    :param max_zoom: The most detailed zoom level.
+    :param precision: The number of decimals kept in coordinates.
+    :param compress: If True, tiles are written as .svgz.
+    :return: The tile index.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    canvas_width, canvas_height = canvas_lims[0], canvas_lims[1]
+    extension = "svgz" if compress else "svg"
+
+    nodes = [
+        (node, data.get("type"), data.get("room_label"))
+        for node, data in graph.nodes(data=True)
+    ]
+    edges = list(graph.edges(data="type"))
+
+    index = {
+        "canvas": [canvas_width, canvas_height],
+        "tile_pixels": TILE_PIXELS,
+        "zoom_levels": [],
+    }
+    for zoom in range(max_zoom+1):
+        tiles_per_axis = 2**zoom
+        tile_width = canvas_width / tiles_per_axis
+        tile_height = canvas_height / tiles_per_axis
+        tolerance = 0 if zoom == max_zoom else max(tile_width, tile_height) / TILE_PIXELS
+
+        walls = _bucket_geometries(dxf.walls, tile_width, tile_height, tiles_per_axis, tolerance)
+        doors = _bucket_geometries(dxf.doors, tile_width, tile_height, tiles_per_axis, tolerance)
+        cluster_size = tolerance and max(tolerance * NODE_CLUSTER_PIXELS, 2 * NODE_RADIUS_CELLS * grid_size)
+        zoom_nodes, representatives = _cluster_nodes(nodes, grid_size, cluster_size)
+        zoom_edges = _thin_edges(edges, representatives, grid_size, tolerance)
+
+        tile_nodes = defaultdict(lambda: defaultdict(list))
+        tile_labels = defaultdict(list)
+        for node, node_type, label in zoom_nodes:
+            x, y = (node.x+0.5)*grid_size, (node.y+0.5)*grid_size
+            cols, rows = _tile_range(x, y, x, y, tile_width, tile_height, tiles_per_axis)
+            tile = (cols[0], rows[0])
+            tile_nodes[tile][NODE_COLORS.get(node_type, "rgb(0,0,0)")].append(node)
+            if zoom == max_zoom:
+                tile_labels[tile].append((node.x, node.y, f'{label or "NA"}+{node.x}+{node.y}'))
+
+        tile_edges = defaultdict(lambda: defaultdict(list))
+        for u, v, edge_type in zoom_edges:
+            cols, rows = _tile_range(
+                (min(u.x, v.x)+0.5)*grid_size,
+                (min(u.y, v.y)+0.5)*grid_size,
+                (max(u.x, v.x)+0.5)*grid_size,
+                (max(u.y, v.y)+0.5)*grid_size,
+                tile_width,
+                tile_height,
+                tiles_per_axis,
+            )
+            color = EDGE_COLORS.get(edge_type, DEFAULT_EDGE_COLOR)
+            for col in cols:
+                for row in rows:
+                    tile_edges[(col, row)][color].append((u, v))
+
+        tiles = []
+        occupied = set(walls) | set(doors) | set(tile_nodes) | set(tile_edges)
+        for col, row in sorted(occupied):
+            filename = f"{zoom}/{col}_{row}.{extension}"
+            os.makedirs(os.path.join(outdir, str(zoom)), exist_ok=True)
+            bounds = [col*tile_width, row*tile_height, (col+1)*tile_width, (row+1)*tile_height]
+            with SvgWriter(
+                    os.path.join(outdir, filename),
+                    width=TILE_PIXELS,
+                    height=TILE_PIXELS,
+                    viewbox=f"{bounds[0]} {bounds[1]} {tile_width} {tile_height}",
+            ) as svg:
+                svg.write(draw_geometries(walls.get((col, row), []), precision) + "\n")
+                svg.write(draw_geometries(doors.get((col, row), []), precision) + "\n")
+                for color, color_nodes in tile_nodes[(col, row)].items():
+                    svg.write(draw_nodes(color_nodes, grid_size, color, precision) + "\n")
+                svg.write(write_texts(tile_labels[(col, row)], grid_size, precision) + "\n")
+                for color, color_edges in tile_edges[(col, row)].items():
+                    svg.write(draw_edges(color_edges, grid_size, color, precision) + "\n")
+            tiles.append({"col": col, "row": row, "file": filename, "bounds": bounds})
+
+        logging.info(f"zoom level {zoom}: {len(tiles)} tiles written")
+        index["zoom_levels"].append({
+            "zoom": zoom,
+            "tiles_per_axis": tiles_per_axis,
+            "tile_width": tile_width,
+            "tile_height": tile_height,
+            "simplify_tolerance": tolerance,
+            "nodes": len(zoom_nodes),
+            "edges": len(zoom_edges),
+            "tiles": tiles,
+        })
+
+    with open(os.path.join(outdir, TILE_INDEX_FILENAME), "w") as index_file:
+        json.dump(index, index_file, indent=1)
+    return index
+
@@ -1,3 +1,32 @@
+from typing import Iterable
+from typing import List
+from xml.sax.saxutils import escape
+
+from shapely.geometry.base import BaseGeometry
+
+LINE_STYLE = 'fill="none" stroke="{stroke_color}" stroke-width="2.0" opacity="0.8"'
+POLYGON_STYLE = 'fill-rule="evenodd" fill="#66cc99" stroke="#555555" stroke-width="2.0" opacity="0.6"'
+NODE_STYLE = "stroke:pink;stroke-width:10;fill-opacity:0.3;stroke-opacity:0.9"
+# the radius of a node marker in grid cells
+NODE_RADIUS_CELLS = 1.5
+
+
+def format_coordinate(value: float, precision: int=None) -> str:
+    """Formats a coordinate for svg output.
+
+    :param value: The coordinate.
+    :param precision: The number of decimals to keep. None keeps the full
+           python representation.
+    :return: The formatted coordinate, without trailing zeros.
+    """
+    if precision is None:
+        return str(value)
+    formatted = "%.*f" % (precision, value)
+    if "." in formatted:
+        formatted = formatted.rstrip("0").rstrip(".")
+    return "0" if formatted == "-0" else formatted
+
+
 def draw_line(line):
 
     return line.svg(stroke_color='rgb({r},{g},{b})')
@@ -7,10 +36,42 @@ def draw_edge(
         edge,
         grid_size,
         color="rgb(0,0,255)",
-):     
+        precision=None,
+):
+    x1 = format_coordinate((edge[0].x+0.5)*grid_size, precision)
+    x2 = format_coordinate((edge[1].x+0.5)*grid_size, precision)
+    y1 = format_coordinate((edge[0].y+0.5)*grid_size, precision)
+    y2 = format_coordinate((edge[1].y+0.5)*grid_size, precision)
     return f"<line stroke='{color}' stroke-width='5'" \
-           f" x1='{(edge[0].x+0.5)*grid_size}' x2='{(edge[1].x+0.5)*grid_size}'" \
-           f" y1='{(edge[0].y+0.5)*grid_size}' y2='{(edge[1].y+0.5)*grid_size}' />"
+           f" x1='{x1}' x2='{x2}'" \
+           f" y1='{y1}' y2='{y2}' />"
+
+
+def draw_edges(
+        edges,
+        grid_size,
+        color="rgb(0,0,255)",
+        precision=None,
+):
+    """Draws many edges with the same color as a single svg path.
+
+    :param edges: An iterable of (u, v) node pairs.
+    :param grid_size: The size of a grid cell.
+    :param color: The stroke color of the edges.
+    :param precision: The number of decimals kept in coordinates.
+    :return: An svg path element, or an empty string if there are no edges.
+    """
+    path_data = []
+    for u, v in edges:
+        path_data.append(
+            f"M{format_coordinate((u.x+0.5)*grid_size, precision)} "
+            f"{format_coordinate((u.y+0.5)*grid_size, precision)}"
+            f"L{format_coordinate((v.x+0.5)*grid_size, precision)} "
+            f"{format_coordinate((v.y+0.5)*grid_size, precision)}"
+        )
+    if not path_data:
+        return ""
+    return f"<path stroke='{color}' stroke-width='5' fill='none' d='{''.join(path_data)}' />"
 
 
 def draw_block(x, y, grid_size, color):
@@ -26,7 +87,7 @@ def draw_block(x, y, grid_size, color):
 def draw_circle(x, y, grid_size, color):
     opacity = "0.3"
     
-    square_line = f'<circle cx="{(x+0.5)*grid_size}" cy="{(y+0.5)*grid_size}" r="{grid_size*1.5}" '
+    square_line = f'<circle cx="{(x+0.5)*grid_size}" cy="{(y+0.5)*grid_size}" r="{grid_size*NODE_RADIUS_CELLS}" '
     # square_line = f'<circle cx="{(x+.5)*grid_size}" cy="{(y+.5)*grid_size}" r="{grid_size*0.5}" '
     square_line += f'style="fill:{color};stroke:pink;stroke-width:10;fill-opacity:{opacity};'
     square_line += 'stroke-opacity:0.9" />'
@@ -34,6 +95,106 @@ def draw_circle(x, y, grid_size, color):
     return square_line
 
 
-def write_text(x, y, grid_size, text):
+def draw_nodes(nodes, grid_size, color, precision=None):
+    """Draws many nodes with the same color as circles inside one group that
+    carries their shared style, matching the look of draw_circle.
+
+    :param nodes: An iterable of nodes with x and y fields.
+    :param grid_size: The size of a grid cell.
+    :param color: The fill color of the nodes.
+    :param precision: The number of decimals kept in coordinates.
+    :return: An svg group element, or an empty string if there are no nodes.
+    """
+    radius = format_coordinate(grid_size*NODE_RADIUS_CELLS, precision)
+    circles = [
+        f'<circle cx="{format_coordinate((node.x+0.5)*grid_size, precision)}" '
+        f'cy="{format_coordinate((node.y+0.5)*grid_size, precision)}" r="{radius}" />'
+        for node in nodes
+    ]
+    if not circles:
+        return ""
+    return f'<g style="fill:{color};{NODE_STYLE}">' + "\n".join(circles) + "</g>"
+
+
+def write_text(x, y, grid_size, text, precision=None):
+
+    return f'<text font-size="8" x="{format_coordinate(x*grid_size, precision)}" ' \
+           f'y="{format_coordinate((y-1)*grid_size, precision)}" fill="black">{text}</text>'
+
+
+def write_texts(positioned_texts, grid_size, precision=None):
+    """Writes many labels inside one group that carries their shared style.
+
+    :param positioned_texts: An iterable of (x, y, text) tuples.
+    :param grid_size: The size of a grid cell.
+    :param precision: The number of decimals kept in coordinates.
+    :return: An svg group element, or an empty string if there are no texts.
+    """
+    texts = [
+        f'<text x="{format_coordinate(x*grid_size, precision)}" '
+        f'y="{format_coordinate((y-1)*grid_size, precision)}">{escape(text)}</text>'
+        for x, y, text in positioned_texts
+    ]
+    if not texts:
+        return ""
+    return '<g font-size="8" fill="black">' + "\n".join(texts) + "</g>"
+
+
+def geometry_path_data(geometry: BaseGeometry, precision: int=None) -> List[str]:
+    """Converts a shapely geometry into svg path data, one subpath per ring
+    or line. Polygon rings are closed with Z.
+
+    :param geometry: A shapely LineString, Polygon, or a collection of them.
+    :param precision: The number of decimals kept in coordinates.
+    :return: A list of svg subpaths.
+    """
+    if geometry.is_empty:
+        return []
+    if hasattr(geometry, "geoms"):
+        path_data = []
+        for part in geometry.geoms:
+            path_data.extend(geometry_path_data(part, precision))
+        return path_data
+    if geometry.geom_type == "Polygon":
+        rings = [geometry.exterior] + list(geometry.interiors)
+        return [_coords_path_data(ring.coords, precision) + "Z" for ring in rings]
+    return [_coords_path_data(geometry.coords, precision)]
+
+
+def _coords_path_data(coords, precision: int=None) -> str:
+    points = [
+        f"{format_coordinate(x, precision)} {format_coordinate(y, precision)}"
+        for x, y, *_ in coords
+    ]
+    return "M" + "L".join(points)
+
+
+def draw_geometries(
+        geometries: Iterable[BaseGeometry],
+        precision: int=None,
+        stroke_color: str="#66cc99",
+) -> str:
+    """Draws a layer of shapely geometries (e.g. all walls) as at most two
+    svg paths: one for polygons and one for lines, styled like the output
+    of shapely's svg().
+
+    :param geometries: The shapely geometries of the layer.
+    :param precision: The number of decimals kept in coordinates.
+    :param stroke_color: The stroke color of the lines.
+    :return: The svg path elements of the layer.
+    """
+    line_data = []
+    polygon_data = []
+    for geometry in geometries:
+        if geometry.geom_type in {"Polygon", "MultiPolygon"}:
+            polygon_data.extend(geometry_path_data(geometry, precision))
+        else:
+            line_data.extend(geometry_path_data(geometry, precision))
 
-    return f'<text font-size="8" x="{x*grid_size}" y="{(y-1)*grid_size}" fill="black">{text}</text>'
+    paths = []
+    if polygon_data:
+        paths.append(f'<path {POLYGON_STYLE} d="{"".join(polygon_data)}" />')
+    if line_data:
+        style = LINE_STYLE.format(stroke_color=stroke_color)
+        paths.append(f'<path {style} d="{"".join(line_data)}" />')
+    return "\n".join(paths)
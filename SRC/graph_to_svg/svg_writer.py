@@ -0,0 +1,77 @@
+import gzip
+from typing import Iterable
+
+SVG_HEADER = (
+    "<?xml version='1.0' encoding='utf-8' ?> <svg baseProfile='tiny' \n"
+    "height='{height}' version='1.1' width='{width}' xmlns='http://www.w3.org/2000/svg' \n"
+    "xmlns:ev='http://www.w3.org/2001/xml-events' xmlns:xlink='http://www.w3.org/1999/xlink'><defs />"
+)
+SVG_FOOTER = "</svg>"
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+class SvgWriter:
+    """A buffered SVG file writer. Elements are collected in memory and
+    written in chunks of roughly `chunk_size` characters instead of with one
+    write call each. Files ending in .svgz are gzip compressed.
+
+    Use as a context manager; the svg header is written on enter and the
+    footer on exit:
+
+        with SvgWriter("floor.svgz", width, height) as svg:
+            svg.write(element)
+    """
+
+    def __init__(
+            self,
+            outfile: str,
+            width: float,
+            height: float,
+            chunk_size: int=DEFAULT_CHUNK_SIZE,
+            viewbox: str=None,
+    ):
+        self.outfile = outfile
+        self.width = width
+        self.height = height
+        self.chunk_size = chunk_size
+        self.viewbox = viewbox
+        self._buffer = []
+        self._buffered_size = 0
+        self._file = None
+
+    def __enter__(self):
+        if self.outfile.endswith(".svgz"):
+            self._file = gzip.open(self.outfile, "wt", encoding="utf-8")
+        else:
+            self._file = open(self.outfile, "w+", encoding="utf-8")
+        header = SVG_HEADER.format(height=self.height, width=self.width)
+        if self.viewbox:
+            header = header.replace("<svg ", f"<svg viewBox='{self.viewbox}' ", 1)
+        self.write(header)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.write(SVG_FOOTER)
+                self.flush()
+        finally:
+            self._file.close()
+
+    def write(self, element: str):
+        """Adds an element (or any svg text) to the output."""
+        self._buffer.append(element)
+        self._buffered_size += len(element)
+        if self._buffered_size >= self.chunk_size:
+            self.flush()
+
+    def write_all(self, elements: Iterable[str], separator: str="\n"):
+        """Adds many elements to the output, each followed by `separator`."""
+        for element in elements:
+            self.write(element + separator)
+
+    def flush(self):
+        if self._buffer:
+            self._file.write("".join(self._buffer))
+            self._buffer = []
+            self._buffered_size = 0
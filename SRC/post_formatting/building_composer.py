@@ -0,0 +1,200 @@
+import logging
+import math
+from collections import defaultdict
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from networkx import Graph
+
+from post_formatting.graph_serializer import make_4d_nodes
+from util.constants import VERTICAL_EDGE_WEIGHT
+from util.constants import VERTICAL_EDGE_WEIGHT2
+from util.data_containers import Node_4d
+
+VERTICAL_EDGE_TYPES = ("stair", "elevator")
+
+
+def stair_shaft_key(attributes: Dict) -> Optional[str]:
+    """Stairs are matched across floors by the last 5 characters of their
+    room label (e.g. '022-S'), as in demo.py."""
+    if attributes.get("RMNAC") == "STAIR" and attributes.get("room_label"):
+        return attributes["room_label"][-5:]
+    return None
+
+
+def elevator_shaft_key(attributes: Dict) -> Optional[str]:
+    """Elevators are matched across floors by their room name (e.g.
+    'ELEV D'). Elevator lobbies are not shafts."""
+    room_name = attributes.get("RMNAC") or ""
+    if "ELEV" in room_name and "LOBBY" not in room_name:
+        return room_name
+    return None
+
+
+SHAFT_KEYS = (
+    ("stair", stair_shaft_key),
+    ("elevator", elevator_shaft_key),
+)
+
+
+class BuildingGraphComposer:
+    """Merges the graphs of the floors of a building into one building graph
+    in which stairs and elevators of the same shaft are linked between
+    consecutive floors. Floors can be added or replaced one at a time: only
+    the nodes of that floor and the vertical edges to its neighbouring floors
+    are touched, the rest of the building graph is kept as is.
+    """
+
+    def __init__(self, building: str, floor_order: List[str]):
+        """
+        :param building: The name of the building.
+        :param floor_order: All floors of the building, from bottom to top.
+        """
+        self.building = building
+        self.floor_order = list(floor_order)
+        self.graph = Graph()
+        self._floor_nodes = {}
+        self._connectors = {}
+
+    @classmethod
+    def from_graph(cls, graph: Graph, building: str, floor_order: List[str]):
+        """Resumes composition from a previously composed building graph
+        (e.g. one loaded with read_graph_npz).
+
+        :param graph: A building graph with Node_4d nodes.
+        :param building: The name of the building.
+        :param floor_order: All floors of the building, from bottom to top.
+        :return: A BuildingGraphComposer holding graph.
+        """
+        composer = cls(building, floor_order)
+        composer.graph = graph
+        floor_nodes = defaultdict(set)
+        for node in graph.nodes:
+            floor_nodes[node.floor].add(node)
+        for floor, nodes in floor_nodes.items():
+            composer._floor_nodes[floor] = nodes
+            composer._connectors[floor] = composer._find_connectors(nodes)
+        return composer
+
+    def floors(self) -> List[str]:
+        """Returns the floors currently in the building graph, bottom to top."""
+        return [floor for floor in self.floor_order if floor in self._floor_nodes]
+
+    def _find_connectors(self, nodes) -> Dict[Tuple[str, str], List[Node_4d]]:
+        connectors = defaultdict(list)
+        for node in nodes:
+            attributes = self.graph.nodes[node]
+            for edge_type, shaft_key in SHAFT_KEYS:
+                key = shaft_key(attributes)
+                if key is not None:
+                    connectors[(edge_type, key)].append(node)
+        for shaft_nodes in connectors.values():
+            shaft_nodes.sort()
+        return dict(connectors)
+
+    def _adjacent_floors(self, floor: str) -> Tuple[Optional[str], Optional[str]]:
+        position = self.floor_order.index(floor)
+        present = set(self._floor_nodes)
+        below = [f for f in self.floor_order[:position] if f in present]
+        above = [f for f in self.floor_order[position+1:] if f in present]
+        return (below[-1] if below else None), (above[0] if above else None)
+
+    def _unlink_floors(self, lower: str, upper: str):
+        edges = [
+            (u, v)
+            for u in self._floor_nodes[lower]
+            for v, data in self.graph.adj[u].items()
+            if v.floor == upper and data.get("type") in VERTICAL_EDGE_TYPES
+        ]
+        self.graph.remove_edges_from(edges)
+
+    def _link_floors(self, lower: str, upper: str) -> int:
+        """Links every stair/elevator node on the lower floor to the nearest
+        node of the same shaft on the upper floor.
+
+        :return: The number of vertical edges added.
+        """
+        added = 0
+        upper_connectors = self._connectors[upper]
+        for (edge_type, key), lower_nodes in self._connectors[lower].items():
+            upper_nodes = upper_connectors.get((edge_type, key))
+            if not upper_nodes:
+                continue
+            for node in lower_nodes:
+                nearest = min(
+                    upper_nodes,
+                    key=lambda other: (math.hypot(other.x - node.x, other.y - node.y), other),
+                )
+                self.graph.add_edge(
+                    node,
+                    nearest,
+                    weight=VERTICAL_EDGE_WEIGHT,
+                    weight2=VERTICAL_EDGE_WEIGHT2,
+                    type=edge_type,
+                )
+                added += 1
+        return added
+
+    def remove_floor(self, floor: str):
+        """Removes a floor and its vertical edges, and links the floors that
+        were below and above it to each other."""
+        if floor not in self._floor_nodes:
+            return
+        below, above = self._adjacent_floors(floor)
+        self.graph.remove_nodes_from(self._floor_nodes.pop(floor))
+        del self._connectors[floor]
+        if below is not None and above is not None:
+            self._link_floors(below, above)
+
+    def set_floor(self, floor: str, floor_graph: Graph):
+        """Adds the graph of a floor to the building graph, replacing the
+        previous graph of that floor if there was one.
+
+        :param floor: The floor, one of floor_order.
+        :param floor_graph: The graph of the floor. Nodes that are not yet
+               Node_4d nodes of this floor and building are converted.
+        """
+        if floor not in self.floor_order:
+            raise ValueError(f"{floor} is not a floor of {self.building}")
+        self.remove_floor(floor)
+
+        first_node = next(iter(floor_graph.nodes), None)
+        if first_node is not None and (
+                getattr(first_node, "floor", None) != floor or
+                getattr(first_node, "building", None) != self.building
+        ):
+            floor_graph = make_4d_nodes(floor_graph, floor=floor, building=self.building)
+
+        below, above = self._adjacent_floors(floor)
+        if below is not None and above is not None:
+            self._unlink_floors(below, above)
+
+        self.graph.add_nodes_from(floor_graph.nodes(data=True))
+        self.graph.add_edges_from(floor_graph.edges(data=True))
+        self._floor_nodes[floor] = set(floor_graph.nodes)
+        self._connectors[floor] = self._find_connectors(self._floor_nodes[floor])
+
+        added = 0
+        if below is not None:
+            added += self._link_floors(below, floor)
+        if above is not None:
+            added += self._link_floors(floor, above)
+        logging.info(f"floor {floor} of {self.building} composed, {added} vertical edges added")
+
+
+def compose_building_graph(
+        floor_graphs: List[Tuple[str, Graph]],
+        building: str,
+) -> Graph:
+    """Composes the graphs of all floors of a building into one graph.
+
+    :param floor_graphs: (floor, graph) pairs, from bottom to top.
+    :param building: The name of the building.
+    :return: The building graph.
+    """
+    composer = BuildingGraphComposer(building, [floor for floor, _ in floor_graphs])
+    for floor, floor_graph in floor_graphs:
+        composer.set_floor(floor, floor_graph)
+    return composer.graph
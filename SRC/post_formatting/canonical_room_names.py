@@ -1,46 +1,93 @@
 import csv
+from typing import Dict
+from typing import Tuple
+
 from networkx import read_yaml
 
+from graph.room_label_index import drop_extensions
+from graph.room_label_index import get_room_label_index
+from graph.room_label_index import identity
+from graph.room_label_index import remove_hyphens
+from post_formatting.interned_graph import InternedGraph
+from post_formatting.interned_graph import read_interned_graph_npz
+
+
+MATCH_TRANSFORMS = (
+    ("exact", identity),
+    ("hyphens_removed", remove_hyphens),
+    ("extensions_dropped", drop_extensions),
+)
+NOT_FOUND = "not_found"
+
+
+def match_canonical_room_names(
+        graph,
+        rooms_to_ids: Dict[str, str],
+) -> Tuple[Dict[str, Tuple[str, str]], Dict[str, int]]:
+    """Matches database room names against the room labels of a graph in a
+    single pass. The labels are normalized once per transform in
+    MATCH_TRANSFORMS, and each room is tried against them in that order.
+
+    :param graph: The graph with room labels, or an InternedGraph.
+    :param rooms_to_ids: A dict from database room names to room ids.
+    :return: A dict from every matched room name to its (rid, match kind),
+             and a dict counting the rooms per match kind (and NOT_FOUND).
+    """
+    if isinstance(graph, InternedGraph):
+        labels = [label for label in graph.labels if label]
+        label_sets = [
+            (kind, transform, {transform(label) for label in labels})
+            for kind, transform in MATCH_TRANSFORMS
+        ]
+    else:
+        index = get_room_label_index(graph)
+        label_sets = [
+            (kind, transform, index.labels(transform))
+            for kind, transform in MATCH_TRANSFORMS
+        ]
+    matches = {}
+    stats = {kind: 0 for kind, _ in MATCH_TRANSFORMS}
+    stats[NOT_FOUND] = 0
+    for room_name, rid in rooms_to_ids.items():
+        transformed_roomname = get_transformed_roomname(room_name)
+        for kind, transform, labels in label_sets:
+            if transform(transformed_roomname) in labels:
+                matches[room_name] = (rid, kind)
+                stats[kind] += 1
+                break
+        else:
+            stats[NOT_FOUND] += 1
+    return matches, stats
+
 
 def add_canonical_room_names(
         db_roomnames_filepath: str,
         graph_filepath: str,
 ):
-    graph = read_yaml(graph_filepath)
+    if graph_filepath.endswith(".npz"):
+        # only the room labels are needed, the interned graph has them as
+        # a table without building a networkx graph
+        graph = read_interned_graph_npz(graph_filepath)
+    else:
+        graph = read_yaml(graph_filepath)
     rooms_to_ids = {}
     with open(db_roomnames_filepath) as db_rooms_file:
         dic_reader = csv.DictReader(db_rooms_file, delimiter="\t")
         for row in dic_reader:
-            rooms_to_ids[row["room"]] = row["rid"]
-    rooms_found = []
-    hyphen_rooms_found = []
-    rooms_not_found = []
-    extensions_dropped_found = []
-
-    aaa = {}
-    for i in rooms_to_ids:
-        t = get_transformed_roomname(i)
-        aaa[t] = 1
-
-    print(len(aaa.keys()))
-    a = {}
-    for node in graph.nodes:
-        if "dx" not in graph.nodes[node]["room_label"]:
-            label = graph.nodes[node]["room_label"]
-            a[label] = 1
-
-    print(len(a.keys()))
+            rooms_to_ids[get_transformed_roomname(row["room"])] = row["rid"]
+    print(len(rooms_to_ids))
 
-    for room_name in aaa:
-        transformed_roomname = get_transformed_roomname(room_name)
-        if graph_has_room_label(graph, transformed_roomname, transform=lambda x: x):
-            rooms_found.append(room_name)
-        elif graph_has_room_label(graph, transformed_roomname, transform=remove_hyphens):
-            hyphen_rooms_found.append(room_name)
-        elif graph_has_room_label(graph, transformed_roomname, transform=drop_extensions):
-            extensions_dropped_found.append(room_name)
+    matches, stats = match_canonical_room_names(graph, rooms_to_ids)
+    rooms_by_kind = {kind: [] for kind, _ in MATCH_TRANSFORMS}
+    rooms_not_found = []
+    for room_name in rooms_to_ids:
+        if room_name in matches:
+            rooms_by_kind[matches[room_name][1]].append(room_name)
         else:
             rooms_not_found.append(room_name)
+    rooms_found = rooms_by_kind["exact"]
+    hyphen_rooms_found = rooms_by_kind["hyphens_removed"]
+    extensions_dropped_found = rooms_by_kind["extensions_dropped"]
 
     rooms_not_found = remove_derived_rooms(rooms_not_found)
 
@@ -60,15 +107,7 @@ def get_transformed_roomname(roomname: str) -> str:
 
 
 def graph_has_room_label(graph, room_label, transform):
-    for node in graph.nodes:
-        if transform(graph.nodes[node]["room_label"]) == transform(room_label):
-            return True
-    return False
-
-
-def remove_hyphens(word: str) -> str:
-    word = word.split("-")
-    return "".join(word)
+    return get_room_label_index(graph).has_label(room_label, transform)
 
 
 def remove_derived_rooms(rooms_list):
@@ -78,6 +117,3 @@ def remove_derived_rooms(rooms_list):
         a[room] = 1
     return list(a.keys())
 
-
-def drop_extensions(word: str) -> str:
-    return word.split("-")[0]
@@ -1,64 +1,225 @@
+import argparse
 import csv
-from networkx import read_yaml
-from networkx import compose_all
+import logging
+import os
+import time
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
 from typing import List
-from graph.graph_utils import compute_hospital_graph_shortest_path
+from typing import Tuple
+
+import numpy as np
+from networkx import read_yaml
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from post_formatting.graph_npz import write_graph_npz
+from post_formatting.mapped_graph import MappedGraph
+
+OUTPUT_COLUMNS = [
+    "hops_graph",
+    "hops_manual",
+    "room1",
+    "room2",
+    "building1",
+    "building2",
+    "desc1",
+    "desc2",
+]
+PROGRESS_INTERVAL = 1000
+
+
+def fast_graph_filepath(graph_filepath: str) -> str:
+    """Returns the .npz version of a graph file, converting a .yaml graph
+    once and caching the result next to it.
+
+    :param graph_filepath: Path to a .npz or .yaml graph.
+    :return: Path to the .npz graph.
+    """
+    if graph_filepath.endswith(".npz"):
+        return graph_filepath
+    npz_filepath = os.path.splitext(graph_filepath)[0] + ".npz"
+    if not os.path.exists(npz_filepath) or \
+            os.path.getmtime(npz_filepath) < os.path.getmtime(graph_filepath):
+        logging.info(f"converting {graph_filepath} to {npz_filepath}")
+        write_graph_npz(read_yaml(graph_filepath), npz_filepath)
+    return npz_filepath
+
+
+def _hop_matrix(graph: MappedGraph) -> csr_matrix:
+    """Wraps the memory-mapped adjacency of a graph as a CSR matrix of hops.
+    The (much larger) neighbour column stays shared; only the row pointers
+    are narrowed to its index dtype."""
+    indices = graph.columns["adj_indices"]
+    indptr = graph.columns["adj_indptr"].astype(indices.dtype)
+    return csr_matrix(
+        (np.ones(len(indices), dtype=np.float32), indices, indptr),
+        shape=(len(graph), len(graph)),
+    )
+
+
+_worker_graph_filepaths = {}
+_worker_graphs = {}
+
+
+def _init_worker(graph_filepaths: Dict[str, str]):
+    global _worker_graph_filepaths
+    _worker_graph_filepaths = graph_filepaths
+    _worker_graphs.clear()
+
+
+def _worker_graph(building: str) -> Tuple[MappedGraph, csr_matrix]:
+    if building not in _worker_graphs:
+        graph = MappedGraph(_worker_graph_filepaths[building])
+        _worker_graphs[building] = (graph, _hop_matrix(graph))
+    return _worker_graphs[building]
+
+
+def _room_node(graph: MappedGraph, room: str):
+    nodes = graph.nodes_with_room_label(room.split(".")[-1])
+    return int(nodes[0]) if len(nodes) else None
+
+
+def hop_distances_from_room(task) -> Tuple[List[Tuple], int]:
+    """Answers all queries that share a building and source room with one
+    shortest path tree.
+
+    :param task: A (building, room1, rows) tuple, where rows are the csv
+           rows of the queries.
+    :return: The output tuples of the answered queries, and the number of
+             queries whose rooms were not found or not connected.
+    """
+    building, room1, rows = task
+    graph, hop_matrix = _worker_graph(building)
+    source = _room_node(graph, room1)
+    if source is None:
+        return [], len(rows)
+    hops = dijkstra(hop_matrix, unweighted=True, indices=source)
+
+    results = []
+    for row in rows:
+        target = _room_node(graph, row["room2"])
+        if target is None or not np.isfinite(hops[target]) or hops[target] == 0:
+            continue
+        results.append((
+            int(hops[target]),
+            int(row["dist"]),
+            row["room1"],
+            row["room2"],
+            row["building1"],
+            row["building2"],
+            row["desc1"],
+            row["desc2"],
+        ))
+    return results, len(rows) - len(results)
 
 
 def compare_hop_distances(
         db_roomnames_filepath: str,
+        graph_filepaths: Dict[str, str],
+        outfile: str="final_hops_data.csv",
+        processes: int=None,
 ):
-    graph_filepaths = [
-        ("data/graphs2/GeneralHospital.yaml","GH"),
-        # ("/Users/talalriaz/RA_FALL_2017/dxf_to_graph/data/graphs/GeneralHospital.yaml","GH"),
-        # ("/Users/talalriaz/RA_FALL_2017/dxf_to_graph/data/graphs/JohnColloton.yaml","JCP"),
-        # ("/Users/talalriaz/RA_FALL_2017/dxf_to_graph/data/graphs/BoydTower.yaml","BT"),
-        # ("/Users/talalriaz/RA_FALL_2017/dxf_to_graph/data/graphs/JohnPappajohn.yaml","JPP"),
-        # ("/Users/talalriaz/RA_FALL_2017/dxf_to_graph/data/graphs/RoyCarver.yaml","RCP"),
-    ]
-    graphs = {}
-    for graph_name in graph_filepaths:
-        graphs[graph_name[1]] = read_yaml(graph_name[0])
-    z = 0
-    y=0
-    hop_distances = []
+    """Compares manually estimated hop distances between rooms with hop
+    distances in the graphs. Queries are grouped by building and source
+    room, every group is answered with one shortest path tree in a process
+    pool, and results are streamed to a csv file.
+
+    :param db_roomnames_filepath: A tab separated file with room1, room2,
+           building1, building2, desc1, desc2 and dist (manual hops) columns.
+    :param graph_filepaths: A dict from building codes (as used in
+           building1) to .npz (or .yaml) graph files.
+    :param outfile: The csv file to write the results to.
+    :param processes: The number of worker processes. None uses one per cpu,
+           0 runs everything in this process.
+    """
+    graph_filepaths = {
+        building: fast_graph_filepath(filepath)
+        for building, filepath in graph_filepaths.items()
+    }
+
+    groups = defaultdict(list)
+    num_queries = 0
+    skipped = defaultdict(int)
     with open(db_roomnames_filepath) as db_rooms_file:
         dic_reader = csv.DictReader(db_rooms_file, delimiter="\t")
         for row in dic_reader:
-            z += 1
-            hops_manual = int(row["dist"])
-            if row["building1"] not in graphs:
+            num_queries += 1
+            if row["building1"] not in graph_filepaths:
+                skipped["unknown building"] += 1
                 continue
             try:
-                hops_graph = compute_hospital_graph_shortest_path(
-                    hospital_graph=graphs[row["building1"]],
-                    room_label_1=row["room1"].split(".")[-1],
-                    room_label_2=row["room2"].split(".")[-1],
-                )
-                if hops_graph:
-                    hop_distances.append(
-                        (
-                            hops_graph,
-                            hops_manual,
-                            row["room1"],
-                            row["room2"],
-                            row["building1"],
-                            row["building2"],
-                            row["desc1"],
-                            row["desc2"],
-                        ),
-                    )
-                    y += 1
-                    if y%100 == 0:
-                        print(y)
-            except:
+                int(row["dist"])
+            except ValueError:
+                skipped["bad manual distance"] += 1
                 continue
+            groups[(row["building1"], row["room1"].split(".")[-1])].append(row)
+    tasks = [(building, room1, rows) for (building, room1), rows in groups.items()]
+    logging.info(f"{num_queries} queries in {len(tasks)} source room groups")
+
+    start_time = time.time()
+    answered = 0
+    with open(outfile, "w+", newline="") as output:
+        writer = csv.writer(output)
+        writer.writerow(OUTPUT_COLUMNS)
+        if processes == 0:
+            _init_worker(graph_filepaths)
+            results = map(hop_distances_from_room, tasks)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(
+                max_workers=processes,
+                initializer=_init_worker,
+                initargs=(graph_filepaths,),
+            )
+            results = executor.map(hop_distances_from_room, tasks, chunksize=16)
+        try:
+            for rows, unanswered in results:
+                writer.writerows(rows)
+                previous = answered
+                answered += len(rows)
+                skipped["rooms not found or not connected"] += unanswered
+                if answered // PROGRESS_INTERVAL != previous // PROGRESS_INTERVAL:
+                    rate = answered / max(time.time() - start_time, 1e-9)
+                    logging.info(f"{answered} hop distances written ({rate:.0f}/s)")
+        finally:
+            if executor:
+                executor.shutdown()
+
+    elapsed = time.time() - start_time
+    logging.info(
+        f"{answered} of {num_queries} queries answered in {elapsed:.1f}s "
+        f"({answered / max(elapsed, 1e-9):.0f}/s)"
+    )
+    for reason, count in skipped.items():
+        logging.info(f"{count} queries skipped: {reason}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--rooms', type=str, required=True, help="tab separated file of manual room to room hop distances")
+    parser.add_argument('-g', '--graph', type=str, action="append", required=True, metavar="BUILDING=PATH", help="graph file (.npz or .yaml) of a building, e.g. GH=data/graphs2/GeneralHospital.npz")
+    parser.add_argument('-o', '--outfile', type=str, default="final_hops_data.csv", help="path to output csv file")
+    parser.add_argument('-p', '--processes', type=int, help="number of worker processes (0 to run in this process)")
+    parser.add_argument('-v', '--verbose', action="store_true", help='turn verbose mode on')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
 
+    graph_filepaths = {}
+    for graph_arg in args.graph:
+        building, _, filepath = graph_arg.partition("=")
+        if not filepath:
+            parser.error(f"--graph expects BUILDING=PATH, got {graph_arg}")
+        graph_filepaths[building] = filepath
 
-    with open("final_hops_data.csv", "w+") as outfile:
-        for i in hop_distances:
-            outfile.write(str(i)[1:-1]+"\n")
+    compare_hop_distances(
+        db_roomnames_filepath=args.rooms,
+        graph_filepaths=graph_filepaths,
+        outfile=args.outfile,
+        processes=args.processes,
+    )
 
 
-compare_hop_distances("/Users/talalriaz/RA_FALL_2017/dxf_to_graph/out2.txt")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,514 @@
+import json
+import struct
+import zipfile
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Mapping
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+from networkx import Graph
+
+from util.data_containers import Node
+from util.data_containers import Node_4d
+from util.data_containers import SpaceType
+
+GRAPH_NPZ_VERSION = 3
+# before version 3, floors and buildings were stored as str() of their
+# values and all nodes were read back as Node_4d
+_TYPED_LOCATIONS_VERSION = 3
+# Offset of the file name length field inside a zip local file header.
+_ZIP_LOCAL_HEADER_SIZE = 30
+_ZIP_NAME_LENGTH_OFFSET = 26
+
+
+def space_type_code(space_type) -> int:
+    """Encodes a node `type` attribute as a small int. Graphs that went
+    through demo.py have their types stringified, so both forms are handled.
+
+    :param space_type: A SpaceType, or its str() representation.
+    :return: The SpaceType value, or -1 if the type is unknown.
+    """
+    if isinstance(space_type, SpaceType):
+        return space_type.value
+    if isinstance(space_type, str) and space_type.startswith("SpaceType."):
+        return SpaceType[space_type.split(".")[-1]].value
+    return -1
+
+
+def space_type_from_code(code: int) -> Optional[SpaceType]:
+    """Decodes space_type_code, None for -1."""
+    return SpaceType(code) if code >= 0 else None
+
+
+def edge_attributes_from_columns(weight: float, weight2: float, edge_type: str) -> Dict:
+    """The attribute dict of an edge from its columns: weights are NaN and
+    the type empty when the edge had none."""
+    attributes = {}
+    if weight == weight:
+        attributes["weight"] = weight
+    if weight2 == weight2:
+        attributes["weight2"] = weight2
+    if edge_type:
+        attributes["type"] = edge_type
+    return attributes
+
+
+def intern_value(table: Dict, value) -> int:
+    """Returns the index of value in table, adding it if it is not there yet.
+
+    :param table: A dict from values to their insertion index.
+    :param value: The value to intern.
+    :return: The index of value in table.
+    """
+    index = table.get(value)
+    if index is None:
+        index = len(table)
+        table[value] = index
+    return index
+
+
+def _string_column(table: Dict) -> np.ndarray:
+    return np.array(list(table), dtype=str) if table else np.zeros(0, dtype="<U1")
+
+
+def adjacency_columns(
+        edge_u: np.ndarray,
+        edge_v: np.ndarray,
+        num_nodes: int,
+) -> Dict[str, np.ndarray]:
+    """Builds a CSR adjacency index over an undirected edge list. The
+    neighbours of node i are adj_indices[adj_indptr[i]:adj_indptr[i+1]],
+    reached through the edges adj_edges[adj_indptr[i]:adj_indptr[i+1]].
+    Self loops are listed once.
+
+    :param edge_u: First endpoint of every edge.
+    :param edge_v: Second endpoint of every edge.
+    :param num_nodes: The number of nodes in the graph.
+    :return: A dict with the adj_indptr, adj_indices and adj_edges columns.
+    """
+    edge_ids = np.arange(len(edge_u), dtype=np.int32)
+    reverse = edge_u != edge_v
+    ends = np.concatenate([edge_u, edge_v[reverse]])
+    others = np.concatenate([edge_v, edge_u[reverse]])
+    edges = np.concatenate([edge_ids, edge_ids[reverse]])
+    order = np.argsort(ends, kind="stable")
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(ends, minlength=num_nodes), out=indptr[1:])
+    return {
+        "adj_indptr": indptr,
+        "adj_indices": others[order].astype(np.int32),
+        "adj_edges": edges[order].astype(np.int32),
+    }
+
+
+def label_columns(node_label: np.ndarray, num_labels: int) -> Dict[str, np.ndarray]:
+    """Builds an index from room labels to nodes. The nodes with label l
+    are label_nodes[label_indptr[l]:label_indptr[l+1]], in node order.
+
+    :param node_label: The label index of every node.
+    :param num_labels: The number of entries in the label table.
+    :return: A dict with the label_indptr and label_nodes columns.
+    """
+    indptr = np.zeros(num_labels + 1, dtype=np.int64)
+    np.cumsum(np.bincount(node_label, minlength=num_labels), out=indptr[1:])
+    return {
+        "label_indptr": indptr,
+        "label_nodes": np.argsort(node_label, kind="stable").astype(np.int32),
+    }
+
+
+def node_key_columns(
+        node_x: np.ndarray,
+        node_y: np.ndarray,
+        node_floor: np.ndarray,
+        node_building: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    """Builds an index of the nodes sorted by (building, floor, x, y), so
+    that a node can be found by binary search (see find_node).
+
+    :return: A dict with the node_order column.
+    """
+    order = np.lexsort((
+        np.asarray(node_y, dtype=np.int64),
+        np.asarray(node_x, dtype=np.int64),
+        np.asarray(node_floor, dtype=np.int64),
+        np.asarray(node_building, dtype=np.int64),
+    ))
+    return {"node_order": order.astype(np.int32)}
+
+
+def find_node(
+        columns: Dict[str, np.ndarray],
+        x: int,
+        y: int,
+        floor: int,
+        building: int,
+) -> Optional[int]:
+    """Finds a node by binary search over the node_order index.
+
+    :param columns: The node_x, node_y, node_floor, node_building and
+           node_order columns.
+    :param x: The x of the node.
+    :param y: The y of the node.
+    :param floor: The index of the node's floor in the floors table.
+    :param building: The index of the node's building in the buildings
+           table.
+    :return: The id of the node, or None if there is no such node.
+    """
+    order = columns["node_order"]
+    key = (building, floor, x, y)
+
+    def node_key(node_id: int):
+        return (
+            int(columns["node_building"][node_id]),
+            int(columns["node_floor"][node_id]),
+            int(columns["node_x"][node_id]),
+            int(columns["node_y"][node_id]),
+        )
+
+    low, high = 0, len(order)
+    while low < high:
+        middle = (low + high) // 2
+        if node_key(order[middle]) < key:
+            low = middle + 1
+        else:
+            high = middle
+    if low < len(order) and node_key(order[low]) == key:
+        return int(order[low])
+    return None
+
+
+def location_values(columns: Dict[str, np.ndarray], name: str) -> List:
+    """The values of the floors or buildings table, with their types
+    (e.g. the floor 0 stays an int).
+
+    :param columns: The graph columns.
+    :param name: "floors" or "buildings".
+    :return: The values, in table order.
+    """
+    if int(columns["format_version"][0]) < _TYPED_LOCATIONS_VERSION:
+        return columns[name].tolist()
+    return [json.loads(value) for value in columns[name].tolist()]
+
+
+def node_tuple(columns: Dict[str, np.ndarray]):
+    """The namedtuple the nodes of the graph were, Node or Node_4d."""
+    if "node_tuple" in columns and str(columns["node_tuple"]) == Node.__name__:
+        return Node
+    return Node_4d
+
+
+def graph_node_tuple(graph: Graph):
+    """The namedtuple of the nodes of a graph, Node or Node_4d (Node_4d for
+    an empty graph).
+
+    :raises ValueError: if the graph mixes them or has other nodes.
+    """
+    node_tuples = {type(node) for node in graph.nodes}
+    if len(node_tuples) > 1 or not node_tuples <= {Node, Node_4d}:
+        raise ValueError(
+            f"graph nodes must be all Node or all Node_4d, not {sorted(t.__name__ for t in node_tuples)}"
+        )
+    return node_tuples.pop() if node_tuples else Node_4d
+
+
+def graph_to_columns(graph: Graph) -> Dict[str, np.ndarray]:
+    """Converts a graph produced by this project into flat numpy columns.
+    Nodes are numbered in graph iteration order. Strings (floors, buildings,
+    room labels, edge types) are stored once in a table and referenced by
+    index, and the remaining DXF attributes of each node are stored as
+    deduplicated JSON strings. CSR indexes for adjacency and room labels,
+    and the nodes sorted by (building, floor, x, y), are included so that readers never have to build them.
+
+    :param graph: A networkx graph whose nodes are all Node or all Node_4d,
+           with `room_label` and `type` attributes. Floors and buildings
+           are stored as JSON, so their types are kept.
+    :return: A dict from column names to numpy arrays.
+    """
+    nodes_tuple = graph_node_tuple(graph)
+    num_nodes = graph.number_of_nodes()
+    node_x = np.empty(num_nodes, dtype=np.int32)
+    node_y = np.empty(num_nodes, dtype=np.int32)
+    node_floor = np.empty(num_nodes, dtype=np.int16)
+    node_building = np.empty(num_nodes, dtype=np.int16)
+    node_type = np.empty(num_nodes, dtype=np.int8)
+    node_label = np.empty(num_nodes, dtype=np.int32)
+    node_details = np.empty(num_nodes, dtype=np.int32)
+
+    floors, buildings, labels, details = {}, {}, {"": 0}, {"{}": 0}
+    node_ids = {}
+    for i, (node, attributes) in enumerate(graph.nodes(data=True)):
+        node_ids[node] = i
+        node_x[i] = node.x
+        node_y[i] = node.y
+        node_floor[i] = intern_value(floors, json.dumps(getattr(node, "floor", "")))
+        node_building[i] = intern_value(buildings, json.dumps(getattr(node, "building", "")))
+        node_type[i] = space_type_code(attributes.get("type"))
+        node_label[i] = intern_value(labels, attributes.get("room_label") or "")
+        remaining = {
+            key: value for key, value in attributes.items()
+            if key not in {"room_label", "type"}
+        }
+        node_details[i] = intern_value(details, json.dumps(remaining, sort_keys=True, default=str))
+
+    num_edges = graph.number_of_edges()
+    edge_u = np.empty(num_edges, dtype=np.int32)
+    edge_v = np.empty(num_edges, dtype=np.int32)
+    edge_weight = np.empty(num_edges, dtype=np.float64)
+    edge_weight2 = np.empty(num_edges, dtype=np.float64)
+    edge_type = np.empty(num_edges, dtype=np.int8)
+    edge_types = {"": 0}
+    for i, (u, v, attributes) in enumerate(graph.edges(data=True)):
+        edge_u[i] = node_ids[u]
+        edge_v[i] = node_ids[v]
+        edge_weight[i] = attributes.get("weight", np.nan)
+        edge_weight2[i] = attributes.get("weight2", np.nan)
+        edge_type[i] = intern_value(edge_types, attributes.get("type", ""))
+
+    columns = {
+        "format_version": np.array([GRAPH_NPZ_VERSION], dtype=np.int32),
+        "node_tuple": np.array(nodes_tuple.__name__),
+        "node_x": node_x,
+        "node_y": node_y,
+        "node_floor": node_floor,
+        "node_building": node_building,
+        "node_type": node_type,
+        "node_label": node_label,
+        "node_details": node_details,
+        "floors": _string_column(floors),
+        "buildings": _string_column(buildings),
+        "labels": _string_column(labels),
+        "details": _string_column(details),
+        "edge_u": edge_u,
+        "edge_v": edge_v,
+        "edge_weight": edge_weight,
+        "edge_weight2": edge_weight2,
+        "edge_type": edge_type,
+        "edge_types": _string_column(edge_types),
+    }
+    columns.update(adjacency_columns(edge_u, edge_v, num_nodes))
+    columns.update(label_columns(node_label, len(labels)))
+    columns.update(node_key_columns(node_x, node_y, node_floor, node_building))
+    return columns
+
+
+def write_graph_npz(graph: Graph, filepath: str):
+    """Saves a graph in the binary columnar format (an uncompressed .npz
+    archive, see graph_to_columns), which loads orders of magnitude faster
+    than the yaml output and can be memory-mapped.
+
+    :param graph: The graph to save.
+    :param filepath: Name of the output file.
+    """
+    with open(filepath, "wb") as outfile:
+        np.savez(outfile, **graph_to_columns(graph))
+
+
+def _memmap_npz_member(filepath: str, info: zipfile.ZipInfo) -> np.ndarray:
+    """Memory-maps a single array stored (uncompressed) inside an npz file.
+
+    :param filepath: Path to the npz file.
+    :param info: The zip entry of the array.
+    :return: A read-only numpy memmap of the array.
+    """
+    with open(filepath, "rb") as npz_file:
+        npz_file.seek(info.header_offset)
+        local_header = npz_file.read(_ZIP_LOCAL_HEADER_SIZE)
+        name_length, extra_length = struct.unpack(
+            "<HH",
+            local_header[_ZIP_NAME_LENGTH_OFFSET:_ZIP_LOCAL_HEADER_SIZE],
+        )
+        npz_file.seek(info.header_offset + _ZIP_LOCAL_HEADER_SIZE + name_length + extra_length)
+        version = np.lib.format.read_magic(npz_file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(npz_file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(npz_file)
+        offset = npz_file.tell()
+
+    return np.memmap(
+        filepath,
+        dtype=dtype,
+        mode="r",
+        shape=shape,
+        offset=offset,
+        order="F" if fortran_order else "C",
+    )
+
+
+def load_graph_columns(filepath: str, mmap: bool=True) -> Dict[str, np.ndarray]:
+    """Loads the columns written by write_graph_npz.
+
+    :param filepath: Path to the npz file.
+    :param mmap: If True, numeric columns are memory-mapped instead of read,
+           so that processes loading the same file share its pages.
+    :return: A dict from column names to numpy arrays.
+    """
+    columns = {}
+    with zipfile.ZipFile(filepath) as archive:
+        for info in archive.infolist():
+            name = info.filename[:-len(".npy")]
+            if mmap and info.compress_type == zipfile.ZIP_STORED and info.file_size:
+                array = _memmap_npz_member(filepath, info)
+                if array.size and array.dtype.kind in "biuf":
+                    columns[name] = array
+                    continue
+            with archive.open(info) as member:
+                columns[name] = np.lib.format.read_array(member, allow_pickle=False)
+
+    if int(columns["format_version"][0]) > GRAPH_NPZ_VERSION:
+        raise ValueError(f"{filepath} uses an unsupported graph format version")
+    return columns
+
+
+def columns_to_graph(columns: Dict[str, np.ndarray]) -> Graph:
+    """Rebuilds a networkx graph (with Node_4d nodes) from graph columns.
+
+    :param columns: The columns produced by graph_to_columns.
+    :return: The networkx graph.
+    """
+    floors = location_values(columns, "floors")
+    buildings = location_values(columns, "buildings")
+    labels = columns["labels"].tolist()
+    details = [json.loads(entry) for entry in columns["details"].tolist()]
+    edge_types = columns["edge_types"].tolist()
+
+    if node_tuple(columns) is Node:
+        nodes = [Node(x=x, y=y) for x, y in zip(columns["node_x"].tolist(), columns["node_y"].tolist())]
+    else:
+        nodes = [
+            Node_4d(x=x, y=y, floor=floors[floor], building=buildings[building])
+            for x, y, floor, building in zip(
+                columns["node_x"].tolist(),
+                columns["node_y"].tolist(),
+                columns["node_floor"].tolist(),
+                columns["node_building"].tolist(),
+            )
+        ]
+
+    graph = Graph()
+    for node, space_type, label, detail in zip(
+            nodes,
+            columns["node_type"].tolist(),
+            columns["node_label"].tolist(),
+            columns["node_details"].tolist(),
+    ):
+        graph.add_node(
+            node,
+            **details[detail],
+            room_label=labels[label],
+            type=space_type_from_code(space_type),
+        )
+
+    for u, v, weight, weight2, edge_type in zip(
+            columns["edge_u"].tolist(),
+            columns["edge_v"].tolist(),
+            columns["edge_weight"].tolist(),
+            columns["edge_weight2"].tolist(),
+            columns["edge_type"].tolist(),
+    ):
+        graph.add_edge(nodes[u], nodes[v], **edge_attributes_from_columns(weight, weight2, edge_types[edge_type]))
+    return graph
+
+
+class GraphColumnsReader:
+    """The accessors shared by the graphs read from graph columns
+    (MappedGraph and InternedGraph), which refer to nodes and edges by
+    their integer ids.
+
+    Subclasses set `columns` (with the node, edge, adjacency and label
+    index columns of graph_to_columns), `labels` and `edge_types` (the
+    tables as lists) and `_label_ids` (from labels to their index), and
+    implement _node_details.
+    """
+
+    def _node_details(self, details_id: int) -> Mapping:
+        """The DXF attributes of the nodes with this details id."""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        return self.number_of_nodes()
+
+    def number_of_nodes(self) -> int:
+        return len(self.columns["node_x"])
+
+    def number_of_edges(self) -> int:
+        return len(self.columns["edge_u"])
+
+    def room_label(self, node_id: int) -> str:
+        return self.labels[self.columns["node_label"][node_id]]
+
+    def space_type(self, node_id: int) -> Optional[SpaceType]:
+        return space_type_from_code(int(self.columns["node_type"][node_id]))
+
+    def node_attributes(self, node_id: int) -> Dict:
+        """Returns the attribute dict the node had in the networkx graph:
+        the DXF details plus room_label and type."""
+        attributes = dict(self._node_details(int(self.columns["node_details"][node_id])))
+        attributes["room_label"] = self.room_label(node_id)
+        attributes["type"] = self.space_type(node_id)
+        return attributes
+
+    def nodes_with_room_label(self, room_label: str) -> np.ndarray:
+        """Returns the ids of all nodes with the given room label, in node
+        order.
+
+        :param room_label: The room label to look up.
+        :return: An array of node ids (empty if the label is unknown).
+        """
+        label_id = self._label_ids.get(room_label)
+        if label_id is None:
+            return np.zeros(0, dtype=np.int32)
+        start, end = self.columns["label_indptr"][label_id:label_id+2]
+        return self.columns["label_nodes"][start:end]
+
+    def adjacency(self, node_id: int) -> Iterator[Tuple[int, int]]:
+        """Iterates over (neighbour id, edge id) pairs of a node."""
+        start, end = self.columns["adj_indptr"][node_id:node_id+2]
+        return zip(
+            self.columns["adj_indices"][start:end].tolist(),
+            self.columns["adj_edges"][start:end].tolist(),
+        )
+
+    def neighbors(self, node_id: int) -> np.ndarray:
+        """Returns the ids of the neighbours of a node."""
+        start, end = self.columns["adj_indptr"][node_id:node_id+2]
+        return self.columns["adj_indices"][start:end]
+
+    def degree(self, node_id: int) -> int:
+        start, end = self.columns["adj_indptr"][node_id:node_id+2]
+        return int(end - start)
+
+    def edge(self, edge_id: int) -> Tuple[int, int]:
+        """Returns the node ids of the endpoints of an edge."""
+        return int(self.columns["edge_u"][edge_id]), int(self.columns["edge_v"][edge_id])
+
+    def edge_attributes(self, edge_id: int) -> Dict:
+        """Returns the attribute dict the edge had in the networkx graph."""
+        return edge_attributes_from_columns(
+            float(self.columns["edge_weight"][edge_id]),
+            float(self.columns["edge_weight2"][edge_id]),
+            self.edge_types[self.columns["edge_type"][edge_id]],
+        )
+
+    def edge_weights(self, weight: str='weight') -> np.ndarray:
+        """Returns the weight column of all edges. As in networkx, edges
+        without the attribute have weight 1.
+
+        :param weight: 'weight' or 'weight2'.
+        :return: A float array indexed by edge id.
+        """
+        weights = np.asarray(self.columns[f"edge_{weight}"])
+        return np.where(np.isnan(weights), 1.0, weights)
+
+
+def read_graph_npz(filepath: str) -> Graph:
+    """Loads a graph saved with write_graph_npz as a networkx graph.
+
+    :param filepath: Path to the npz file.
+    :return: The networkx graph.
+    """
+    return columns_to_graph(load_graph_columns(filepath, mmap=False))
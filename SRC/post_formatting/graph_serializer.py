@@ -1,40 +1,31 @@
 from networkx import Graph
-from networkx import empty_graph
+from networkx import relabel_nodes
 
+from graph.room_label_index import invalidate_room_label_index
 from util.data_containers import Node_4d
 
 
-def make_graph_serializable(graph: Graph) -> Graph:
+def make_graph_serializable(graph: Graph, copy: bool=True) -> Graph:
     """Makes the networkx graphs serializable so that they can be stored
     in a variety of ways.
 
     :param graph: a network x graph
+    :param copy: If False, the nodes of graph are relabelled in place
+           instead of in a copy.
     :return: a serializable networkx graph
     """
-    serializable_graph = empty_graph()
-    for node in graph.nodes:
-        new_node_name = f"{node.x}-{node.y}"
-        serializable_graph.add_node(
-            new_node_name,
-            **graph.nodes[node],
-        )
-
-    for edge in graph.edges:
-        u, v = edge[0], edge[1]
-        source = f"{u.x}-{u.y}"
-        dest = f"{v.x}-{v.y}"
-        serializable_graph.add_edge(
-            source,
-            dest,
-            **graph.edges[edge],
-        )
-    return serializable_graph
+    mapping = {node: f"{node.x}-{node.y}" for node in graph.nodes}
+    relabelled_graph = relabel_nodes(graph, mapping, copy=copy)
+    if not copy:
+        invalidate_room_label_index(graph)
+    return relabelled_graph
 
 
 def make_4d_nodes(
         graph: Graph,
         floor: str,
         building: str,
+        copy: bool=True,
 ) ->  Graph:
     """Change the nodes in the graph so that they have a component for their
     floor and building as well. This is done so that multiple graphs can be
@@ -44,39 +35,16 @@ def make_4d_nodes(
            x and y values
     :param floor: the floor for this graph.
     :param building: the building for this graph.
+    :param copy: If False, the nodes of graph are relabelled in place
+           instead of in a copy.
     :return: a network x graph where the nodes have floor and building as well
              as the x and y coords
     """
-    graph_4d = Graph()
-    for node in graph.nodes:
-        new_node = Node_4d(
-            x=node.x,
-            y=node.y,
-            building=building,
-            floor=floor,
-        )
-        graph_4d.add_node(
-            new_node,
-            **graph.nodes[node],
-        )
-
-    for edge in graph.edges:
-        u, v = edge[0], edge[1]
-        source = Node_4d(
-            x=u.x,
-            y=u.y,
-            building=building,
-            floor=floor,
-        )
-        dest = Node_4d(
-            x=v.x,
-            y=v.y,
-            building=building,
-            floor=floor,
-        )
-        graph_4d.add_edge(
-            source,
-            dest,
-            **graph.edges[edge],
-        )
-    return graph_4d
+    mapping = {
+        node: Node_4d(x=node.x, y=node.y, building=building, floor=floor)
+        for node in graph.nodes
+    }
+    relabelled_graph = relabel_nodes(graph, mapping, copy=copy)
+    if not copy:
+        invalidate_room_label_index(graph)
+    return relabelled_graph
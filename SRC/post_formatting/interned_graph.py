@@ -0,0 +1,306 @@
+import json
+import sys
+from types import MappingProxyType
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+import numpy as np
+from networkx import Graph
+
+from post_formatting.graph_npz import GraphColumnsReader
+from post_formatting.graph_npz import adjacency_columns
+from post_formatting.graph_npz import find_node
+from post_formatting.graph_npz import graph_node_tuple
+from post_formatting.graph_npz import intern_value
+from post_formatting.graph_npz import label_columns
+from post_formatting.graph_npz import load_graph_columns
+from post_formatting.graph_npz import location_values
+from post_formatting.graph_npz import node_key_columns
+from post_formatting.graph_npz import node_tuple
+from post_formatting.graph_npz import space_type_code
+from util.data_containers import Node
+from util.data_containers import Node_4d
+
+_NODE_COLUMNS = ("node_x", "node_y", "node_type", "node_label", "node_details")
+_EDGE_COLUMNS = ("edge_u", "edge_v", "edge_weight", "edge_weight2", "edge_type")
+
+
+class InternedGraph(GraphColumnsReader):
+    """A compact in-memory form of the output graphs, for tools that load
+    whole floors or buildings to look up rooms and walk the graph (e.g.
+    canonical_room_names).
+
+    Nodes and edges are the integer ids 0..n-1 and 0..m-1, everything else
+    is a numpy column indexed by them, as in graph_npz:
+
+    - node_x, node_y: the coordinates of the nodes.
+    - node_location: the index of the (floor, building) pair of every node
+      in locations, so every pair is stored once.
+    - node_type: the SpaceType value, -1 if unknown.
+    - node_label: the index of the room label in labels (interned strings).
+    - node_details: the index of the remaining DXF attributes in details, a
+      read-only mapping shared by all nodes with equal details (i.e. the
+      nodes of a room).
+    - edge_u, edge_v, edge_weight, edge_weight2 (NaN if the edge had none)
+      and edge_type, the index of the edge type in edge_types.
+    - adj_indptr, adj_indices, adj_edges: the CSR adjacency of
+      graph_npz.adjacency_columns, and label_indptr, label_nodes: the nodes
+      of every label.
+
+    The node and edge accessors are those of GraphColumnsReader, shared
+    with MappedGraph. node_tuple is the namedtuple the nodes were, Node or Node_4d, which node
+    and to_graph return. `graph` builds a networkx graph on the node ids for
+    networkx algorithms when it is first used (see the property).
+    """
+
+    def __init__(
+            self,
+            columns: Dict[str, np.ndarray],
+            locations: List[Tuple],
+            labels: List[str],
+            details: List[MappingProxyType],
+            edge_types: List[str],
+            nodes_tuple=Node_4d,
+    ):
+        self.columns = columns
+        self.locations = locations
+        self.labels = labels
+        self.details = details
+        self.edge_types = edge_types
+        self.node_tuple = nodes_tuple
+        self._label_ids = {label: i for i, label in enumerate(labels)}
+        self._location_ids = None
+        self._keys = None
+        self._graph = None
+
+    @classmethod
+    def from_graph(cls, graph: Graph):
+        """Interns a graph produced by this project. Nodes and edges are
+        numbered in graph iteration order, as in graph_npz.
+
+        :param graph: A networkx graph whose nodes are all Node or all
+               Node_4d, with `room_label` and `type` attributes.
+        :return: The InternedGraph.
+        """
+        nodes_tuple = graph_node_tuple(graph)
+        num_nodes = graph.number_of_nodes()
+        columns = {
+            "node_x": np.empty(num_nodes, dtype=np.int32),
+            "node_y": np.empty(num_nodes, dtype=np.int32),
+            "node_location": np.empty(num_nodes, dtype=np.int16),
+            "node_type": np.empty(num_nodes, dtype=np.int8),
+            "node_label": np.empty(num_nodes, dtype=np.int32),
+            "node_details": np.empty(num_nodes, dtype=np.int32),
+        }
+        locations, labels, details_table = {}, {"": 0}, {}
+        details = []
+        node_ids = {}
+        for i, (node, attributes) in enumerate(graph.nodes(data=True)):
+            node_ids[node] = i
+            columns["node_x"][i] = node.x
+            columns["node_y"][i] = node.y
+            columns["node_location"][i] = intern_value(
+                locations,
+                (getattr(node, "floor", ""), getattr(node, "building", "")),
+            )
+            columns["node_type"][i] = space_type_code(attributes.get("type"))
+            columns["node_label"][i] = intern_value(labels, attributes.get("room_label") or "")
+            remaining = {
+                key: value for key, value in attributes.items()
+                if key not in {"room_label", "type"}
+            }
+            details_id = intern_value(details_table, json.dumps(remaining, sort_keys=True, default=str))
+            if details_id == len(details):
+                details.append(MappingProxyType(remaining))
+            columns["node_details"][i] = details_id
+
+        num_edges = graph.number_of_edges()
+        columns.update({
+            "edge_u": np.empty(num_edges, dtype=np.int32),
+            "edge_v": np.empty(num_edges, dtype=np.int32),
+            "edge_weight": np.empty(num_edges, dtype=np.float64),
+            "edge_weight2": np.empty(num_edges, dtype=np.float64),
+            "edge_type": np.empty(num_edges, dtype=np.int8),
+        })
+        edge_types = {"": 0}
+        for i, (u, v, attributes) in enumerate(graph.edges(data=True)):
+            columns["edge_u"][i] = node_ids[u]
+            columns["edge_v"][i] = node_ids[v]
+            columns["edge_weight"][i] = attributes.get("weight", np.nan)
+            columns["edge_weight2"][i] = attributes.get("weight2", np.nan)
+            columns["edge_type"][i] = intern_value(edge_types, attributes.get("type", ""))
+        columns.update(adjacency_columns(columns["edge_u"], columns["edge_v"], num_nodes))
+        columns.update(label_columns(columns["node_label"], len(labels)))
+
+        return cls(
+            columns,
+            list(locations),
+            [sys.intern(label) for label in labels],
+            details,
+            [sys.intern(edge_type) for edge_type in edge_types],
+            nodes_tuple,
+        )
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, np.ndarray]):
+        """Builds an InternedGraph from graph_npz columns, without creating
+        any Node_4d.
+
+        :param columns: The columns produced by graph_to_columns.
+        :return: The InternedGraph.
+        """
+        floors = location_values(columns, "floors")
+        buildings = location_values(columns, "buildings")
+        locations = {}
+        location_ids = {}
+        node_floor = columns["node_floor"].tolist()
+        node_building = columns["node_building"].tolist()
+        for pair in set(zip(node_floor, node_building)):
+            location_ids[pair] = intern_value(locations, (floors[pair[0]], buildings[pair[1]]))
+
+        interned_columns = {name: np.array(columns[name]) for name in _NODE_COLUMNS + _EDGE_COLUMNS}
+        interned_columns["node_location"] = np.array(
+            [location_ids[pair] for pair in zip(node_floor, node_building)],
+            dtype=np.int16,
+        )
+        labels = [sys.intern(label) for label in columns["labels"].tolist()]
+        if "adj_indptr" in columns:
+            for name in ("adj_indptr", "adj_indices", "adj_edges", "label_indptr", "label_nodes"):
+                interned_columns[name] = np.array(columns[name])
+        else:
+            # files written before format version 2 have no indexes
+            interned_columns.update(adjacency_columns(
+                interned_columns["edge_u"], interned_columns["edge_v"], len(node_floor),
+            ))
+            interned_columns.update(label_columns(interned_columns["node_label"], len(labels)))
+
+        return cls(
+            interned_columns,
+            list(locations),
+            labels,
+            [MappingProxyType(json.loads(entry)) for entry in columns["details"].tolist()],
+            [sys.intern(edge_type) for edge_type in columns["edge_types"].tolist()],
+            node_tuple(columns),
+        )
+
+    def node(self, node_id: int):
+        """Returns the node (a Node_4d, or a Node if the graph had 2d nodes)
+        for a node id."""
+        if self.node_tuple is Node:
+            return Node(
+                x=int(self.columns["node_x"][node_id]),
+                y=int(self.columns["node_y"][node_id]),
+            )
+        floor, building = self.locations[self.columns["node_location"][node_id]]
+        return Node_4d(
+            x=int(self.columns["node_x"][node_id]),
+            y=int(self.columns["node_y"][node_id]),
+            floor=floor,
+            building=building,
+        )
+
+    def node_id(self, node: Node_4d) -> int:
+        """Finds the id of a node by binary search over a node index, which
+        is built on first use.
+
+        :param node: The node to look up.
+        :return: The integer id of the node.
+        :raises KeyError: if the node is not in the graph.
+        """
+        if self._keys is None:
+            self._location_ids = {location: i for i, location in enumerate(self.locations)}
+            self._keys = {
+                "node_x": self.columns["node_x"],
+                "node_y": self.columns["node_y"],
+                "node_floor": np.zeros(len(self), dtype=np.int64),
+                "node_building": self.columns["node_location"],
+            }
+            self._keys.update(node_key_columns(**self._keys))
+        location = (getattr(node, "floor", ""), getattr(node, "building", ""))
+        if location not in self._location_ids:
+            raise KeyError(node)
+        node_id = find_node(self._keys, int(node.x), int(node.y), 0, self._location_ids[location])
+        if node_id is None:
+            raise KeyError(node)
+        return node_id
+
+    def _node_details(self, details_id: int) -> MappingProxyType:
+        return self.details[details_id]
+
+    def edge_id(self, u: int, v: int) -> int:
+        """Returns the id of the edge between two nodes, by a scan of the
+        neighbours of u. The edges of `graph` carry their id.
+
+        :raises KeyError: if there is no such edge.
+        """
+        for neighbour, edge_id in self.adjacency(u):
+            if neighbour == v:
+                return edge_id
+        raise KeyError((u, v))
+
+    def weight(self, weight: str='weight') -> Callable[[int, int, Dict], float]:
+        """Returns a weight function for networkx algorithms run on `graph`,
+        e.g. shortest_path(interned.graph, u, v, weight=interned.weight(
+        'weight2')). As in networkx, edges without the attribute have
+        weight 1.
+
+        :param weight: 'weight' or 'weight2'.
+        """
+        weights = self.edge_weights(weight).tolist()
+        # the edges of `graph` carry their id, so this is a list lookup
+        return lambda u, v, attributes: weights[attributes["id"]]
+
+    @property
+    def graph(self) -> Graph:
+        """A networkx graph on the node ids, built on first use. Its nodes
+        have the attributes room_label, type (the SpaceType value) and
+        details (the shared read-only mapping), its edges only their edge
+        id, as `id`, which weight uses. It takes several times the
+        memory of the columns."""
+        if self._graph is None:
+            graph = Graph()
+            graph.add_nodes_from(
+                (i, {"room_label": self.labels[label], "type": space_type, "details": self.details[details]})
+                for i, (label, space_type, details) in enumerate(zip(
+                    self.columns["node_label"].tolist(),
+                    self.columns["node_type"].tolist(),
+                    self.columns["node_details"].tolist(),
+                ))
+            )
+            graph.add_edges_from(
+                (u, v, {"id": i})
+                for i, (u, v) in enumerate(zip(self.columns["edge_u"].tolist(), self.columns["edge_v"].tolist()))
+            )
+            self._graph = graph
+        return self._graph
+
+    def to_graph(self) -> Graph:
+        """Expands the graph back into a networkx graph with the original
+        nodes (Node or Node_4d) and node and edge attributes.
+
+        :return: The networkx graph.
+        """
+        nodes = [self.node(i) for i in range(len(self))]
+        graph = Graph()
+        graph.add_nodes_from(
+            (nodes[i], self.node_attributes(i)) for i in range(len(self))
+        )
+        graph.add_edges_from(
+            (nodes[u], nodes[v], self.edge_attributes(i))
+            for i, (u, v) in enumerate(zip(
+                self.columns["edge_u"].tolist(),
+                self.columns["edge_v"].tolist(),
+            ))
+        )
+        return graph
+
+
+def read_interned_graph_npz(filepath: str) -> InternedGraph:
+    """Loads a graph saved with write_graph_npz as an InternedGraph.
+
+    :param filepath: Path to the npz file.
+    :return: The InternedGraph.
+    """
+    return InternedGraph.from_columns(load_graph_columns(filepath, mmap=False))
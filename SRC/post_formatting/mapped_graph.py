@@ -0,0 +1,92 @@
+import json
+from typing import Dict
+from typing import Mapping
+
+from post_formatting.graph_npz import GraphColumnsReader
+from post_formatting.graph_npz import adjacency_columns
+from post_formatting.graph_npz import find_node
+from post_formatting.graph_npz import label_columns
+from post_formatting.graph_npz import load_graph_columns
+from post_formatting.graph_npz import location_values
+from post_formatting.graph_npz import node_key_columns
+from post_formatting.graph_npz import node_tuple
+from util.data_containers import Node
+from util.data_containers import Node_4d
+
+
+class MappedGraph(GraphColumnsReader):
+    """A read-only graph backed by a memory-mapped .npz file written by
+    post_formatting.graph_npz.write_graph_npz. Nodes and edges are referred
+    to by their integer ids in the file, and no networkx graph is built, so
+    worker processes that open the same file share its pages instead of
+    each holding a private copy of the graph.
+    """
+
+    def __init__(self, filepath: str, mmap: bool=True):
+        self.filepath = filepath
+        self.columns = load_graph_columns(filepath, mmap=mmap)
+        num_nodes = len(self.columns["node_x"])
+        if "adj_indptr" not in self.columns:
+            # files written before format version 2 have no indexes
+            self.columns.update(adjacency_columns(
+                self.columns["edge_u"], self.columns["edge_v"], num_nodes,
+            ))
+            self.columns.update(label_columns(
+                self.columns["node_label"], len(self.columns["labels"]),
+            ))
+            self.columns.update(node_key_columns(
+                self.columns["node_x"], self.columns["node_y"],
+                self.columns["node_floor"], self.columns["node_building"],
+            ))
+
+        self.floors = location_values(self.columns, "floors")
+        self.buildings = location_values(self.columns, "buildings")
+        self.node_tuple = node_tuple(self.columns)
+        # older files have the str() of the floors and buildings
+        self._stringified_locations = int(self.columns["format_version"][0]) < 3
+        self.labels = self.columns["labels"].tolist()
+        self.edge_types = self.columns["edge_types"].tolist()
+        self._label_ids = {label: i for i, label in enumerate(self.labels)}
+        self._floor_ids = {floor: i for i, floor in enumerate(self.floors)}
+        self._building_ids = {building: i for i, building in enumerate(self.buildings)}
+        self._details = {}
+
+    def node(self, node_id: int):
+        """Returns the node (a Node_4d, or a Node if the graph had 2d nodes)
+        for a node id."""
+        if self.node_tuple is Node:
+            return Node(
+                x=int(self.columns["node_x"][node_id]),
+                y=int(self.columns["node_y"][node_id]),
+            )
+        return Node_4d(
+            x=int(self.columns["node_x"][node_id]),
+            y=int(self.columns["node_y"][node_id]),
+            floor=self.floors[self.columns["node_floor"][node_id]],
+            building=self.buildings[self.columns["node_building"][node_id]],
+        )
+
+    def _location_id(self, ids: Dict, value) -> int:
+        return ids[str(value) if self._stringified_locations else value]
+
+    def node_id(self, node: Node_4d) -> int:
+        """Finds the id of a node by binary search over the node index.
+
+        :param node: The node to look up.
+        :return: The integer id of the node.
+        :raises KeyError: if the node is not in the graph.
+        """
+        try:
+            floor = self._location_id(self._floor_ids, getattr(node, "floor", ""))
+            building = self._location_id(self._building_ids, getattr(node, "building", ""))
+        except (KeyError, TypeError):
+            raise KeyError(node)
+        node_id = find_node(self.columns, int(node.x), int(node.y), floor, building)
+        if node_id is None:
+            raise KeyError(node)
+        return node_id
+
+    def _node_details(self, details_id: int) -> Mapping:
+        if details_id not in self._details:
+            self._details[details_id] = json.loads(self.columns["details"][details_id])
+        return self._details[details_id]
@@ -32,4 +32,10 @@ SPARSITY_LEVEL = 8
 DELETE_LINE_SIZE = 10
 OUTSIDE_COLOR = 3
 MIN_COMPONENT_SIZE = 30
+# skeleton graphs only have nodes at junctions, ends and labels, a whole
+# floor can have fewer than MIN_COMPONENT_SIZE of them
+MIN_SKELETON_COMPONENT_SIZE = 4
 GRID_RATIO = 4
+# weights of the stair and elevator edges between consecutive floors
+VERTICAL_EDGE_WEIGHT = 1
+VERTICAL_EDGE_WEIGHT2 = 1000
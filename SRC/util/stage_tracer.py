@@ -0,0 +1,212 @@
+import json
+import logging
+import re
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict
+from typing import List
+from typing import Optional
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# ru_maxrss is in kilobytes on linux and in bytes on macOS
+_MAXRSS_BYTES = 1 if sys.platform == "darwin" else 1024
+
+
+_STATUS_FILEPATH = "/proc/self/status"
+_CLEAR_REFS_FILEPATH = "/proc/self/clear_refs"
+# writing this to clear_refs resets the peak resident set size (VmHWM)
+_RESET_PEAK_RSS = "5"
+
+
+def _max_rss() -> int:
+    """The peak resident set size of this process over its whole life, in
+    bytes."""
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_BYTES
+
+
+def _peak_rss() -> Optional[int]:
+    """The peak resident set size of this process since it was last reset
+    by _reset_peak_rss, in bytes, or None where it is not available."""
+    try:
+        with open(_STATUS_FILEPATH) as status_file:
+            match = re.search(r"VmHWM:\s+(\d+) kB", status_file.read())
+    except OSError:
+        return None
+    return int(match.group(1)) * 1024 if match else None
+
+
+def _reset_peak_rss() -> bool:
+    """Resets the peak resident set size to the current one (linux only).
+
+    :return: True if it was reset.
+    """
+    try:
+        with open(_CLEAR_REFS_FILEPATH, "w") as clear_refs_file:
+            clear_refs_file.write(_RESET_PEAK_RSS)
+    except OSError:
+        return False
+    return True
+
+
+class StageTracer:
+    """Records the wall time, cpu time, peak memory and item counts of the
+    (nested) stages of a conversion.
+
+    peak_rss is the peak resident set size of the process during the
+    stage, which needs linux, where it can be reset when a stage starts.
+    Elsewhere only max_rss, the peak over the life of the process so far, is
+    recorded. If trace_memory is True, traced_peak, the peak of the memory
+    allocated by python during the stage, is also recorded with tracemalloc,
+    which slows the conversion down considerably. tracemalloc is stopped
+    when the outermost stage ends, if the tracer started it.
+
+    A stage that raises is recorded with the exception as `error`.
+    """
+
+    def __init__(self, name: str, trace_memory: bool=False):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.stages = []
+        self._open_stages = []
+        self._start = time.perf_counter()
+        self._started_tracemalloc = False
+
+    @contextmanager
+    def stage(self, name: str):
+        """Traces the stage run in the with block. The yielded dict can be
+        filled with item counts, e.g. `counts["nodes"] = len(graph)`.
+
+        :param name: The name of the stage.
+        """
+        counts = {}
+        record = {
+            "name": name,
+            "depth": len(self._open_stages),
+            "start": time.perf_counter() - self._start,
+            "counts": counts,
+        }
+        self.stages.append(record)
+        # the peaks are reset for every stage, so the peaks reached so far
+        # go to the enclosing stage first
+        peak_rss = _peak_rss()
+        if peak_rss is not None:
+            self._update_parent_peak("peak_rss", peak_rss)
+            if _reset_peak_rss():
+                record["peak_rss"] = 0
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            self._update_parent_peak("traced_peak", tracemalloc.get_traced_memory()[1])
+            record["traced_peak"] = 0
+            _reset_traced_peak()
+        self._open_stages.append(record)
+        cpu_start = time.process_time()
+        try:
+            yield counts
+        except BaseException as error:
+            record["error"] = repr(error)
+            raise
+        finally:
+            record["wall"] = time.perf_counter() - self._start - record["start"]
+            record["cpu"] = time.process_time() - cpu_start
+            record["max_rss"] = _max_rss()
+            self._open_stages.pop()
+            if "peak_rss" in record:
+                record["peak_rss"] = max(record["peak_rss"], _peak_rss() or 0)
+                self._update_parent_peak("peak_rss", record["peak_rss"])
+            if "traced_peak" in record:
+                record["traced_peak"] = max(record["traced_peak"], tracemalloc.get_traced_memory()[1])
+                self._update_parent_peak("traced_peak", record["traced_peak"])
+            if not self._open_stages and self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+            logging.debug(f"{name}: {record['wall']:.3f}s wall, {record['cpu']:.3f}s cpu, {counts}")
+
+    def _update_parent_peak(self, key: str, peak: int):
+        if self._open_stages and key in self._open_stages[-1]:
+            parent = self._open_stages[-1]
+            parent[key] = max(parent[key], peak)
+
+    def report(self) -> Dict:
+        """Returns the recorded stages, in the order they started."""
+        return {
+            "name": self.name,
+            "wall": time.perf_counter() - self._start,
+            "stages": self.stages,
+        }
+
+    def write_json(self, filepath: str):
+        with open(filepath, "w") as outfile:
+            json.dump(self.report(), outfile, indent=2, default=str)
+
+    def chrome_trace_events(self) -> List[Dict]:
+        """Returns the stages as complete ("X") events of the Chrome trace
+        event format, viewable in chrome://tracing or Perfetto."""
+        events = []
+        for stage in self.stages:
+            args = dict(stage["counts"], cpu=stage.get("cpu"), max_rss=stage.get("max_rss"))
+            for key in ("peak_rss", "traced_peak", "error"):
+                if key in stage:
+                    args[key] = stage[key]
+            events.append({
+                "name": stage["name"],
+                "cat": self.name,
+                "ph": "X",
+                "ts": stage["start"] * 1e6,
+                "dur": stage.get("wall", 0) * 1e6,
+                "pid": 1,
+                "tid": 1,
+                "args": args,
+            })
+        return events
+
+    def write_chrome_trace(self, filepath: str):
+        with open(filepath, "w") as outfile:
+            json.dump({"traceEvents": self.chrome_trace_events()}, outfile, default=str)
+
+
+def _reset_traced_peak():
+    # tracemalloc.reset_peak only exists from python 3.9, before that the
+    # traced peak of a stage includes the peak of the stages before it
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+
+
+_active_tracer = None
+
+
+@contextmanager
+def active_tracer(tracer: StageTracer):
+    """Makes tracer record the trace_stage calls of the with block."""
+    global _active_tracer
+    previous = _active_tracer
+    _active_tracer = tracer
+    try:
+        yield tracer
+    finally:
+        _active_tracer = previous
+
+
+@contextmanager
+def trace_stage(name: str):
+    """Traces a pipeline stage with the active tracer, if there is one.
+    Without an active tracer this does nothing, so pipeline code can always
+    be wrapped in it.
+
+    :param name: The name of the stage.
+    :return: A dict to put item counts in.
+    """
+    if _active_tracer is None:
+        yield {}
+    else:
+        with _active_tracer.stage(name) as counts:
+            yield counts